@@ -0,0 +1,193 @@
+# extractor/batch.py
+"""
+Headless batch extraction over a directory of documents.
+
+    python -m extractor.batch test/ --out results.jsonl --ocr-workers 4 --llm-workers 8
+
+OCR runs in a process pool and feeds an LLM thread pool as each document finishes,
+so both stages stay busy. At most ocr_workers + 2 * llm_workers documents are in
+flight at once: a new document enters OCR only when one leaves the pipeline, so
+memory stays flat however long the backlog is. One JSON line is appended per document as soon as it is
+done; re-running with the same --out skips documents already recorded as "ok",
+so a crashed run resumes where it stopped.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Optional, Set
+
+from extractor import metrics
+from extractor.pipeline import find_documents
+
+
+def completed_documents(out_path: str) -> Set[str]:
+    """Documents already extracted successfully in a previous (possibly crashed) run."""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, "r", encoding="utf-8") as fh:
+        for line in fh:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from a crash
+            if rec.get("status") == "ok":
+                done.add(rec.get("file"))
+    return done
+
+
+def _ocr_job(directory: str, rel_path: str, collect_metrics: bool = False) -> Dict:
+    # Runs in a pool process: read the document there instead of pickling its bytes over
+    from extractor.pipeline import ocr_job, guess_mime_type
+
+    with open(os.path.join(directory, rel_path), "rb") as fh:
+        data = fh.read()
+    return ocr_job(data, guess_mime_type(rel_path), collect_metrics)
+
+
+def _extract_job(ocr: Dict, expected_fields, n_consistency, cache, token_format, max_runs=None,
+                 requery="full", chunk_chars=None, table_items=False, rules=False) -> Dict:
+    from extractor.pipeline import extract_stage
+
+    t0 = time.perf_counter()
+    out = extract_stage(ocr, expected_fields=expected_fields, n_consistency=n_consistency,
+                        cache=cache, token_format=token_format, max_runs=max_runs,
+                        requery=requery, chunk_chars=chunk_chars, table_items=table_items, rules=rules)
+    out["llm_s"] = round(time.perf_counter() - t0, 3)
+    return out
+
+
+def run_batch(directory: str, out_path: str, ocr_workers: Optional[int] = None, llm_workers: int = 4,
+              expected_fields: Optional[List[str]] = None, n_consistency: int = 3, cache=None,
+              token_format: str = "compact", resume: bool = True, max_runs: Optional[int] = None,
+              requery: str = "full", chunk_chars: Optional[int] = None, table_items: bool = False,
+              rules: bool = False) -> Dict:
+    """Run the full pipeline over every document in `directory`, appending JSONL to `out_path`."""
+    docs = find_documents(directory)
+    done = completed_documents(out_path) if resume else set()
+    todo = [d for d in docs if d not in done]
+    stats = {"total": len(docs), "skipped": len(docs) - len(todo), "ok": 0, "error": 0}
+    if not todo:
+        stats["elapsed_s"] = 0.0
+        stats["docs_per_min"] = 0.0
+        return stats
+
+    t_start = time.perf_counter()
+    mode = "a" if resume else "w"
+    with open(out_path, mode, encoding="utf-8") as out, \
+            ProcessPoolExecutor(max_workers=ocr_workers) as ocr_pool, \
+            ThreadPoolExecutor(max_workers=llm_workers) as llm_pool:
+
+        def write(record):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()  # a crash loses at most the document in flight
+            stats[record["status"]] += 1
+            print(f"[BATCH] {record['status']:5s} {record['file']}", file=sys.stderr)
+
+        meta = {}
+        pending = set()
+        collect = metrics.enabled()
+        # Finished OCR results wait for the LLM pool; bounding the documents in flight
+        # keeps that queue (and its TokenTables) from growing with the backlog
+        window = (ocr_workers or os.cpu_count() or 1) + 2 * llm_workers
+        queue = iter(todo)
+
+        def fill():
+            while len(pending) < window:
+                rel = next(queue, None)
+                if rel is None:
+                    return
+                fut = ocr_pool.submit(_ocr_job, directory, rel, collect)
+                meta[fut] = ("ocr", rel, None)
+                pending.add(fut)
+
+        fill()
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                stage, rel, ocr = meta.pop(fut)
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    write({"file": rel, "status": "error", "stage": stage, "error": str(e)})
+                    continue
+                if stage == "ocr":
+                    for ev in res.pop("metrics", []):
+                        metrics.emit(ev)
+                    if not res["tokens"]:
+                        write({"file": rel, "status": "error", "stage": "ocr", "error": "OCR produced no tokens"})
+                        continue
+                    nxt = llm_pool.submit(_extract_job, res, expected_fields, n_consistency, cache,
+                                          token_format, max_runs, requery, chunk_chars, table_items, rules)
+                    meta[nxt] = ("llm", rel, res)
+                    pending.add(nxt)
+                else:
+                    normalized = res["normalized"]
+                    write({
+                        "file": rel,
+                        "status": "ok",
+                        "n_pages": ocr["n_pages"],
+                        "n_tokens": len(ocr["tokens"]),
+                        "route_scores": res["route_scores"],
+                        "timings": {"ocr_s": ocr["ocr_s"], "llm_s": res["llm_s"]},
+                        "result": normalized,
+                    })
+            fill()
+
+    elapsed = time.perf_counter() - t_start
+    stats["elapsed_s"] = round(elapsed, 2)
+    stats["docs_per_min"] = round((stats["ok"] + stats["error"]) / elapsed * 60.0, 2) if elapsed else 0.0
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m extractor.batch", description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("directory")
+    parser.add_argument("--out", default="results.jsonl")
+    parser.add_argument("--ocr-workers", type=int, default=None, help="OCR processes (default: CPU count)")
+    parser.add_argument("--llm-workers", type=int, default=4, help="documents in the LLM stage at once")
+    parser.add_argument("--fields", default="", help="comma-separated fields (default: per doc type)")
+    parser.add_argument("--n-consistency", type=int, default=3)
+    parser.add_argument("--max-runs", type=int, default=None,
+                        help="adaptive mode: start with 2 runs, add more up to this many while fields disagree")
+    parser.add_argument("--requery", choices=["full", "fields"], default="full",
+                        help="adaptive runs resend the whole document or only the disputed fields")
+    parser.add_argument("--chunk-chars", type=int, default=None,
+                        help="extract documents longer than this (prompt chars) in parallel page/line chunks")
+    parser.add_argument("--table-items", action="store_true",
+                        help="parse line items from clean item tables instead of asking the LLM")
+    parser.add_argument("--rules", action="store_true",
+                        help="answer labelled fields (invoice number, dates, totals ...) without the LLM when valid")
+    parser.add_argument("--token-format", choices=["json", "compact", "layout"], default="compact")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the LLM / OCR caches")
+    parser.add_argument("--restart", action="store_true", help="overwrite --out instead of resuming")
+    args = parser.parse_args(argv)
+
+    metrics.configure_from_env()
+
+    cache = None
+    # OCR_CACHE_PATH is read by every OCR worker process (see extractor.ocr.get_ocr_cache)
+    if args.no_cache:
+        os.environ.pop("OCR_CACHE_PATH", None)
+    else:
+        os.environ.setdefault("OCR_CACHE_PATH", ".cache/ocr_cache.sqlite")
+        from extractor.cache import default_llm_cache
+        cache = default_llm_cache()
+
+    fields = [f.strip() for f in args.fields.split(",") if f.strip()] or None
+    stats = run_batch(
+        args.directory, args.out,
+        ocr_workers=args.ocr_workers, llm_workers=args.llm_workers,
+        expected_fields=fields, n_consistency=args.n_consistency,
+        cache=cache, token_format=args.token_format, resume=not args.restart,
+        max_runs=args.max_runs, requery=args.requery, chunk_chars=args.chunk_chars,
+        table_items=args.table_items, rules=args.rules,
+    )
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+# extractor/benchmarks.py
+"""
+Measurement utilities for the extraction pipeline.
+
+    python -m extractor.benchmarks prompt test/
+    python -m extractor.benchmarks ocr test/ --workers 8
+    python -m extractor.benchmarks spatial
+    python -m extractor.benchmarks router
+    python -m extractor.benchmarks tokens
+    python -m extractor.benchmarks imports
+    python -m extractor.benchmarks preprocess test/
+    python -m extractor.benchmarks dpi test/
+    python -m extractor.benchmarks roi test/
+"""
+import argparse
+import json
+import mimetypes
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import List, Dict, Tuple
+
+from extractor.pipeline import list_documents
+
+def ocr_file(path: str) -> Tuple[str, List[Dict]]:
+    """OCR one document the same way app.py does; return (full_text, tokens)."""
+    from extractor.ocr import file_bytes_to_tokens
+
+    with open(path, "rb") as fh:
+        data = fh.read()
+    tokens, _ = file_bytes_to_tokens(data, mimetypes.guess_type(path)[0])
+    return " ".join(t["text"] for t in tokens), tokens
+
+
+def bench_prompt(directory: str, quant: int = 1) -> List[Dict]:
+    """Prompt size for the JSON vs compact vs layout token encodings on every document in `directory`."""
+    from extractor.llm_extract import build_prompt, prompt_size
+    from extractor.router import detect_doc_type
+
+    rows = []
+    for path in list_documents(directory):
+        text, tokens = ocr_file(path)
+        doc_type, _ = detect_doc_type(text, tokens)
+        fields = ["InvoiceNumber", "InvoiceDate", "TotalAmount"]
+        before = prompt_size(build_prompt(text, tokens, fields, doc_type=doc_type))
+        after = prompt_size(build_prompt(text, tokens, fields, doc_type=doc_type,
+                                         token_format="compact", quant=quant))
+        rows.append({
+            "file": os.path.basename(path),
+            "tokens": len(tokens),
+            "json_chars": before[0],
+            "json_approx_tokens": before[1],
+            "compact_chars": after[0],
+            "layout_chars": prompt_size(build_prompt(text, tokens, fields, doc_type=doc_type,
+                                                     token_format="layout", quant=quant))[0],
+            "compact_approx_tokens": after[1],
+            "ratio": round(after[0] / before[0], 3) if before[0] else None,
+        })
+    return rows
+
+
+def bench_ocr(directory: str, workers: int = None) -> List[Dict]:
+    """Serial vs process-pool OCR time on the multi-page PDFs in `directory`."""
+    from extractor.ocr import file_bytes_to_images, ocr_document
+
+    rows = []
+    for path in list_documents(directory):
+        if not path.lower().endswith(".pdf"):
+            continue
+        with open(path, "rb") as fh:
+            images = file_bytes_to_images(fh.read(), "application/pdf")
+        if len(images) < 2:
+            continue
+        t0 = time.perf_counter()
+        serial = ocr_document(images, workers=1)
+        t1 = time.perf_counter()
+        parallel = ocr_document(images, workers=workers)
+        t2 = time.perf_counter()
+        rows.append({
+            "file": os.path.basename(path),
+            "pages": len(images),
+            "serial_s": round(t1 - t0, 3),
+            "parallel_s": round(t2 - t1, 3),
+            "speedup": round((t1 - t0) / max(t2 - t1, 1e-9), 2),
+            "same_tokens": len(serial) == len(parallel),
+        })
+    return rows
+
+
+def synthetic_tokens(n: int, pages: int = 1, seed: int = 0) -> List[Dict]:
+    """Grid-laid fake OCR tokens (≈60 words per line) for micro-benchmarks."""
+    rng = random.Random(seed)
+    per_page = max(1, n // pages)
+    tokens = []
+    for i in range(n):
+        page, k = i // per_page + 1, i % per_page
+        x, y = 40 + (k % 60) * 55, 40 + (k // 60) * 28
+        tokens.append({"text": f"w{i}", "conf": rng.random(), "bbox": [x, y, x + 48, y + 20], "page": page})
+    return tokens
+
+
+def bench_spatial(sizes=(1000, 4000, 16000), n_queries: int = 200) -> List[Dict]:
+    """Field-bbox lookups: linear scan over all tokens vs TokenIndex, as token count grows."""
+    from extractor.spatial import TokenIndex, intersects
+
+    rows = []
+    for n in sizes:
+        tokens = synthetic_tokens(n)
+        rng = random.Random(n)
+        queries = []
+        for _ in range(n_queries):
+            t = tokens[rng.randrange(n)]
+            x, y = t["bbox"][0], t["bbox"][1]
+            queries.append([x, y, x + 160, y + 22])
+
+        t0 = time.perf_counter()
+        scan = [[tok for tok in tokens if intersects(tok["bbox"], q)] for q in queries]
+        t1 = time.perf_counter()
+        index = TokenIndex(tokens)
+        t2 = time.perf_counter()
+        hits = [index.query(1, q) for q in queries]
+        t3 = time.perf_counter()
+        rows.append({
+            "tokens": n,
+            "queries": n_queries,
+            "scan_ms": round((t1 - t0) * 1000, 2),
+            "index_build_ms": round((t2 - t1) * 1000, 2),
+            "index_query_ms": round((t3 - t2) * 1000, 2),
+            "same_results": scan == hits,
+        })
+    return rows
+
+
+def bench_router(pages=(1, 10, 50), words_per_page: int = 600) -> List[Dict]:
+    """Text-hint counting per hint/per class (legacy) vs the combined matcher on long OCR text."""
+    from extractor import router
+
+    vocab = [w for ws in (router.INVOICE_HINTS, router.MEDICAL_BILL_HINTS, router.PRESCRIPTION_HINTS) for w in ws]
+    vocab += ["total", "amount", "date", "qty", "rate", "name", "address", "12.50", "2024-01-05"] * 8
+    rows = []
+    for n in pages:
+        rng = random.Random(n)
+        text = " ".join(rng.choice(vocab) for _ in range(n * words_per_page))
+        t0 = time.perf_counter()
+        legacy = {
+            cls: router._count_occurrences(text, hints)
+            for cls, hints in (("invoice", router.INVOICE_HINTS),
+                               ("medical_bill", router.MEDICAL_BILL_HINTS),
+                               ("prescription", router.PRESCRIPTION_HINTS))
+        }
+        t1 = time.perf_counter()
+        combined = router._count_all_classes(text)
+        t2 = time.perf_counter()
+        rows.append({
+            "pages": n,
+            "chars": len(text),
+            "legacy_ms": round((t1 - t0) * 1000, 2),
+            "combined_ms": round((t2 - t1) * 1000, 2),
+            "speedup": round((t1 - t0) / max(t2 - t1, 1e-9), 1),
+            "same_scores": legacy == combined,
+        })
+    return rows
+
+
+def bench_tokens(sizes=(1000, 10000, 50000), n_queries: int = 200) -> List[Dict]:
+    """
+    Memory and bbox-query cost: list of token dicts vs columnar TokenTable.
+    The table reuses the dicts' (interned) strings, so table_kb covers the columns and text list only.
+    """
+    import tracemalloc
+    from extractor.tokens import TokenTable
+
+    rows = []
+    for n in sizes:
+        tracemalloc.start()
+        tokens = synthetic_tokens(n)
+        dict_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        tracemalloc.start()
+        table = TokenTable.from_dicts(tokens)
+        table_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        rng = random.Random(n)
+        queries = []
+        for _ in range(n_queries):
+            t = tokens[rng.randrange(n)]
+            queries.append([t["bbox"][0], t["bbox"][1], t["bbox"][0] + 160, t["bbox"][1] + 22])
+        t0 = time.perf_counter()
+        scan = [[tok["conf"] for tok in tokens if tok["bbox"][0] <= q[2] and tok["bbox"][2] >= q[0]
+                 and tok["bbox"][1] <= q[3] and tok["bbox"][3] >= q[1]] for q in queries]
+        t1 = time.perf_counter()
+        vec = [table.confs_in(1, q) for q in queries]
+        t2 = time.perf_counter()
+        rows.append({
+            "tokens": n,
+            "dicts_kb": round(dict_bytes / 1024),
+            "table_kb": round(table_bytes / 1024),
+            "dict_query_ms": round((t1 - t0) * 1000, 2),
+            "table_query_ms": round((t2 - t1) * 1000, 2),
+            "same_results": scan == vec,
+        })
+    return rows
+
+
+def bench_preprocess(directory: str, steps=None, target_dpi: float = 300) -> List[Dict]:
+    """Tesseract time, token count and mean token conf on the raw vs preprocessed test images."""
+    from PIL import Image
+    from extractor.ocr import _image_to_token_table
+    from extractor.preprocess import DEFAULT_STEPS, preprocess_image
+
+    rows = []
+    for path in list_documents(directory):
+        if path.lower().endswith(".pdf"):
+            continue
+        img = Image.open(path)
+        img.load()
+        t0 = time.perf_counter()
+        raw = _image_to_token_table(img.convert("RGB"))
+        t1 = time.perf_counter()
+        prepped, _ = preprocess_image(img, steps=steps or DEFAULT_STEPS, target_dpi=target_dpi)
+        t2 = time.perf_counter()
+        pre = _image_to_token_table(prepped)
+        t3 = time.perf_counter()
+        if raw is None or pre is None:
+            rows.append({"file": os.path.basename(path), "error": "tesseract failed"})
+            continue
+        rows.append({
+            "file": os.path.basename(path),
+            "pixels_raw": img.size[0] * img.size[1],
+            "pixels_pre": prepped.size[0] * prepped.size[1],
+            "ocr_raw_s": round(t1 - t0, 3),
+            "prep_s": round(t2 - t1, 3),
+            "ocr_pre_s": round(t3 - t2, 3),
+            "tokens_raw": len(raw),
+            "tokens_pre": len(pre),
+            "conf_raw": round(float(raw.conf.mean()), 3) if len(raw) else 0.0,
+            "conf_pre": round(float(pre.conf.mean()), 3) if len(pre) else 0.0,
+        })
+    return rows
+
+
+def bench_dpi(directory: str, dpi: int = 200, workers: int = None) -> List[Dict]:
+    """OCR time, pixels and mean token conf on the PDFs in `directory`: fixed `dpi` vs per-page DPI."""
+    from extractor import metrics
+    from extractor.ocr import file_bytes_to_tokens
+
+    rows = []
+    for path in list_documents(directory):
+        if not path.lower().endswith(".pdf"):
+            continue
+        with open(path, "rb") as fh:
+            data = fh.read()
+        t0 = time.perf_counter()
+        fixed, n_pages = file_bytes_to_tokens(data, "application/pdf", dpi=dpi, use_text_layer=False,
+                                              workers=workers, as_table=True, adaptive_dpi=False)
+        t1 = time.perf_counter()
+        with metrics.capture() as events:
+            adaptive, _ = file_bytes_to_tokens(data, "application/pdf", dpi=dpi, use_text_layer=False,
+                                               workers=workers, as_table=True, adaptive_dpi=True)
+        t2 = time.perf_counter()
+        stats = next((e for e in events if e["stage"] == "adaptive_dpi"), {})
+        rows.append({
+            "file": os.path.basename(path),
+            "pages": n_pages,
+            "fixed_s": round(t1 - t0, 3),
+            "adaptive_s": round(t2 - t1, 3),
+            "pixel_ratio": stats.get("pixel_ratio"),
+            "retried": stats.get("retried"),
+            "tokens_fixed": len(fixed),
+            "tokens_adaptive": len(adaptive),
+            "conf_fixed": round(float(fixed.conf.mean()), 3) if len(fixed) else 0.0,
+            "conf_adaptive": round(float(adaptive.conf.mean()), 3) if len(adaptive) else 0.0,
+        })
+    return rows
+
+
+def bench_roi(directory: str) -> List[Dict]:
+    """Whole-page vs region-of-interest OCR on the test images: time, blocks, tokens, mean conf."""
+    from PIL import Image
+    from extractor.ocr import _image_to_token_table, _image_to_token_table_roi
+    from extractor.preprocess import to_gray
+    from extractor.regions import find_text_blocks
+
+    rows = []
+    for path in list_documents(directory):
+        if path.lower().endswith(".pdf"):
+            continue
+        img = Image.open(path).convert("RGB")
+        t0 = time.perf_counter()
+        page = _image_to_token_table(img)
+        t1 = time.perf_counter()
+        roi = _image_to_token_table_roi(img)
+        t2 = time.perf_counter()
+        if page is None or roi is None:
+            rows.append({"file": os.path.basename(path), "error": "tesseract failed"})
+            continue
+        rows.append({
+            "file": os.path.basename(path),
+            "blocks": len(find_text_blocks(to_gray(img)) or []),
+            "page_s": round(t1 - t0, 3),
+            "roi_s": round(t2 - t1, 3),
+            "tokens_page": len(page),
+            "tokens_roi": len(roi),
+            "conf_page": round(float(page.conf.mean()), 3) if len(page) else 0.0,
+            "conf_roi": round(float(roi.conf.mean()), 3) if len(roi) else 0.0,
+        })
+    return rows
+
+
+IMPORT_MODULES = ("extractor.router", "extractor.validator", "extractor.llm_extract", "extractor.ocr",
+                  "extractor.normalize_result", "extractor.pipeline", "extractor.batch")
+HEAVY_MODULES = ("numpy", "PIL", "pytesseract", "pdf2image", "fitz", "dateutil", "openai", "pydantic", "dotenv")
+
+_IMPORT_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+dt = time.perf_counter() - t0
+print(json.dumps([dt, [m for m in {heavy!r} if m in sys.modules]]))
+"""
+
+
+def bench_imports(modules=IMPORT_MODULES, repeats: int = 5) -> List[Dict]:
+    """Cold import time of each module in a fresh interpreter (median of `repeats`) and the heavy deps it pulls in."""
+    rows = []
+    for module in modules:
+        times, loaded = [], []
+        for _ in range(repeats):
+            out = subprocess.run([sys.executable, "-c", _IMPORT_PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                 capture_output=True, text=True)
+            if out.returncode != 0:
+                loaded = ["import failed: " + (out.stderr.strip().splitlines() or ["?"])[-1]]
+                break
+            dt, loaded = json.loads(out.stdout.strip().splitlines()[-1])
+            times.append(dt)
+        rows.append({
+            "module": module,
+            "import_ms": round(sorted(times)[len(times) // 2] * 1000, 1) if times else None,
+            "heavy_deps": ",".join(loaded) or "-",
+        })
+    return rows
+
+
+def _print_table(rows: List[Dict]) -> None:
+    if not rows:
+        print("(no documents)")
+        return
+    cols = list(rows[0].keys())
+    widths = [max(len(c), *(len(str(r[c])) for r in rows)) for c in cols]
+    print("  ".join(c.ljust(w) for c, w in zip(cols, widths)))
+    for r in rows:
+        print("  ".join(str(r[c]).ljust(w) for c, w in zip(cols, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m extractor.benchmarks")
+    parser.add_argument("--json", action="store_true", help="print machine-readable JSON")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("prompt", help="prompt size for the json / compact / layout token encodings")
+    p.add_argument("directory", nargs="?", default="test")
+    p.add_argument("--quant", type=int, default=1)
+
+    p = sub.add_parser("ocr", help="serial vs parallel per-page OCR on multi-page PDFs")
+    p.add_argument("directory", nargs="?", default="test")
+    p.add_argument("--workers", type=int, default=None)
+
+    p = sub.add_parser("spatial", help="bbox lookup: linear scan vs spatial index")
+    p.add_argument("--sizes", type=int, nargs="+", default=[1000, 4000, 16000])
+
+    p = sub.add_parser("router", help="doc-type keyword counting on long OCR text")
+    p.add_argument("--pages", type=int, nargs="+", default=[1, 10, 50])
+
+    p = sub.add_parser("tokens", help="list-of-dicts vs TokenTable memory and query cost")
+    p.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+
+    p = sub.add_parser("preprocess", help="OCR time and mean conf on raw vs preprocessed images")
+    p.add_argument("directory", nargs="?", default="test")
+    p.add_argument("--steps", default="", help="comma-separated subset of extractor.preprocess.STEPS")
+    p.add_argument("--target-dpi", type=float, default=300)
+
+    p = sub.add_parser("dpi", help="fixed vs per-page adaptive DPI on the PDFs of a directory")
+    p.add_argument("directory", nargs="?", default="test")
+    p.add_argument("--dpi", type=int, default=200)
+    p.add_argument("--workers", type=int, default=None)
+
+    p = sub.add_parser("roi", help="whole-page vs region-of-interest OCR on the images of a directory")
+    p.add_argument("directory", nargs="?", default="test")
+
+    p = sub.add_parser("imports", help="cold import time per module and heavy deps loaded")
+    p.add_argument("--modules", nargs="+", default=list(IMPORT_MODULES))
+    p.add_argument("--repeats", type=int, default=5)
+
+    args = parser.parse_args(argv)
+    if args.cmd == "prompt":
+        rows = bench_prompt(args.directory, quant=args.quant)
+    elif args.cmd == "ocr":
+        rows = bench_ocr(args.directory, workers=args.workers)
+    elif args.cmd == "spatial":
+        rows = bench_spatial(tuple(args.sizes))
+    elif args.cmd == "router":
+        rows = bench_router(tuple(args.pages))
+    elif args.cmd == "tokens":
+        rows = bench_tokens(tuple(args.sizes))
+    elif args.cmd == "preprocess":
+        steps = tuple(x.strip() for x in args.steps.split(",") if x.strip()) or None
+        rows = bench_preprocess(args.directory, steps=steps, target_dpi=args.target_dpi)
+    elif args.cmd == "dpi":
+        rows = bench_dpi(args.directory, dpi=args.dpi, workers=args.workers)
+    elif args.cmd == "roi":
+        rows = bench_roi(args.directory)
+    elif args.cmd == "imports":
+        rows = bench_imports(tuple(args.modules), repeats=args.repeats)
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        _print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
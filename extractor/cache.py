@@ -0,0 +1,247 @@
+# extractor/cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+
+def make_key(*parts) -> str:
+    """Content-address any JSON-serializable parts (e.g. model, temperature, messages, run index)."""
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _encode(value: Any) -> bytes:
+    return zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+
+def _decode(blob: bytes) -> Any:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class SQLiteCache:
+    """
+    Persistent key/value cache in a single SQLite file.
+    Values are zlib-compressed JSON. Entries older than `ttl` seconds are ignored and
+    purged; when `max_entries` or `max_bytes` is exceeded, least recently used entries go first.
+    Safe to share across threads.
+    """
+
+    def __init__(self, path: str, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None, ttl: Optional[float] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # timeout: OCR pool workers in other processes may hold the write lock briefly
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache(accessed_at)")
+        self._db.commit()
+
+    def get(self, key: str) -> Any:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                if row is not None:
+                    self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+        return _decode(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        blob = _encode(value)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now),
+            )
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now: float) -> None:
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM cache WHERE created_at < ?", (now - self.ttl,))
+        if self.max_entries is not None:
+            self._db.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        if self.max_bytes is not None:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+            if total > self.max_bytes:
+                for key, size in self._db.execute("SELECT key, size FROM cache ORDER BY accessed_at").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    total -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM cache")
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+            "bytes": total,
+        }
+
+
+class FileCache:
+    """
+    Same interface as SQLiteCache, one compressed file per key in `directory`.
+    File mtime is the write time (TTL) and atime, set explicitly on every hit, the last
+    access (LRU eviction), so entries that are read often still expire.
+    """
+
+    def __init__(self, directory: str, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None, ttl: Optional[float] = None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json.z")
+
+    def get(self, key: str) -> Any:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fh:
+                entry = _decode(fh.read())
+        except (OSError, ValueError, zlib.error):
+            with self._lock:
+                self.misses += 1
+            return None
+        if self.ttl is not None and time.time() - entry["created_at"] > self.ttl:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            st = os.stat(path)
+            os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))  # keep mtime: it is the write time
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return entry["value"]
+
+    def set(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(_encode({"created_at": time.time(), "value": value}))
+        os.replace(tmp, path)  # atomic, so concurrent readers never see a partial file
+        with self._lock:
+            self._evict()
+
+    def _entries(self):
+        out = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json.z"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            out.append((st.st_atime, st.st_mtime, st.st_size, name))
+        return out
+
+    def _evict(self) -> None:
+        if self.max_entries is None and self.max_bytes is None and self.ttl is None:
+            return
+        entries = sorted(self._entries())  # oldest access first
+        now = time.time()
+        total = sum(size for _, _, size, _ in entries)
+        count = len(entries)
+        for _, mtime, size, name in entries:
+            expired = self.ttl is not None and now - mtime > self.ttl
+            over = (self.max_entries is not None and count > self.max_entries) or \
+                   (self.max_bytes is not None and total > self.max_bytes)
+            if not expired and not over:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+            count -= 1
+
+    def clear(self) -> None:
+        with self._lock:
+            for *_, name in self._entries():
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            "backend": "files",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": len(entries),
+            "bytes": sum(size for _, _, size, _ in entries),
+        }
+
+
+def open_cache(path: str, **kwargs):
+    """Open a SQLiteCache for *.sqlite / *.db paths, otherwise a FileCache directory."""
+    if path.endswith((".sqlite", ".sqlite3", ".db")):
+        return SQLiteCache(path, **kwargs)
+    return FileCache(path, **kwargs)
+
+
+def default_llm_cache():
+    """LLM response cache configured from env (LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES)."""
+    return open_cache(
+        os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite"),
+        ttl=float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600)),
+        max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", 5000)),
+    )
+
+
+def default_ocr_cache():
+    """OCR result cache from env (OCR_CACHE_PATH, OCR_CACHE_MAX_MB); None when OCR_CACHE_PATH is unset."""
+    path = os.getenv("OCR_CACHE_PATH")
+    if not path:
+        return None
+    return open_cache(path, max_bytes=int(float(os.getenv("OCR_CACHE_MAX_MB", 256)) * 1024 * 1024))
@@ -36,3 +36,39 @@ def overall_confidence(per_field_scores):
     if not per_field_scores:
         return 0.0
     return sum(per_field_scores) / len(per_field_scores)
+
+
+def asked_runs(llm_runs, field_name):
+    """
+    The runs that asked for `field_name`: every full run, and the targeted runs (see
+    llm_extract.requery_fields) whose "_fields" list names it.
+    """
+    return [run for run in llm_runs if field_name in run.get("_fields", (field_name,))]
+
+
+def run_values(llm_runs, field_name):
+    """Value of `field_name` in each LLM run that asked for it (None where it was not returned)."""
+    vals = []
+    for run in asked_runs(llm_runs, field_name):
+        val = None
+        for ff in run.get("fields", []):
+            if ff.get("name") == field_name:
+                val = ff.get("value")
+        vals.append(val)
+    return vals
+
+
+def field_agreement(llm_runs, field_names):
+    """
+    Per-field LLM agreement across runs, as used in compute_field_confidence.
+    A field no run returned counts as agreed (1.0): more runs cannot resolve it.
+    """
+    out = {}
+    for name in field_names:
+        vals = run_values(llm_runs, name)
+        if all(v is None for v in vals):
+            out[name] = 1.0
+            continue
+        _, breakdown = compute_field_confidence(name, [], vals, validator_ok=False, return_breakdown=True)
+        out[name] = breakdown["llm_agreement"]
+    return out
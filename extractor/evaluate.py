@@ -0,0 +1,232 @@
+# extractor/evaluate.py
+"""
+Accuracy and latency benchmark over document / ground-truth pairs.
+
+    python -m extractor.evaluate test/ --llm recorded --out bench.json
+
+For every document in the directory (01.pdf, 02.jpg, ...) the full pipeline is run
+with per-stage timings; OCR goes through file_bytes_to_tokens, so the text layer,
+OCR_ADAPTIVE_DPI and the other OCR_* settings apply as in production. Fields are scored against <stem>_gt.json when present.
+The LLM is one of:
+  recorded  replay <stem>_pred.json as the model response (no network)
+  stub      return an empty extraction (pure pipeline overhead)
+  live      call the configured model
+Results are written as JSON so runs can be diffed between versions.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from extractor.pipeline import default_fields, guess_mime_type, list_documents
+
+STAGES = ["text_layer", "rasterize", "ocr", "route", "prompt_build", "llm", "normalize", "validate"]
+
+STUB_RESPONSE = {"doc_type": "", "fields": [], "line_items": [], "overall_confidence": 0.0,
+                 "qa": {"passed_rules": [], "failed_rules": [], "notes": "stub"}}
+
+
+def _stem(path: str) -> str:
+    return os.path.splitext(path)[0]
+
+
+def _load_json(path: str) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def make_llm(mode: str, doc_path: str):
+    """Return a call_llm replacement for the given mode (None = real call_llm)."""
+    if mode == "live":
+        return None
+    response = STUB_RESPONSE
+    if mode == "recorded":
+        response = _load_json(_stem(doc_path) + "_pred.json") or STUB_RESPONSE
+    raw = json.dumps(response)
+
+    def _llm(messages, model=None, temperature=0.0, **kwargs):
+        return raw
+    return _llm
+
+
+def _norm_value(v) -> str:
+    s = str(v if v is not None else "").strip().lower()
+    s = re.sub(r"[\s$€₹£]+", " ", s).strip()
+    return s.replace(",", "")
+
+
+def score_fields(pred_fields: List[Dict], gt_fields: List[Dict]) -> Dict:
+    """Field-level true positives / precision / recall; a field matches on name + normalized value."""
+    pred = {f.get("name"): _norm_value(f.get("value")) for f in pred_fields
+            if f.get("value") not in (None, "", [])}
+    gt = {f.get("name"): _norm_value(f.get("value")) for f in gt_fields}
+    tp = sum(1 for name, v in pred.items() if name in gt and gt[name] == v)
+    return {
+        "tp": tp,
+        "predicted": len(pred),
+        "expected": len(gt),
+        "precision": round(tp / len(pred), 3) if pred else None,
+        "recall": round(tp / len(gt), 3) if gt else None,
+    }
+
+
+def _max_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def evaluate_document(path: str, llm_mode: str = "recorded", n_consistency: int = 3,
+                      token_format: str = "compact", workers: Optional[int] = None,
+                      trace_memory: bool = False) -> Dict:
+    """
+    Run the pipeline stage by stage on one document and return timings and scores.
+    "text_layer" is reading the PDF pages that have one, "rasterize" rendering the others
+    to images and "ocr" the rest of OCR (Tesseract, preprocessing, cache lookups). With `trace_memory`, py_peak_mb is this document's Python peak.
+    """
+    from extractor import metrics
+    from extractor.ocr import file_bytes_to_tokens
+    from extractor.router import detect_doc_type
+    from extractor.llm_extract import build_prompt, extract_with_llm
+    from extractor.normalize_result import normalize_extraction
+    from extractor.validator import validate_fields
+
+    timings = {}
+
+    def timed(stage, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        out = fn(*args, **kwargs)
+        timings[stage] = round(timings.get(stage, 0.0) + time.perf_counter() - t0, 4)
+        return out
+
+    with open(path, "rb") as fh:
+        data = fh.read()
+    mime = guess_mime_type(path)
+    if trace_memory:
+        tracemalloc.start()
+
+    # The production OCR path; its metrics events split out the text layer read and page
+    # rendering, which both run in this process
+    with metrics.capture() as events:
+        tokens, n_pages = timed("ocr", file_bytes_to_tokens, data, mime, workers=workers, as_table=True)
+    for stage, event in (("text_layer", "pdf_text_layer"), ("rasterize", "rasterize")):
+        matched = [ev for ev in events if ev["stage"] == event]
+        if matched:
+            timings[stage] = round(sum(ev["duration_s"] for ev in matched), 4)
+            timings["ocr"] = round(max(0.0, timings["ocr"] - timings[stage]), 4)
+    ocr_pages = next((ev.get("ocr_pages", n_pages) for ev in events if ev["stage"] == "pdf_text_layer"), n_pages)
+    full_text = tokens.full_text()
+
+    doc_type, _ = timed("route", detect_doc_type, full_text, tokens)
+    fields = default_fields(doc_type)
+    messages = timed("prompt_build", build_prompt, full_text, tokens, fields,
+                     doc_type=doc_type, token_format=token_format)
+    llm_raw = timed("llm", extract_with_llm, full_text, tokens, fields, n_consistency=n_consistency,
+                    doc_type=doc_type, token_format=token_format, llm=make_llm(llm_mode, path))
+    normalized = timed("normalize", normalize_extraction, llm_raw, tokens)
+    timed("validate", validate_fields, normalized["doc_type"],
+          {f["name"]: f["value"] for f in normalized["fields"]}, llm_raw.get("line_items", []))
+
+    record = {
+        "file": os.path.basename(path),
+        "pages": n_pages,
+        "ocr_pages": ocr_pages,
+        "tokens": len(tokens),
+        "prompt_chars": sum(len(m["content"]) for m in messages),
+        "doc_type": normalized["doc_type"],
+        "timings_s": timings,
+        "total_s": round(sum(timings.values()), 4),
+    }
+    if trace_memory:
+        record["py_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+        tracemalloc.stop()
+
+    gt = _load_json(_stem(path) + "_gt.json")
+    if gt is not None:
+        record["doc_type_correct"] = gt.get("doc_type") == normalized["doc_type"]
+        record["fields"] = score_fields(normalized["fields"], gt.get("fields", []))
+    return record
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def summarize(records: List[Dict]) -> Dict:
+    stages = {}
+    for stage in STAGES:
+        vals = [r["timings_s"][stage] for r in records if stage in r["timings_s"]]
+        if vals:
+            stages[stage] = {"total_s": round(sum(vals), 4), "median_s": round(statistics.median(vals), 4),
+                             "max_s": round(max(vals), 4)}
+    scored = [r for r in records if "fields" in r]
+    tp = sum(r["fields"]["tp"] for r in scored)
+    pred = sum(r["fields"]["predicted"] for r in scored)
+    exp = sum(r["fields"]["expected"] for r in scored)
+    return {
+        "documents": len(records),
+        "stages": stages,
+        "total_s": round(sum(r["total_s"] for r in records), 4),
+        "doc_type_accuracy": round(sum(r["doc_type_correct"] for r in scored) / len(scored), 3) if scored else None,
+        "field_precision": round(tp / pred, 3) if pred else None,
+        "field_recall": round(tp / exp, 3) if exp else None,
+    }
+
+
+def run(directory: str, llm_mode: str = "recorded", **kwargs) -> Dict:
+    records = []
+    for path in list_documents(directory):
+        try:
+            records.append(evaluate_document(path, llm_mode=llm_mode, **kwargs))
+        except Exception as e:
+            print(f"[EVAL ERROR] {os.path.basename(path)}: {e}")
+    return {
+        "revision": _git_revision(),
+        "llm": llm_mode,
+        "options": kwargs,
+        "documents": records,
+        "summary": summarize(records),
+        # process-wide high-water mark, so only meaningful for the run as a whole
+        "max_rss_mb": _max_rss_mb(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m extractor.evaluate")
+    parser.add_argument("directory", nargs="?", default="test")
+    parser.add_argument("--llm", choices=["recorded", "stub", "live"], default="recorded")
+    parser.add_argument("--n-consistency", type=int, default=3)
+    parser.add_argument("--token-format", choices=["json", "compact", "layout"], default="compact")
+    parser.add_argument("--workers", type=int, default=None, help="OCR processes per document")
+    parser.add_argument("--trace-memory", action="store_true", help="record Python peak memory (slower)")
+    parser.add_argument("--out", default=None, help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = run(args.directory, llm_mode=args.llm, n_consistency=args.n_consistency,
+                 token_format=args.token_format, workers=args.workers, trace_memory=args.trace_memory)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+# extractor/layout.py
+from typing import List, Dict, Optional
+
+from extractor.validator import parse_amount
+
+
+def _height(tok: Dict) -> float:
+    return max(1.0, tok["bbox"][3] - tok["bbox"][1])
+
+
+def group_lines(tokens: List[Dict], y_tol: float = 0.5) -> List[List[Dict]]:
+    """
+    Group OCR tokens into text lines, in reading order.
+    Tokens are swept per page by vertical center; a token joins the current line when its
+    center lies within `y_tol` * (line height) of the line's center. Each line is sorted by x.
+    O(n log n) in the number of tokens.
+    """
+    ordered = sorted(
+        tokens,
+        key=lambda t: (t.get("page", 1), (t["bbox"][1] + t["bbox"][3]) / 2.0, t["bbox"][0]),
+    )
+    lines, cur = [], []
+    cur_page, cur_cy, cur_h = None, 0.0, 1.0
+    for tok in ordered:
+        page = tok.get("page", 1)
+        cy = (tok["bbox"][1] + tok["bbox"][3]) / 2.0
+        if cur and page == cur_page and abs(cy - cur_cy) <= y_tol * cur_h:
+            cur.append(tok)
+            # running mean keeps the line center stable on long rows
+            cur_cy += (cy - cur_cy) / len(cur)
+            cur_h = max(cur_h, _height(tok))
+            continue
+        if cur:
+            lines.append(sorted(cur, key=lambda t: t["bbox"][0]))
+        cur, cur_page, cur_cy, cur_h = [tok], page, cy, _height(tok)
+    if cur:
+        lines.append(sorted(cur, key=lambda t: t["bbox"][0]))
+    return lines
+
+
+def line_bbox(line: List[Dict]) -> List[float]:
+    """Union bbox [x1,y1,x2,y2] of a line's tokens."""
+    return [
+        min(t["bbox"][0] for t in line),
+        min(t["bbox"][1] for t in line),
+        max(t["bbox"][2] for t in line),
+        max(t["bbox"][3] for t in line),
+    ]
+
+
+def lines_near(lines: List[List[Dict]], regions, context: int = 1) -> List[int]:
+    """
+    Indices of `lines` that vertically overlap any (page, bbox) region, plus `context`
+    neighbouring lines above and below on the same page (labels usually sit on the
+    value's line or the one above it). The whole line is kept, not just the bbox width.
+    """
+    boxes = [(ln[0].get("page", 1), line_bbox(ln)) for ln in lines]
+    hit = set()
+    for page, bbox in regions:
+        for i, (p, lb) in enumerate(boxes):
+            if p == page and lb[1] <= bbox[3] and lb[3] >= bbox[1]:
+                hit.add(i)
+    out = set()
+    for i in hit:
+        for j in range(max(0, i - context), min(len(lines), i + context + 1)):
+            if boxes[j][0] == boxes[i][0]:
+                out.add(j)
+    return sorted(out)
+
+
+def _median_height(line: List[Dict]) -> float:
+    heights = sorted(_height(t) for t in line)
+    return heights[len(heights) // 2]
+
+
+def line_cells(line: List[Dict], gap: float = 0.6) -> List[Dict]:
+    """
+    Split a text line into cells: runs of words whose horizontal gap is at most `gap` x the
+    line height (word spacing), so a wide gap starts a new cell (column spacing). A word
+    starting with ":" stays with its label ("Bill No     : 123" is one cell).
+    Each cell is {"text", "bbox", "tokens"}.
+    """
+    h = _median_height(line)
+    cells = []
+    for tok in line:
+        if cells and (tok["bbox"][0] - cells[-1]["bbox"][2] <= gap * h or tok["text"].startswith(":")):
+            cell = cells[-1]
+            cell["tokens"].append(tok)
+            cell["bbox"] = [min(cell["bbox"][0], tok["bbox"][0]), min(cell["bbox"][1], tok["bbox"][1]),
+                            max(cell["bbox"][2], tok["bbox"][2]), max(cell["bbox"][3], tok["bbox"][3])]
+        else:
+            cells.append({"tokens": [tok], "bbox": list(tok["bbox"])})
+    for cell in cells:
+        cell["text"] = " ".join(t["text"] for t in cell["tokens"])
+    return cells
+
+
+def _columns(row_cells: List[List[Dict]]) -> List[List[float]]:
+    # Union of the cells' x-intervals: overlapping intervals are one column
+    spans = sorted((c["bbox"][0], c["bbox"][2]) for cells in row_cells for c in cells)
+    cols = []
+    for x1, x2 in spans:
+        if cols and x1 <= cols[-1][1]:
+            cols[-1][1] = max(cols[-1][1], x2)
+        else:
+            cols.append([x1, x2])
+    return cols
+
+
+def _add_spans(spans: List[List[float]], cells: List[Dict]) -> None:
+    # Incremental _columns: merge each cell's x-interval into the sorted spans
+    for c in cells:
+        x1, x2 = c["bbox"][0], c["bbox"][2]
+        keep = [s for s in spans if s[1] < x1 or s[0] > x2]
+        hit = [s for s in spans if not (s[1] < x1 or s[0] > x2)]
+        merged = [min([x1] + [s[0] for s in hit]), max([x2] + [s[1] for s in hit])]
+        spans[:] = sorted(keep + [merged])
+
+
+def _overlaps(cell: Dict, spans: List[List[float]]) -> int:
+    return sum(1 for x1, x2 in spans if min(cell["bbox"][2], x2) > max(cell["bbox"][0], x1))
+
+
+def _within_columns(cells: List[Dict], spans: List[List[float]], numeric: List[List[float]]) -> bool:
+    # A wrapped line: every cell overlaps exactly one column, none spans several, and none
+    # falls in a numeric column; a "Total  314.39" line under the last item starts a new row
+    if cells and any(cells[0]["text"].lower().startswith(w) for w in SUMMARY_WORDS):
+        return False
+    return all(_overlaps(c, spans) == 1 and not _overlaps(c, numeric) for c in cells)
+
+
+def _column_of(bbox, cols) -> int:
+    overlap = [min(bbox[2], c[1]) - max(bbox[0], c[0]) for c in cols]
+    best = max(range(len(cols)), key=overlap.__getitem__)
+    if overlap[best] > 0:
+        return best
+    cx = (bbox[0] + bbox[2]) / 2.0
+    return min(range(len(cols)), key=lambda i: abs((cols[i][0] + cols[i][1]) / 2.0 - cx))
+
+
+def _is_numeric(text: str) -> bool:
+    chars = [ch for ch in text if not ch.isspace()]
+    return bool(chars) and sum(ch.isdigit() or ch in ",.-%$€£₹" for ch in chars) / len(chars) >= 0.6
+
+
+def _build_table(page: int, entries, min_cols: int, min_rows: int):
+    cols = _columns([cells for _, cells, starts_row in entries if starts_row])
+    if len(cols) < min_cols:
+        return None
+    rows = []
+    for _, cells, starts_row in entries:
+        if starts_row:
+            rows.append({"cells": [[] for _ in cols], "tokens": []})
+        for cell in cells:
+            rows[-1]["cells"][_column_of(cell["bbox"], cols)].append(cell)
+            rows[-1]["tokens"].extend(cell["tokens"])
+    if len(rows) < min_rows:
+        return None
+    out_rows = []
+    for row in rows:
+        toks = row["tokens"]
+        out_rows.append({
+            "cells": [" ".join(c["text"] for c in col_cells) for col_cells in row["cells"]],
+            "cell_bboxes": [line_bbox([t for c in col_cells for t in c["tokens"]]) if col_cells else None
+                            for col_cells in row["cells"]],
+            "bbox": line_bbox(toks),
+            "conf": sum(t["conf"] for t in toks) / len(toks),
+        })
+    header = None
+    first = [c for c in out_rows[0]["cells"] if c]
+    if first and not any(_is_numeric(c) for c in first):
+        header = out_rows.pop(0)["cells"]
+    return {
+        "page": page,
+        "bbox": line_bbox([t for row in rows for t in row["tokens"]]),
+        "columns": cols,
+        "header": header,
+        "rows": out_rows,
+        "lines": [i for i, _, _ in entries],
+    }
+
+
+def find_tables(lines: List[List[Dict]], min_cols: int = 3, min_rows: int = 2,
+                row_gap: float = 3.0, wrap_gap: float = 1.0) -> List[Dict]:
+    """
+    Reconstruct column-aligned tables from text lines (see group_lines), O(n log n).
+
+    A line with at least `min_cols` cells (see line_cells) is a table row; consecutive rows on
+    a page no more than `row_gap` line heights apart form one table, and a line with fewer
+    cells right under a row (within `wrap_gap` line heights, e.g. a wrapped description) is
+    merged into that row when each of its cells falls in a single column and none in a
+    numeric one, unless it starts with a summary word (see SUMMARY_WORDS). Columns are the
+    union of the rows' cell x-intervals, and every cell goes to the column it overlaps most.
+    A first row without numbers is the header.
+
+    Returns [{"page", "bbox", "columns": [[x1, x2], ...], "header": [str] | None,
+              "rows": [{"cells": [str], "cell_bboxes", "bbox", "conf"}], "lines": [line index]}].
+    """
+    tables, entries, spans, numeric, page, bottom = [], [], [], [], None, 0.0
+
+    def _close():
+        if entries:
+            table = _build_table(page, entries, min_cols, min_rows)
+            if table:
+                tables.append(table)
+
+    for i, line in enumerate(lines):
+        cells = line_cells(line)
+        lpage, lb, h = line[0].get("page", 1), line_bbox(line), _median_height(line)
+        if entries and lpage == page:
+            gap = lb[1] - bottom
+            if len(cells) >= min_cols and gap <= row_gap * h:
+                entries.append((i, cells, True))
+                _add_spans(spans, cells)
+                _add_spans(numeric, [c for c in cells if _is_numeric(c["text"])])
+                bottom = lb[3]
+                continue
+            if len(cells) < min_cols and gap <= wrap_gap * h and _within_columns(cells, spans, numeric):
+                entries.append((i, cells, False))
+                bottom = lb[3]
+                continue
+        _close()
+        entries, spans, numeric, page, bottom = [], [], [], lpage, lb[3]
+        if len(cells) >= min_cols:
+            entries.append((i, cells, True))
+            _add_spans(spans, cells)
+            _add_spans(numeric, [c for c in cells if _is_numeric(c["text"])])
+    _close()
+    return tables
+
+
+# Header keywords per LineItem column, most specific first; unit_price is matched before
+# quantity so "Unit price" is not taken for a quantity column
+ITEM_COLUMNS = (
+    ("unit_price", ("unit price", "unit cost", "price", "rate", "mrp")),
+    ("quantity", ("qty", "quantity", "units", "nos")),
+    ("description", ("description", "item", "product", "particulars", "service", "medicine", "details", "name")),
+    ("amount", ("amount", "line total", "gross", "total", "amt", "worth", "value")),
+)
+SUMMARY_WORDS = ("total", "subtotal", "sub total", "tax", "vat", "discount", "balance", "amount due")
+
+
+def item_columns(header: List[str]) -> Dict[str, int]:
+    """Map LineItem keys (description, quantity, unit_price, amount) to header column indices."""
+    names = [h.lower() for h in header]
+    out = {}
+    for key, words in ITEM_COLUMNS:
+        for word in words:
+            col = next((i for i, n in enumerate(names) if word in n and i not in out.values()), None)
+            if col is not None:
+                out[key] = col
+                break
+    return out
+
+
+def table_line_items(tables: List[Dict]) -> Optional[List[Dict]]:
+    """
+    LineItem dicts ({description, quantity, unit_price, amount, source, confidence}) parsed
+    from the item tables found by find_tables, without the LLM. A table is an item table
+    when its header has description and amount columns; a row naming a total / tax ends it.
+    Returns None when there is no item table or one is not clean (a row without a
+    description, or a number that does not parse): leave line items to the LLM then.
+    """
+    items, found = [], False
+    for table in tables:
+        cols = item_columns(table["header"] or [])
+        if "description" not in cols or "amount" not in cols:
+            continue
+        found = True
+        for row in table["rows"]:
+            cell = {key: row["cells"][i].strip() for key, i in cols.items()}
+            if not cell["description"]:
+                return None
+            desc = cell["description"].lower()
+            if not cell.get("quantity") and any(desc.startswith(w) for w in SUMMARY_WORDS):
+                break
+            values = {key: parse_amount(cell[key]) if cell.get(key) else None
+                      for key in ("quantity", "unit_price", "amount")}
+            if values["amount"] is None or any(cell.get(k) and values[k] is None for k in values):
+                return None
+            items.append({
+                "description": cell["description"],
+                **values,
+                "source": {"page": table["page"], "bbox": [int(v) for v in row["bbox"]]},
+                "confidence": round(row["conf"], 2),
+            })
+    return items if found and items else None
@@ -0,0 +1,480 @@
+# extractor/llm_client.py
+"""
+Shared LLM client: pooled HTTP connections, a requests/min + tokens/min token bucket,
+exponential backoff with jitter that honours Retry-After, and a circuit breaker.
+
+One LLMClient is meant to be shared by every thread in the process (app, batch, and
+the service, whose asyncio handlers hand LLM work to a thread pool), so all callers
+draw from the same quota and connection pool:
+
+    client = LLMClient.from_env()
+    text = client.complete(messages, model=..., temperature=0.3)
+
+complete_hedged() routes a request over an ordered list of models (ModelRoute, with
+a latency SLO each): the next model is tried when one fails, and hedged when one is
+slower than its p95 latency; the first valid answer wins.
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Sequence
+
+from extractor import metrics
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the provider while the circuit breaker is open."""
+
+
+class LLMCancelled(RuntimeError):
+    """Raised by a request whose result is no longer wanted (another hedged request won)."""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at `rate_per_min`, holding at most `capacity`
+    (default: one minute's worth). The balance may go negative when actual usage
+    exceeds a reservation; later callers then wait for the debt to refill.
+    """
+
+    def __init__(self, rate_per_min: float, capacity: Optional[float] = None):
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_min
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self, n: float) -> float:
+        """Take `n` tokens and return 0.0, or take nothing and return the seconds to wait."""
+        n = min(n, self.capacity)  # a request larger than the bucket would never fit
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= n:
+                self._tokens -= n
+                return 0.0
+            return (n - self._tokens) / self.rate
+
+    def adjust(self, n: float) -> None:
+        """Charge (n > 0) or refund (n < 0) tokens after the fact, without waiting."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens - n)
+
+
+class RateLimiter:
+    """Requests/min and tokens/min buckets plus a shared pause set from Retry-After."""
+
+    def __init__(self, requests_per_min: Optional[float] = None, tokens_per_min: Optional[float] = None):
+        self.requests = TokenBucket(requests_per_min) if requests_per_min else None
+        self.tokens = TokenBucket(tokens_per_min) if tokens_per_min else None
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller for `seconds` (the provider said so), instead of each retrying alone."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _wait_time(self, n_tokens: float) -> float:
+        with self._lock:
+            paused = self._paused_until - time.monotonic()
+        if paused > 0:
+            return paused
+        if self.requests is not None:
+            wait = self.requests.try_take(1)
+            if wait:
+                return wait
+        if self.tokens is not None:
+            wait = self.tokens.try_take(n_tokens)
+            if wait:
+                if self.requests is not None:
+                    self.requests.adjust(-1)  # give the request slot back while waiting
+                return wait
+        return 0.0
+
+    def acquire(self, n_tokens: float = 0) -> float:
+        """Block until one request and `n_tokens` are available; returns the seconds waited."""
+        waited = 0.0
+        while True:
+            wait = self._wait_time(n_tokens)
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def settle(self, reserved: float, used: float) -> None:
+        """Correct the tokens/min bucket once the real usage of a request is known."""
+        if self.tokens is not None and used:
+            self.tokens.adjust(used - reserved)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds; then lets one trial call through (half-open) and
+    closes again on its success.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> None:
+        with self._lock:
+            if self.state == "closed":
+                return
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if self.state == "open" and remaining <= 0:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return
+            raise CircuitOpenError(f"LLM circuit open, retry in {max(0.0, remaining):.1f}s")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state, self._failures, self._trial_running = "closed", 0, False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+def retry_after(err: Exception) -> Optional[float]:
+    """Seconds requested by a Retry-After / retry-after-ms header on an API error, if any."""
+    response = getattr(err, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:  # HTTP-date form
+        import email.utils
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(err: Exception) -> bool:
+    """Rate limits, timeouts, connection errors and 5xx are retried; other 4xx are not."""
+    status = getattr(err, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    return not isinstance(err, (ValueError, TypeError))
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**(attempt-1)))."""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+def estimate_tokens(messages: List[Dict], max_tokens: int) -> int:
+    """Tokens reserved for a request before sending it (~4 chars per token plus the completion budget)."""
+    return sum(len(m.get("content") or "") for m in messages) // 4 + max_tokens
+
+
+class ModelRoute:
+    """One model in a routing policy, with the latency (seconds) it is expected to answer within."""
+
+    __slots__ = ("model", "slo_s")
+
+    def __init__(self, model: str, slo_s: float = 20.0):
+        self.model = model
+        self.slo_s = slo_s
+
+    def __repr__(self):
+        return f"ModelRoute({self.model!r}, slo_s={self.slo_s})"
+
+
+def parse_model_routes(spec: str, default_slo: float = 20.0) -> List[ModelRoute]:
+    """Parse "model-a@8,model-b@15" (SLO seconds after @, optional) into ModelRoutes."""
+    routes = []
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        model, _, slo = part.rpartition("@") if "@" in part else (part, "", "")
+        try:
+            routes.append(ModelRoute(model.strip(), float(slo) if slo else default_slo))
+        except ValueError:
+            print(f"[LLM ERROR] Ignoring bad SLO in model route {part!r}")
+    return routes
+
+
+class LatencyTracker:
+    """Recent successful-call latencies per model; p95 once `min_samples` are in."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def p95(self, model: str) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+
+
+class LLMClient:
+    """
+    Rate-limited, retrying chat-completions client over a pooled OpenAI-compatible
+    connection. The SDK client is created on first use; all threads share it, the
+    limiter and the breaker, so they count against one quota.
+    """
+
+    def __init__(self, base_url: str = "https://openrouter.ai/api/v1", api_key: Optional[str] = None,
+                 requests_per_min: Optional[float] = None, tokens_per_min: Optional[float] = None,
+                 max_connections: int = 32, timeout: float = 120.0, max_attempts: int = 4,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 default_headers: Optional[Dict[str, str]] = None, max_hedges: Optional[int] = None):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.default_headers = default_headers
+        self.limiter = RateLimiter(requests_per_min, tokens_per_min)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latency = LatencyTracker()
+        self.max_hedges = max_hedges if max_hedges is not None else max(1, max_connections // 4)
+        self._surplus = 0  # hedges and abandoned losers still in flight (see complete_hedged)
+        self._hedge_pool = None
+        self._sync = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, **overrides) -> "LLMClient":
+        """
+        Settings from LLM_BASE_URL, OPENROUTER_API_KEY, LLM_RPM, LLM_TPM, LLM_MAX_CONNECTIONS,
+        LLM_TIMEOUT and LLM_MAX_HEDGES.
+        """
+        def num(name):
+            v = os.getenv(name)
+            return float(v) if v else None
+        kwargs = dict(
+            base_url=os.getenv("LLM_BASE_URL", "https://openrouter.ai/api/v1"),
+            api_key=os.getenv("OPENROUTER_API_KEY"),
+            requests_per_min=num("LLM_RPM"),
+            tokens_per_min=num("LLM_TPM"),
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", 32)),
+            timeout=float(os.getenv("LLM_TIMEOUT", 120)),
+            max_hedges=int(os.getenv("LLM_MAX_HEDGES")) if os.getenv("LLM_MAX_HEDGES") else None,
+        )
+        kwargs.update(overrides)
+        return cls(**kwargs)
+
+    def _limits(self):
+        import httpx  # the openai SDK's HTTP library
+
+        return httpx.Limits(max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_connections,
+                            keepalive_expiry=60.0)
+
+    def _client_kwargs(self) -> Dict:
+        # max_retries=0: retries, backoff and rate limiting are handled here
+        return dict(base_url=self.base_url, api_key=self.api_key, timeout=self.timeout,
+                    max_retries=0, default_headers=self.default_headers)
+
+    @property
+    def sync_client(self):
+        if self._sync is None:
+            with self._lock:
+                if self._sync is None:
+                    from openai import OpenAI, DefaultHttpxClient
+                    self._sync = OpenAI(http_client=DefaultHttpxClient(limits=self._limits()),
+                                        **self._client_kwargs())
+        return self._sync
+
+    def _request(self, messages, model, temperature, max_tokens, extra):
+        req = dict(model=model, messages=messages, temperature=temperature, max_tokens=max_tokens)
+        req.update(extra)
+        return req
+
+    def _finish(self, completion, rec, reserved) -> str:
+        content = completion.choices[0].message.content
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            rec["prompt_tokens"] = getattr(usage, "prompt_tokens", 0) or 0
+            rec["completion_tokens"] = getattr(usage, "completion_tokens", 0) or 0
+            self.limiter.settle(reserved, rec["prompt_tokens"] + rec["completion_tokens"])
+        rec["response_chars"] = len(content or "")
+        self.breaker.record_success()
+        return content
+
+    def _on_error(self, err: Exception, attempt: int, attempts: int) -> float:
+        """Record a failed attempt; return the delay before the next one or re-raise."""
+        retryable = is_retryable(err)
+        status = getattr(err, "status_code", None)
+        if status is None or status >= 500:
+            self.breaker.record_failure()  # outages trip the breaker
+        else:
+            self.breaker.record_success()  # 4xx / 429: the provider is up and answering
+        if not retryable or attempt >= attempts:
+            raise err
+        delay = backoff_delay(attempt)
+        hinted = retry_after(err)
+        if hinted is not None:
+            delay = max(delay, hinted)
+            if status == 429:
+                self.limiter.pause(hinted)
+        print(f"[LLM ERROR] Attempt {attempt} failed ({status or type(err).__name__}), retrying in {delay:.1f}s: {err}")
+        return delay
+
+    def complete(self, messages, model: str, temperature: float = 0.0, max_tokens: int = 1200,
+                 max_attempts: Optional[int] = None, cancel: Optional[threading.Event] = None, **extra) -> str:
+        """
+        Chat completion text, retried on transient errors; raises the last error otherwise.
+        Setting `cancel` stops further attempts (an in-flight HTTP call still completes).
+        """
+        attempts = max_attempts or self.max_attempts
+        reserved = estimate_tokens(messages, max_tokens)
+        for attempt in range(1, attempts + 1):
+            if cancel is not None and cancel.is_set():
+                raise LLMCancelled(f"{model}: cancelled")
+            self.breaker.allow()
+            waited = self.limiter.acquire(reserved)
+            try:
+                with metrics.stage("call_llm", model=model, attempt=attempt, rate_wait_s=round(waited, 3)) as rec:
+                    t0 = time.perf_counter()
+                    completion = self.sync_client.chat.completions.create(
+                        **self._request(messages, model, temperature, max_tokens, extra))
+                    self.latency.record(model, time.perf_counter() - t0)
+                    return self._finish(completion, rec, reserved)
+            except Exception as e:
+                delay = self._on_error(e, attempt, attempts)
+                if cancel is not None:
+                    cancel.wait(delay)
+                else:
+                    time.sleep(delay)
+
+    def hedge_delay(self, route: ModelRoute) -> float:
+        """Seconds to wait on `route` before hedging: its observed p95, capped by its SLO."""
+        p95 = self.latency.p95(route.model)
+        return route.slo_s if p95 is None else min(p95, route.slo_s)
+
+    def _hold_surplus(self, fut) -> None:
+        with self._lock:
+            self._surplus += 1
+        fut.add_done_callback(self._release_surplus)
+
+    def _release_surplus(self, _fut) -> None:
+        with self._lock:
+            self._surplus -= 1
+
+    def complete_hedged(self, messages, routes: Sequence[ModelRoute],
+                        validate: Optional[Callable[[str], bool]] = None, return_model: bool = False,
+                        **kwargs):
+        """
+        Complete over an ordered list of models. routes[0] is asked first; the next route
+        is started when every running request has failed (fallback), or when the latest
+        one has not answered within hedge_delay (hedge). The first response passing
+        `validate` wins. With one route this is complete(). With `return_model`, returns
+        (text, model that answered).
+
+        The other requests are abandoned, not aborted: they stop retrying, but an HTTP
+        call already in flight runs to the end on its pool thread and connection (the
+        sync SDK cannot interrupt it). So hedging cannot multiply load during a latency
+        spike, at most `max_hedges` hedges and abandoned requests are in flight across
+        all callers; past that, slow requests are waited for instead of hedged (failed
+        ones still fall back).
+        """
+        routes = list(routes)
+        if len(routes) == 1:
+            text = self.complete(messages, model=routes[0].model, **kwargs)
+            return (text, routes[0].model) if return_model else text
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+        with self._lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=self.max_connections,
+                                                      thread_name_prefix="llm-hedge")
+        running: Dict = {}  # future -> (route, cancel event)
+        held = set()  # futures counted in self._surplus
+        errors = []
+        launched = 0
+        deadline = None
+
+        def launch(hedge=False):
+            nonlocal launched, deadline
+            route = routes[launched]
+            launched += 1
+            ev = threading.Event()
+            fut = self._hedge_pool.submit(metrics.bind(self.complete), messages, model=route.model,
+                                          cancel=ev, **kwargs)
+            running[fut] = (route, ev)
+            if hedge:
+                held.add(fut)
+                self._hold_surplus(fut)
+            deadline = time.monotonic() + self.hedge_delay(route) if launched < len(routes) else None
+
+        with metrics.stage("llm_route", primary=routes[0].model) as rec:
+            launch()
+            while running:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    if self._surplus >= self.max_hedges:
+                        rec["hedge_capped"] = 1
+                        deadline = None  # wait for what is running; a failure still falls back
+                        continue
+                    print(f"[LLM] {running[next(iter(running))][0].model} slower than "
+                          f"{self.hedge_delay(routes[launched - 1]):.1f}s, hedging to {routes[launched].model}")
+                    rec["hedged"] = rec.get("hedged", 0) + 1
+                    launch(hedge=True)
+                    continue
+                for fut in done:
+                    route, _ = running.pop(fut)
+                    try:
+                        raw = fut.result()
+                    except Exception as e:
+                        errors.append(f"{route.model}: {e}")
+                        continue
+                    if validate is None or validate(raw):
+                        for other, (_, ev) in running.items():
+                            ev.set()
+                            if not other.cancel() and other not in held:
+                                self._hold_surplus(other)  # in flight: abandoned
+                        rec["served_by"] = route.model
+                        rec["fallback"] = int(route is not routes[0])
+                        return (raw, route.model) if return_model else raw
+                    errors.append(f"{route.model}: invalid response")
+                if not running and launched < len(routes):
+                    launch()  # everything in flight failed: fall back to the next model
+            rec["outcome"] = "error"
+        raise RuntimeError(f"All {len(routes)} models failed: " + "; ".join(errors))
@@ -3,37 +3,56 @@ import os
 import json
 import copy
 import re
+import threading
+from collections import Counter
 from typing import List, Dict, Any
-from pydantic import ValidationError
-from extractor.schema import ExtractionResult
-from openai import OpenAI
-from dotenv import load_dotenv
-import time
-import random
+from extractor.cache import make_key
+from extractor.layout import group_lines, line_bbox, lines_near, line_cells, find_tables, table_line_items
+from extractor import metrics
+from extractor.llm_client import LLMClient, ModelRoute, parse_model_routes
+from extractor.confidence import asked_runs, field_agreement, run_values
 
 
-# Load env vars from .env
-load_dotenv()
+DEFAULT_MODEL = "openai/gpt-oss-20b:free"
+LINE_ITEM_FIELDS = ("LineItems", "Medications")
 
-# Initialize OpenRouter client
-api_key = os.getenv("OPENROUTER_API_KEY")
-print("Using API key:", api_key)    # Debug print (optional)
+_client = None
+_client_lock = threading.Lock()
 
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=api_key
-)
+
+def get_client():
+    """
+    The LLM client shared by every thread, created on first use (after loading
+    .env) so importing this module opens no connections and reads no credentials.
+    Rate limits and pool size come from env (LLM_RPM, LLM_TPM, ...; see LLMClient.from_env).
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from dotenv import load_dotenv
+                load_dotenv()
+                _client = LLMClient.from_env(default_headers={
+                    "HTTP-Referer": "<YOUR_SITE_URL>",
+                    "X-Title": "<YOUR_SITE_NAME>",
+                })
+    return _client
+
+def _json_block(raw: str):
+    """First {...} block of `raw` with single quotes and trailing commas repaired, or None."""
+    m = re.search(r"\{.*\}", raw, re.S)
+    if not m:
+        return None
+    fixed = m.group(0).replace("'", '"')
+    return re.sub(r",\s*([}\]])", r"\1", fixed)
 
 def safe_json_parse(raw: str):
     try:
         return json.loads(raw)
     except json.JSONDecodeError:
         # Try to extract first JSON-like block
-        m = re.search(r"\{.*\}", raw, re.S)
-        if m:
-            fixed = m.group(0)
-            fixed = fixed.replace("'", '"')
-            fixed = re.sub(r",\s*([}\]])", r"\1", fixed)
+        fixed = _json_block(raw)
+        if fixed is not None:
             try:
                 return json.loads(fixed)
             except Exception as e:
@@ -41,36 +60,135 @@ def safe_json_parse(raw: str):
                 return {"doc_type": "unknown", "fields": [], "overall_confidence": 0.0, "qa": {"passed_rules": [], "failed_rules": [], "notes": "json parse failed"}}
         return {"doc_type": "unknown", "fields": [], "overall_confidence": 0.0, "qa": {"passed_rules": [], "failed_rules": [], "notes": "no json detected"}}
 
-        
-def call_llm(messages, model="openai/gpt-oss-20b:free", temperature=0.0, max_tokens=1200, retries=3):
-    """Call the LLM via OpenRouter/OpenAI client with retries (Windows-safe)."""
-    last_err = None
-    for attempt in range(1, retries + 1):
-        try:
-            completion = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                response_format={"type": "json_object"},
-                extra_headers={
-                    "HTTP-Referer": "<YOUR_SITE_URL>",
-                    "X-Title": "<YOUR_SITE_NAME>",
-                },
-            )
-            return completion.choices[0].message.content
+def is_valid_json(raw) -> bool:
+    """True if `raw` holds a JSON object that safe_json_parse reads without its fallback."""
+    if not raw:
+        return False
+    try:
+        return isinstance(json.loads(raw), dict)
+    except json.JSONDecodeError:
+        fixed = _json_block(raw)
+    try:
+        return fixed is not None and isinstance(json.loads(fixed), dict)
+    except json.JSONDecodeError:
+        return False
 
-        except Exception as e:
-            last_err = e
-            print(f"[LLM ERROR] Attempt {attempt} failed: {e}")
-            # backoff between retries
-            time.sleep(random.uniform(1, 3))
+def model_routes(model=DEFAULT_MODEL):
+    """
+    Models to try for a request: `model` first, then the others listed in LLM_MODELS
+    ("model-a@8,model-b@15", SLO seconds after @; default LLM_SLO_S, 20s).
+    With LLM_MODELS unset this is just `model`.
+    """
+    default_slo = float(os.getenv("LLM_SLO_S", 20))
+    listed = parse_model_routes(os.getenv("LLM_MODELS", ""), default_slo=default_slo)
+    primary = next((r for r in listed if r.model == model), ModelRoute(model, default_slo))
+    return [primary] + [r for r in listed if r.model != model]
 
-    # After all retries fail
-    raise RuntimeError(f"LLM call failed after {retries} retries: {last_err}")
+def call_llm(messages, model=DEFAULT_MODEL, temperature=0.0, max_tokens=1200, retries=3, routes=None,
+             return_model=False):
+    """
+    Call the LLM through the shared client: rate limited, retried with exponential
+    backoff (honouring Retry-After) on 429 / 5xx / network errors, and failing fast
+    while the circuit breaker is open.
 
-def build_prompt(ocr_text, ocr_tokens, expected_fields, doc_type=None):
-    """Return messages for the chat model. Keep instructions strict: return JSON only."""
+    `routes` (default: model_routes(model)) lists fallback models with latency SLOs:
+    a slow model is hedged with the next one after its p95 latency, a failing one is
+    replaced, and the first response that is valid JSON wins (see LLMClient.complete_hedged).
+    With `return_model`, returns (text, model that answered).
+    """
+    try:
+        return get_client().complete_hedged(
+            messages, routes or model_routes(model), validate=is_valid_json, return_model=return_model,
+            temperature=temperature, max_tokens=max_tokens, max_attempts=retries,
+            response_format={"type": "json_object"},
+        )
+    except Exception as e:
+        raise RuntimeError(f"LLM call failed: {e}") from e
+
+def encode_tokens_compact(ocr_tokens, quant=1):
+    """
+    Compact, line-grouped token encoding for the prompt.
+    One row per text line: `p<page> y<y1>,<y2> | word@x1,x2,conf word@x1,x2,conf ...`
+    Coordinates are integers in units of `quant` pixels and conf is a 0-99 percentage,
+    so the "text"/"conf"/"bbox" keys are not repeated for every token.
+    Tokens from region OCR add the layout blocks of the line: `p<page> b<id>[,<id>] y...`.
+    """
+    q = max(1, int(quant))
+    rows = []
+    for line in group_lines(ocr_tokens):
+        _, y1, _, y2 = line_bbox(line)
+        words = " ".join(
+            f"{t['text']}@{round(t['bbox'][0] / q)},{round(t['bbox'][2] / q)},{min(99, int(t['conf'] * 100))}"
+            for t in line
+        )
+        blocks = sorted({t.get("block_id", 0) for t in line} - {0})
+        tag = f" b{','.join(map(str, blocks))}" if blocks else ""
+        rows.append(f"p{line[0].get('page', 1)}{tag} y{round(y1 / q)},{round(y2 / q)} | {words}")
+    return "\n".join(rows)
+
+def encode_tokens_layout(ocr_tokens, quant=1):
+    """
+    Layout encoding for the prompt, shorter than encode_tokens_compact: words are merged
+    into cells (see layout.line_cells) and only cells carry coordinates, no per-word conf.
+    One row per text line: `p<page> y<y1>,<y2> | cell text@<x1>,<x2> | ...`.
+    A table (see layout.find_tables) starts with `p<page> table: <col> | <col> ...` and has
+    one row per table row (wrapped lines merged) with one cell per column, `-` when empty.
+    """
+    q = max(1, int(quant))
+    lines = group_lines(ocr_tokens)
+    tables = {t["lines"][0]: t for t in find_tables(lines)}
+    skip = {i for t in tables.values() for i in t["lines"]}
+
+    def _cell(text, bbox):
+        return f"{text}@{round(bbox[0] / q)},{round(bbox[2] / q)}" if text else "-"
+
+    def _row(page, bbox, cells):
+        return f"p{page} y{round(bbox[1] / q)},{round(bbox[3] / q)} | " + " | ".join(cells)
+
+    rows = []
+    for i, line in enumerate(lines):
+        table = tables.get(i)
+        if table:
+            head = table["header"] or [f"col{k + 1}" for k in range(len(table["columns"]))]
+            rows.append(f"p{table['page']} table: " + " | ".join(h or "-" for h in head))
+            rows.extend(_row(table["page"], r["bbox"], [_cell(c, b) for c, b in zip(r["cells"], r["cell_bboxes"])])
+                        for r in table["rows"])
+        elif i not in skip:
+            rows.append(_row(line[0].get("page", 1), line_bbox(line),
+                             [_cell(c["text"], c["bbox"]) for c in line_cells(line)]))
+    return "\n".join(rows)
+
+def _has_blocks(ocr_tokens):
+    block = getattr(ocr_tokens, "block", None)
+    if block is not None:
+        return bool(block.any())
+    return any(t.get("block_id") for t in ocr_tokens)
+
+def _scale_sources(result, quant):
+    """Map bboxes returned in compact-encoding units back to pixels."""
+    if quant == 1 or not isinstance(result, dict):
+        return result
+    for item in (result.get("fields") or []) + (result.get("line_items") or []):
+        src = item.get("source") if isinstance(item, dict) else None
+        if isinstance(src, dict) and isinstance(src.get("bbox"), list):
+            try:
+                src["bbox"] = [int(round(float(v) * quant)) for v in src["bbox"]]
+            except (TypeError, ValueError):
+                pass
+    return result
+
+@metrics.instrument("build_prompt", lambda res, ocr_text, ocr_tokens, *a, **k: {
+    "tokens": len(ocr_tokens), "prompt_chars": sum(len(m["content"]) for m in res)})
+def build_prompt(ocr_text, ocr_tokens, expected_fields, doc_type=None, token_format="json", quant=1,
+                 line_items=True):
+    """Return messages for the chat model. Keep instructions strict: return JSON only.
+
+    token_format="json" sends OCR_TEXT plus every token as a JSON object (original format);
+    token_format="compact" sends only line-grouped rows from `encode_tokens_compact`,
+    which carry the same text and layout in a fraction of the input tokens;
+    token_format="layout" sends cells and reconstructed tables (`encode_tokens_layout`),
+    shorter still. line_items=False leaves line_items out of the requested output.
+    """
     system = {
         "role": "system",
         "content": (
@@ -80,33 +198,459 @@ def build_prompt(ocr_text, ocr_tokens, expected_fields, doc_type=None):
         )
     }
     hint = f"\nDOC_TYPE_HINT: {doc_type}" if doc_type else ""
+    if token_format == "compact":
+        unit = "pixels" if int(quant) <= 1 else f"units of {int(quant)} pixels"
+        ocr_block = (
+            "OCR_LINES (one text line per row: `p<page> y<y1>,<y2> | word@<x1>,<x2>,<conf%> ...`; "
+            f"a word's bbox is [x1,y1,x2,y2], coordinates in {unit}"
+            + ("; `b<id>` lists the layout blocks (header, address, table, totals box ...) on the row"
+               if _has_blocks(ocr_tokens) else "")
+            + "):\n"
+            + encode_tokens_compact(ocr_tokens, quant=quant) + "\n\n"
+        )
+    elif token_format == "layout":
+        from extractor.tokens import as_dicts
+        unit = "pixels" if int(quant) <= 1 else f"units of {int(quant)} pixels"
+        ocr_block = (
+            "OCR_LINES (one text line per row: `p<page> y<y1>,<y2> | cell text@<x1>,<x2> | ...`; "
+            f"a cell's bbox is [x1,y1,x2,y2], coordinates in {unit}; tables start with "
+            "`p<page> table: <column headers>` and then have one row per table row, one cell per column):\n"
+            + encode_tokens_layout(as_dicts(ocr_tokens), quant=quant) + "\n\n"
+        )
+    else:
+        from extractor.tokens import as_dicts
+        ocr_block = (
+            "OCR_TEXT:\n" + ocr_text + "\n\n"
+            "OCR_TOKENS (list of token objects: text, conf, bbox):\n" + json.dumps(as_dicts(ocr_tokens)) + "\n\n"
+        )
     human = {
         "role": "user",
         "content": (
-            "OCR_TEXT:\n" + ocr_text + "\n\n"
-            "OCR_TOKENS (list of token objects: text, conf, bbox):\n" + json.dumps(ocr_tokens) + "\n\n"
+            ocr_block +
             "EXTRACT FIELDS: " + json.dumps(expected_fields) +
             hint +
             "\n\nReturn JSON with keys: "
             "doc_type, fields (list of {name, value, confidence, source:{page,bbox}}), "
-            "line_items (if present), overall_confidence (0..1), "
+            + ("line_items (if present), " if line_items else "") +
+            "overall_confidence (0..1), "
             "qa (passed_rules, failed_rules, notes)."
         )
     }
     return [system, human]
 
-def extract_with_llm(ocr_text, ocr_tokens, expected_fields, n_consistency=3, doc_type=None):
-    runs = []
-    for i in range(n_consistency):
-        messages = build_prompt(ocr_text, ocr_tokens, expected_fields, doc_type=doc_type)
-        temp = 0.0 if n_consistency == 1 else 0.3
-        raw = call_llm(messages, temperature=temp)
-        j = safe_json_parse(raw)
-        runs.append(j)
+def prompt_size(messages):
+    """Return (chars, approx_tokens) for a list of chat messages (~4 chars per token)."""
+    chars = sum(len(m["content"]) for m in messages)
+    return chars, (chars + 3) // 4
+
+def _run_llm(messages, indices, model=DEFAULT_MODEL, temperature=0.0, cache=None, llm=None,
+             quant=1, max_concurrency=None):
+    """
+    One LLM call per run index for the same `messages`, through a bounded thread pool.
+    Returns [(parsed_result, None) | (None, exception)] in index order.
+    Answers are cached under the model that gave them, so one from a fallback model
+    (see call_llm) is never served later as the requested model's.
+    """
+    def _run(i):
+        raw = cache.get(make_key(model, temperature, messages, i)) if cache is not None else None
+        if raw is None:
+            if llm is None:
+                raw, served = call_llm(messages, model=model, temperature=temperature, return_model=True)
+            else:
+                raw, served = llm(messages, model=model, temperature=temperature), model
+            if cache is not None:
+                cache.set(make_key(served, temperature, messages, i), raw)
+        return _scale_sources(safe_json_parse(raw), quant)
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    indices = list(indices)
+    workers = max(1, min(max_concurrency or len(indices), len(indices)))
+    outcomes = []
+    if workers == 1:
+        for i in indices:
+            try:
+                outcomes.append((_run(i), None))
+            except Exception as e:
+                outcomes.append((None, e))
+        return outcomes
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(metrics.bind(_run), i) for i in indices]
+        for fut in futures:  # submission order keeps results deterministic
+            try:
+                outcomes.append((fut.result(), None))
+            except Exception as e:
+                outcomes.append((None, e))
+    return outcomes
+
+
+def _field_regions(runs, fields):
+    """(page, bbox) candidates for `fields` from the runs' sources; None if a field has none."""
+    regions = []
+    for name in fields:
+        found = []
+        for run in runs:
+            for ff in run.get("fields", []):
+                src = ff.get("source") if ff.get("name") == name else None
+                try:
+                    bbox = [float(v) for v in src["bbox"]]
+                    if len(bbox) == 4:
+                        found.append((int(src["page"]), bbox))
+                except (KeyError, TypeError, ValueError):
+                    continue
+        if not found:
+            return None
+        regions += found
+    return regions
+
+
+def build_field_prompt(runs, ocr_tokens, fields, doc_type=None, quant=1, context=1):
+    """
+    Targeted re-extraction prompt: only `fields` and the OCR lines around the bboxes the
+    runs gave for them (see layout.lines_near), in the compact encoding.
+    Returns None when some field has no usable source bbox to target.
+    """
+    regions = _field_regions(runs, fields)
+    if regions is None:
+        return None
+    lines = group_lines(ocr_tokens)
+    picked = [tok for i in lines_near(lines, regions, context=context) for tok in lines[i]]
+    if not picked:
+        return None
+    return build_prompt("", picked, fields, doc_type=doc_type, token_format="compact", quant=quant)
+
+
+def _targeted_run(answer, fields):
+    """A targeted answer as a run holding only `fields`, listed in "_fields" so it only votes on them."""
+    return {
+        "doc_type": answer.get("doc_type"),
+        "fields": [f for f in answer.get("fields", []) if f.get("name") in fields],
+        "_fields": list(fields),
+    }
+
+
+def _consensus(runs, fields):
+    """Majority value per field over the runs that asked for it (first wins ties), with its field entry."""
+    out = {}
+    for name in fields:
+        asked = asked_runs(runs, name)
+        vals = run_values(asked, name)
+        keys = [str(v).strip().lower() if v is not None else None for v in vals]
+        counts = Counter(k for k in keys if k is not None)
+        if not counts:
+            continue
+        best = max(counts.values())
+        i = next(i for i, k in enumerate(keys) if k is not None and counts[k] == best)
+        out[name] = next(f for f in asked[i]["fields"] if f.get("name") == name)
+    return out
+
+
+def requery_fields(result, ocr_tokens, fields, n_runs=1, doc_type=None, cache=None,
+                   model=DEFAULT_MODEL, quant=1, llm=None, max_concurrency=None, context=1):
+    """
+    Re-extract only the disputed `fields` of an extract_with_llm result from the OCR lines
+    near their candidate bboxes, instead of resending the whole document.
+
+    Each answer is appended to `_llm_runs` as a run holding only `fields` (listed in its
+    "_fields"), so it votes on those fields and nothing else: agreement and confidence of
+    each field are computed over the runs that asked for it (see confidence.asked_runs).
+    The result's entries for `fields` become the majority answer. Returns the updated result (modified in place),
+    or it unchanged when the fields cannot be located.
+    """
+    runs = result.get("_llm_runs") or [result]
+    fields = list(fields)
+    messages = build_field_prompt(runs, ocr_tokens, fields, doc_type=doc_type or result.get("doc_type"),
+                                  quant=quant, context=context)
+    if not fields or messages is None:
+        return result
+    start = len(runs) + len(result.get("_llm_errors", []))
+    outcomes = _run_llm(messages, range(start, start + n_runs), model=model, temperature=0.3,
+                        cache=cache, llm=llm, quant=quant, max_concurrency=max_concurrency)
+    answers = [j for j, err in outcomes if err is None]
+    for i, (_, err) in enumerate(outcomes):
+        if err is not None:
+            print(f"[LLM ERROR] Targeted run {start + i} failed: {err}")
+    if not answers:
+        return result
+
+    runs = runs + [_targeted_run(a, fields) for a in answers]
+    winners = _consensus(runs, fields)
+    result["fields"] = [
+        copy.deepcopy(winners[f["name"]]) if f.get("name") in winners else f
+        for f in result.get("fields", [])
+    ]
+    have = {f.get("name") for f in result["fields"]}
+    result["fields"] += [copy.deepcopy(winners[n]) for n in fields if n in winners and n not in have]
+    result["_llm_runs"] = runs
+    result.setdefault("_llm_requery", []).append({
+        "fields": fields,
+        "runs": len(answers),
+        "prompt_chars": prompt_size(messages)[0],
+    })
+    return result
+
+
+def extract_with_llm(ocr_text, ocr_tokens, expected_fields, n_consistency=3, doc_type=None,
+                     max_concurrency=None, cache=None, model=DEFAULT_MODEL,
+                     token_format="json", quant=1, llm=None,
+                     max_runs=None, agreement_threshold=1.0, requery="full", table_items=False,
+                     rules=False):
+    """
+    Run `n_consistency` extractions and return the first successful run plus all runs.
+
+    The runs are independent, so they are sent concurrently through a bounded thread
+    pool (`max_concurrency` workers, default: all runs at once; 1 = sequential).
+    Runs are kept in submission order. A failing run is logged in `_llm_errors` and
+    left out of `_llm_runs`; the call only raises if every run fails.
+
+    Adaptive mode (`max_runs` set, at least 2): instead of `n_consistency` runs, 2 runs
+    are sent and extra runs are issued one at a time only while some requested field's
+    agreement (see confidence.field_agreement) is below `agreement_threshold`, up to
+    `max_runs`. Documents whose runs agree stop early; `_llm_adaptive` records what happened.
+    With requery="fields" the extra runs ask only for the disputed fields, over the
+    OCR lines near their bboxes (see requery_fields); if a disputed field has no
+    usable bbox, a full run is sent instead.
+
+    With a `cache` (see extractor.cache), raw responses are stored under a hash of
+    (model, temperature, messages, run index), so re-processing the same document
+    costs no LLM calls.
+
+    `token_format` / `quant` select the prompt encoding (see build_prompt); bboxes
+    returned in quantized units are scaled back to pixels.
+
+    `llm` replaces call_llm (same signature), e.g. a recorded or stub backend.
+
+    With `table_items`, line items are parsed from the reconstructed item table when it is
+    clean (see layout.table_line_items): the line-item fields are then left out of the
+    prompt (no LLM call at all if nothing else is asked) and `_line_items` is "table".
+
+    With `rules`, fields found next to their printed label with a valid, confident value
+    (see extractor.rules) are answered without the LLM and only the others are asked for;
+    `_rules` lists the fields answered that way.
+    """
+    rule_fields = []
+    if rules:
+        from extractor.rules import extract_with_rules
+        rule_fields, expected_fields = extract_with_rules(ocr_tokens, expected_fields)
+    items = None
+    if table_items and any(f in LINE_ITEM_FIELDS for f in expected_fields):
+        from extractor.tokens import as_dicts
+        items = table_line_items(find_tables(group_lines(as_dicts(ocr_tokens))))
+    if items is not None:
+        expected_fields = [f for f in expected_fields if f not in LINE_ITEM_FIELDS]
+    if not expected_fields and (rule_fields or items is not None):
+        result = {"doc_type": doc_type or "", "fields": rule_fields, "_llm_runs": []}
+        if items is not None:
+            result.update({"line_items": items, "_line_items": "table"})
+        if rule_fields:
+            result["_rules"] = [f["name"] for f in rule_fields]
+        return result
+    messages = build_prompt(ocr_text, ocr_tokens, expected_fields, doc_type=doc_type,
+                            token_format=token_format, quant=quant, line_items=items is None)
+    adaptive = max_runs is not None
+    if adaptive and max_runs < 2:
+        raise ValueError(f"max_runs must be at least 2 (one run always agrees with itself), got {max_runs}")
+    temp = 0.0 if n_consistency == 1 and not adaptive else 0.3
+    scale = quant if token_format in ("compact", "layout") else 1
+    first = 2 if adaptive else n_consistency
+
+    outcomes = _run_llm(messages, range(first), model=model, temperature=temp, cache=cache,
+                        llm=llm, quant=scale, max_concurrency=max_concurrency)
+    runs = [j for j, err in outcomes if err is None]
+    errors = [{"run": i, "error": str(err)} for i, (_, err) in enumerate(outcomes) if err is not None]
+    if not runs:
+        raise RuntimeError(f"All {len(outcomes)} LLM runs failed: {errors[0]['error'] if errors else 'no runs'}")
+    for e in errors:
+        print(f"[LLM ERROR] Run {e['run']} failed: {e['error']}")
 
     result = copy.deepcopy(runs[0])
     result["_llm_runs"] = runs
+    if errors:
+        result["_llm_errors"] = errors
+
+    if adaptive:
+        n_calls = len(outcomes)
+        while True:
+            agreement = field_agreement(result["_llm_runs"], expected_fields)
+            disputed = [f for f, a in agreement.items() if a < agreement_threshold]
+            if not disputed or n_calls >= max_runs:
+                break
+            before = len(result["_llm_runs"])
+            if requery == "fields":
+                requery_fields(result, ocr_tokens, disputed, doc_type=doc_type, cache=cache, model=model,
+                               quant=quant, llm=llm)
+            if len(result["_llm_runs"]) == before:
+                (extra, err), = _run_llm(messages, [n_calls], model=model, temperature=temp, cache=cache,
+                                         llm=llm, quant=scale)
+                if err is None:
+                    result["_llm_runs"].append(extra)
+                else:
+                    print(f"[LLM ERROR] Run {n_calls} failed: {err}")
+                    result.setdefault("_llm_errors", []).append({"run": n_calls, "error": str(err)})
+            n_calls += 1
+        result["_llm_adaptive"] = {
+            "runs": n_calls,
+            "max_runs": max_runs,
+            "threshold": agreement_threshold,
+            "agreement": agreement,
+            "stopped_early": n_calls < max_runs,
+        }
+    if items is not None:
+        result["line_items"] = items
+        result["_line_items"] = "table"
+    if rule_fields:
+        names = {f["name"] for f in rule_fields}
+        result["fields"] = rule_fields + [f for f in result.get("fields") or [] if f.get("name") not in names]
+        result["_rules"] = [f["name"] for f in rule_fields]
     # If model didn’t set doc_type, backfill with the router hint
     if result and doc_type and not result.get("doc_type"):
         result["doc_type"] = doc_type
     return result
+
+
+def _row_chars(line):
+    # Length of the line's row in encode_tokens_compact (close enough for budgeting)
+    return 16 + sum(len(t["text"]) + 14 for t in line)
+
+def chunk_tokens(ocr_tokens, max_chars=12000):
+    """
+    Split tokens into prompt-sized chunks of about `max_chars` of compact encoding:
+    consecutive whole pages are packed together while they fit, and a page larger than
+    the budget is cut into bands of consecutive text lines. Chunks are in reading order
+    and do not overlap. Returns a list of token-dict lists.
+    """
+    from extractor.tokens import as_dicts
+
+    pages = []  # [[line, ...]] per page
+    last_page = None
+    for line in group_lines(as_dicts(ocr_tokens)):
+        page = line[0].get("page", 1)
+        if page != last_page:
+            pages.append([])
+            last_page = page
+        pages[-1].append(line)
+
+    chunks, cur, size = [], [], 0
+    for lines in pages:
+        page_chars = sum(_row_chars(line) for line in lines)
+        if cur and size + page_chars > max_chars:
+            chunks.append(cur)
+            cur, size = [], 0
+        if page_chars <= max_chars:
+            cur.extend(t for line in lines for t in line)
+            size += page_chars
+            continue
+        for line in lines:  # oversized page: line bands
+            n = _row_chars(line)
+            if cur and size + n > max_chars:
+                chunks.append(cur)
+                cur, size = [], 0
+            cur.extend(line)
+            size += n
+    if cur:
+        chunks.append(cur)
+    return chunks
+
+def _has_value(v):
+    return v not in (None, "", [], {})
+
+def merge_chunk_results(chunk_results, chunk_tokens_list, expected_fields):
+    """
+    Deterministic merge of per-chunk extract_with_llm results. Each field comes from the
+    chunk where its normalized confidence (see normalize_extraction) is highest, earliest
+    chunk on ties; its runs become the merged `_llm_runs` so agreement is kept (each merged
+    run lists in "_fields" the fields it votes on). line_items are concatenated in chunk order;
+    an item repeated with the same values and source (a chunk returning it twice) is kept once.
+    """
+    from extractor.normalize_result import normalize_extraction
+
+    best = {}  # field -> (confidence, chunk index, field entry)
+    empty = {}  # fields no chunk found a value for: first chunk's (empty) entry
+    for k, (res, toks) in enumerate(zip(chunk_results, chunk_tokens_list)):
+        if res is None:
+            continue
+        scores = {f["name"]: f["confidence"] for f in normalize_extraction(res, toks)["fields"]}
+        for f in res.get("fields", []):
+            name = f.get("name")
+            if not _has_value(f.get("value")):
+                empty.setdefault(name, (0.0, k, f))
+                continue
+            conf = scores.get(name, 0.0)
+            if name not in best or conf > best[name][0]:
+                best[name] = (conf, k, f)
+
+    for name, entry in empty.items():
+        best.setdefault(name, entry)
+    order = list(expected_fields) + sorted(n for n in best if n not in expected_fields)
+    n_runs = max((len(r.get("_llm_runs", [])) for r in chunk_results if r), default=0)
+    runs = [{"fields": [], "_fields": []} for _ in range(n_runs)]
+    fields = []
+    for name in order:
+        if name not in best:
+            continue
+        _, k, entry = best[name]
+        fields.append(copy.deepcopy(entry))
+        for i, run in enumerate(chunk_results[k].get("_llm_runs", [])):
+            if not asked_runs([run], name):
+                continue
+            runs[i]["_fields"].append(name)
+            runs[i]["fields"] += [copy.deepcopy(f) for f in run.get("fields", []) if f.get("name") == name]
+
+    items, seen = [], set()
+    for item in (item for r in chunk_results if r for item in (r.get("line_items") or [])):
+        key = json.dumps(item, sort_keys=True, default=str)
+        if key not in seen:
+            seen.add(key)
+            items.append(item)
+
+    doc_types = [r.get("doc_type") for r in chunk_results if r and r.get("doc_type")]
+    return {
+        "doc_type": Counter(doc_types).most_common(1)[0][0] if doc_types else None,
+        "fields": fields,
+        "line_items": items,
+        "_llm_runs": runs,
+        "_chunk_sources": {name: best[name][1] for name in best},
+    }
+
+def extract_chunked(ocr_text, ocr_tokens, expected_fields, max_chunk_chars=12000, max_chunks_parallel=None,
+                    doc_type=None, **kwargs):
+    """
+    extract_with_llm for long documents: split the tokens into page / line-band chunks
+    (chunk_tokens), extract every chunk concurrently and merge deterministically
+    (merge_chunk_results). Latency follows the slowest chunk, not the document length.
+    A document that fits in one chunk goes straight to extract_with_llm. `kwargs` are
+    passed to every per-chunk extract_with_llm call.
+    """
+    chunks = chunk_tokens(ocr_tokens, max_chars=max_chunk_chars)
+    if len(chunks) <= 1:
+        return extract_with_llm(ocr_text, ocr_tokens, expected_fields, doc_type=doc_type, **kwargs)
+    from concurrent.futures import ThreadPoolExecutor
+
+    def _extract(toks):
+        text = " ".join(t["text"] for t in toks)
+        return extract_with_llm(text, toks, expected_fields, doc_type=doc_type, **kwargs)
+
+    results, errors = [], []
+    with ThreadPoolExecutor(max_workers=max_chunks_parallel or len(chunks)) as pool:
+        futures = [pool.submit(metrics.bind(_extract), toks) for toks in chunks]
+        for k, fut in enumerate(futures):  # chunk order keeps the merge deterministic
+            try:
+                results.append(fut.result())
+            except Exception as e:
+                print(f"[LLM ERROR] Chunk {k} failed: {e}")
+                results.append(None)
+                errors.append({"chunk": k, "error": str(e)})
+    if all(r is None for r in results):
+        raise RuntimeError(f"All {len(chunks)} chunks failed: {errors[0]['error']}")
+
+    result = merge_chunk_results(results, chunks, expected_fields)
+    result["_chunks"] = [
+        {"chunk": k, "pages": sorted({t.get("page", 1) for t in toks}), "tokens": len(toks),
+         "ok": results[k] is not None}
+        for k, toks in enumerate(chunks)
+    ]
+    if errors:
+        result["_chunk_errors"] = errors
+    if doc_type and not result.get("doc_type"):
+        result["doc_type"] = doc_type
+    return result
@@ -0,0 +1,290 @@
+# extractor/metrics.py
+"""
+Lightweight per-stage instrumentation.
+
+Every instrumented stage emits one event:
+    {"stage": "call_llm", "duration_s": 1.23, "outcome": "ok", "ts": ..., <counts...>}
+to each registered sink. With no sinks registered, recording is close to free.
+
+    from extractor import metrics
+    sink = metrics.MemorySink()
+    metrics.add_sink(sink)
+    ...
+    sink.summary()
+
+Sinks are per process: a forked pool worker starts with none, captures its events
+and the parent re-emits them (see extractor.ocr.iter_ocr_pages).
+
+A sink registered with `scoped` only sees the events of the current thread / task
+(and of pool threads started through `bind`), e.g. one request among many:
+
+    with metrics.scoped(sink):
+        ...
+"""
+import atexit
+import contextvars
+import functools
+import json
+import os
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+_sinks: List[Any] = []
+_lock = threading.Lock()
+_scoped_sinks: contextvars.ContextVar = contextvars.ContextVar("metrics_scoped_sinks", default=())
+
+
+def _forget_sinks() -> None:
+    # Inherited sinks would write every worker event twice (in the worker and when the
+    # parent re-emits it), and a worker's PrometheusFileSink would overwrite the parent's
+    # file with partial counts. The lock may also have been held by another thread.
+    global _lock
+    _lock = threading.Lock()
+    _sinks.clear()
+
+
+if hasattr(os, "register_at_fork"):  # not on Windows, where pools spawn fresh interpreters
+    os.register_at_fork(after_in_child=_forget_sinks)
+
+
+def add_sink(sink) -> None:
+    with _lock:
+        _sinks.append(sink)
+
+
+def remove_sink(sink) -> None:
+    with _lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+
+
+@contextmanager
+def scoped(sink):
+    """Register `sink` for the events emitted in the current context only, for the block."""
+    token = _scoped_sinks.set(_scoped_sinks.get() + (sink,))
+    try:
+        yield sink
+    finally:
+        _scoped_sinks.reset(token)
+
+
+def bind(fn: Callable) -> Callable:
+    """`fn` run in a copy of the current context, so scoped sinks see the events of a pool thread."""
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def enabled() -> bool:
+    """True if at least one sink receives events here (registered or scoped)."""
+    return bool(_sinks) or bool(_scoped_sinks.get())
+
+
+def emit(event: Dict[str, Any]) -> None:
+    for sink in list(_sinks) + list(_scoped_sinks.get()):
+        try:
+            sink.record(event)
+        except Exception as e:
+            print(f"[METRICS ERROR] {type(sink).__name__} failed: {e}")
+
+
+@contextmanager
+def stage(name: str, **counts):
+    """
+    Time a block as stage `name`. The yielded dict can be filled with counts
+    (tokens, bytes, pages, ...) inside the block; exceptions mark outcome="error"
+    and are re-raised.
+    """
+    rec = dict(counts)
+    if not enabled():
+        yield rec
+        return
+    t0 = time.perf_counter()
+    outcome, error = "ok", None
+    try:
+        yield rec
+    except BaseException as e:
+        outcome, error = "error", f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        event = {"stage": name, "duration_s": round(time.perf_counter() - t0, 6),
+                 "outcome": rec.pop("outcome", outcome), "ts": round(time.time(), 3)}
+        if error:
+            event["error"] = error[:300]
+        event.update(rec)
+        emit(event)
+
+
+def instrument(name: str, counts: Optional[Callable[..., Dict[str, Any]]] = None):
+    """Decorator form of `stage`; counts(result, *args, **kwargs) adds counts from the return value."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name) as rec:
+                result = fn(*args, **kwargs)
+                if counts is not None and enabled():
+                    try:
+                        rec.update(counts(result, *args, **kwargs))
+                    except Exception:
+                        pass
+                return result
+        return wrapper
+    return deco
+
+
+def _is_count(key: str, value: Any) -> bool:
+    """Numeric event fields that are summed across events (timing metadata excluded)."""
+    return key not in ("duration_s", "ts", "attempt") and isinstance(value, (int, float)) \
+        and not isinstance(value, bool)
+
+
+class MemorySink:
+    """Keeps events in memory (bounded by `max_events`) and aggregates them per stage."""
+
+    def __init__(self, max_events: int = 100000):
+        self.max_events = max_events
+        self.events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def record(self, event):
+        with self._lock:
+            self.events.append(event)
+            if len(self.events) > self.max_events:
+                del self.events[: len(self.events) - self.max_events]
+
+    def clear(self):
+        with self._lock:
+            self.events.clear()
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """One row per stage: calls, errors, total/mean/p95 seconds and summed counts."""
+        with self._lock:
+            events = list(self.events)
+        by_stage: Dict[str, List[Dict]] = {}
+        for ev in events:
+            by_stage.setdefault(ev["stage"], []).append(ev)
+        rows = []
+        for name, evs in by_stage.items():
+            durs = sorted(ev["duration_s"] for ev in evs)
+            row = {
+                "stage": name,
+                "calls": len(evs),
+                "errors": sum(1 for ev in evs if ev["outcome"] != "ok"),
+                "total_s": round(sum(durs), 4),
+                "mean_s": round(statistics.fmean(durs), 4),
+                "p95_s": round(durs[min(len(durs) - 1, int(0.95 * len(durs)))], 4),
+            }
+            totals: Dict[str, float] = {}
+            for ev in evs:
+                for k, v in ev.items():
+                    if _is_count(k, v):
+                        totals[k] = totals.get(k, 0) + v
+            row.update(totals)
+            if "cache_hit" in totals:
+                lookups = sum(1 for ev in evs if "cache_hit" in ev)
+                row["cache_hit_rate"] = round(totals["cache_hit"] / lookups, 3) if lookups else 0.0
+            rows.append(row)
+        return rows
+
+
+class capture:
+    """Context manager collecting the events of a block in a temporary, scoped MemorySink."""
+
+    def __enter__(self):
+        self.sink = MemorySink()
+        self._scope = scoped(self.sink)
+        self._scope.__enter__()
+        return self.sink.events
+
+    def __exit__(self, *exc):
+        self._scope.__exit__(*exc)
+        return False
+
+
+class JSONLogSink:
+    """Appends one JSON line per event to `path`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, event):
+        line = json.dumps(event, ensure_ascii=False, default=str) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as fh:
+            fh.write(line)
+
+
+class PrometheusFileSink:
+    """
+    Aggregates events into Prometheus text exposition format and rewrites `path`
+    (atomically, at most every `interval` seconds) for node_exporter's textfile collector.
+    """
+
+    def __init__(self, path: str, prefix: str = "extractor", interval: float = 1.0):
+        self.path = path
+        self.prefix = prefix
+        self.interval = interval
+        self._last_write = 0.0
+        self._lock = threading.Lock()
+        self._count: Dict[tuple, int] = {}
+        self._seconds: Dict[str, float] = {}
+        self._items: Dict[tuple, float] = {}
+        atexit.register(self.flush)
+
+    def record(self, event):
+        name = event["stage"]
+        with self._lock:
+            key = (name, event["outcome"])
+            self._count[key] = self._count.get(key, 0) + 1
+            self._seconds[name] = self._seconds.get(name, 0.0) + event["duration_s"]
+            for k, v in event.items():
+                if not _is_count(k, v):
+                    continue
+                self._items[(name, k)] = self._items.get((name, k), 0) + v
+            if time.time() - self._last_write >= self.interval:
+                self._write()
+
+    def flush(self):
+        with self._lock:
+            self._write()
+
+    def render(self) -> str:
+        p = self.prefix
+        lines = [
+            f"# HELP {p}_stage_calls_total Stage executions by outcome.",
+            f"# TYPE {p}_stage_calls_total counter",
+        ]
+        for (name, outcome), n in sorted(self._count.items()):
+            lines.append(f'{p}_stage_calls_total{{stage="{name}",outcome="{outcome}"}} {n}')
+        lines += [
+            f"# HELP {p}_stage_seconds_total Time spent per stage.",
+            f"# TYPE {p}_stage_seconds_total counter",
+        ]
+        for name, secs in sorted(self._seconds.items()):
+            lines.append(f'{p}_stage_seconds_total{{stage="{name}"}} {secs:.6f}')
+        lines += [
+            f"# HELP {p}_stage_items_total Items (bytes, tokens, pages, ...) processed per stage.",
+            f"# TYPE {p}_stage_items_total counter",
+        ]
+        for (name, kind), v in sorted(self._items.items()):
+            lines.append(f'{p}_stage_items_total{{stage="{name}",kind="{kind}"}} {v}')
+        return "\n".join(lines) + "\n"
+
+    def _write(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            fh.write(self.render())
+        os.replace(tmp, self.path)
+        self._last_write = time.time()
+
+
+def configure_from_env() -> None:
+    """Register sinks from EXTRACTOR_METRICS_JSONL / EXTRACTOR_METRICS_PROM if set (idempotent)."""
+    jsonl, prom = os.getenv("EXTRACTOR_METRICS_JSONL"), os.getenv("EXTRACTOR_METRICS_PROM")
+    with _lock:
+        have = {(type(s), getattr(s, "path", None)) for s in _sinks}
+    if jsonl and (JSONLogSink, jsonl) not in have:
+        add_sink(JSONLogSink(jsonl))
+    if prom and (PrometheusFileSink, prom) not in have:
+        add_sink(PrometheusFileSink(prom))
@@ -1,8 +1,23 @@
 # extractor/normalize_result.py
+import math
 from typing import Dict, Any, List
-from extractor.confidence import compute_field_confidence, overall_confidence
+from extractor.confidence import compute_field_confidence, overall_confidence, run_values
 from extractor.validator import validate_fields
+from extractor.spatial import TokenIndex
+from extractor import metrics
+from extractor.tokens import TokenTable
 
+
+def _parse_source(src):
+    """Return (page, [x1,y1,x2,y2]) from an LLM source dict, or None if it is unusable."""
+    try:
+        bbox = [float(v) for v in src["bbox"]]
+        page = int(src["page"])
+    except (KeyError, TypeError, ValueError, OverflowError):
+        return None
+    return (page, bbox) if len(bbox) == 4 and all(math.isfinite(v) for v in bbox) else None
+
+@metrics.instrument("normalize_extraction", lambda res, raw, all_tokens: {"fields": len(res["fields"]), "tokens": len(all_tokens)})
 def normalize_extraction(raw: Dict[str, Any], all_tokens: List[Dict]) -> Dict[str, Any]:
     """
     Take raw llm_raw output + OCR tokens and enforce the required schema.
@@ -14,6 +29,15 @@ def normalize_extraction(raw: Dict[str, Any], all_tokens: List[Dict]) -> Dict[st
     # LLM run values for self-consistency
     llm_runs = raw.get("_llm_runs", [])
 
+    # A TokenTable answers bbox queries vectorized; for token dicts a grid index is
+    # built once so each field's lookup only touches nearby cells
+    if isinstance(all_tokens, TokenTable):
+        index = None
+        all_confs = all_tokens.conf.tolist()
+    else:
+        index = TokenIndex(all_tokens)
+        all_confs = [t["conf"] for t in all_tokens]
+
     for f in raw.get("fields", []):
         name = f.get("name")
         value = f.get("value")
@@ -21,27 +45,21 @@ def normalize_extraction(raw: Dict[str, Any], all_tokens: List[Dict]) -> Dict[st
 
         # OCR tokens overlapping bbox
         token_confs = []
-        if src and "bbox" in src and "page" in src:
-            bbox = src["bbox"]
-            page = src["page"]
-            token_confs = [
-                t["conf"]
-                for t in all_tokens
-                if t.get("page") == page
-                and t["bbox"][0] >= bbox[0]-5
-                and t["bbox"][2] <= bbox[2]+5
-            ]
+        loc = _parse_source(src) if src else None
+        if loc:
+            page, bbox = loc
+            if index is None:
+                token_confs = all_tokens.confs_in(page, bbox, pad=5)
+            else:
+                token_confs = [t["conf"] for t in index.query(page, bbox, pad=5)]
         else:
-            token_confs = [t["conf"] for t in all_tokens]
+            token_confs = all_confs
 
-        # Collect values for this field across runs
-        run_vals = []
-        for run in llm_runs:
-            val = None
-            for ff in run.get("fields", []):
-                if ff.get("name") == name:
-                    val = ff.get("value")
-            run_vals.append(val)
+        # Collect values for this field across runs; a rule-based answer (extractor.rules)
+        # is deterministic, so it counts as full agreement
+        run_vals = run_values(llm_runs, name)
+        if "rule" in f and not any(v is not None for v in run_vals):
+            run_vals = [value]
 
         # Compute confidence (for now validator_ok=True, since validation is handled separately)
         conf, breakdown = compute_field_confidence(
@@ -55,6 +73,7 @@ def normalize_extraction(raw: Dict[str, Any], all_tokens: List[Dict]) -> Dict[st
             "confidence": round(conf, 2),
             "source": src if src else None,
             "confidence_breakdown": breakdown,
+            **({"method": "rules"} if "rule" in f else {}),
         })
 
 
@@ -68,6 +87,7 @@ def normalize_extraction(raw: Dict[str, Any], all_tokens: List[Dict]) -> Dict[st
     return {
         "doc_type": doc_type,
         "fields": fields,
+        "line_items": [li for li in raw.get("line_items") or [] if isinstance(li, dict)],
         "overall_confidence": round(overall_confidence(per_field_scores), 2),
         "qa": qa,
     }
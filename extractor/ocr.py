@@ -1,9 +1,20 @@
 # extractor/ocr.py
-from pdf2image import convert_from_bytes
-from PIL import Image
-import pytesseract
+# pdf2image, PIL and pytesseract are imported where they are used, so importing this
+# module (e.g. for the text layer or the cache helpers) does not pay for them
 import io
+import os
+import hashlib
+import tempfile
+import contextlib
+import itertools
+import functools
+import numpy as np
+from collections import deque
+from extractor import metrics
+from extractor.cache import make_key, default_ocr_cache
+from extractor.tokens import TokenTable
 
+@metrics.instrument("file_bytes_to_images", lambda res, file_bytes, *a, **k: {"bytes": len(file_bytes), "pages": len(res)})
 def file_bytes_to_images(file_bytes, mime_type=None, dpi=200):
     """
     Return list of PIL Images from PDF or image file.
@@ -12,9 +23,11 @@ def file_bytes_to_images(file_bytes, mime_type=None, dpi=200):
     try:
         if mime_type and "pdf" in mime_type.lower():
             # PDF → convert each page to image
+            from pdf2image import convert_from_bytes
             return convert_from_bytes(file_bytes, dpi=dpi)
         else:
             # Image (png/jpg/jpeg) → open directly
+            from PIL import Image
             img = Image.open(io.BytesIO(file_bytes)).convert("RGB")
             return [img]
     except Exception as e:
@@ -24,36 +37,441 @@ def file_bytes_to_images(file_bytes, mime_type=None, dpi=200):
 def pdf_bytes_to_images(pdf_bytes, dpi=200):
     """Legacy function: only PDF → kept for compatibility."""
     try:
+        from pdf2image import convert_from_bytes
         images = convert_from_bytes(pdf_bytes, dpi=dpi)
         return images
     except Exception as e:
         print(f"[OCR ERROR] Failed to convert PDF to images: {e}")
         return []
 
-def image_to_ocr_data(pil_image):
+def pdf_page_count(pdf_bytes):
+    """Number of pages in a PDF (via poppler's pdfinfo), 0 if it cannot be read."""
+    try:
+        from pdf2image import pdfinfo_from_bytes
+        return int(pdfinfo_from_bytes(pdf_bytes)["Pages"])
+    except Exception as e:
+        print(f"[OCR ERROR] Failed to read PDF info: {e}")
+        return 0
+
+def iter_pdf_pages(pdf_bytes, dpi=200, pages=None):
+    """
+    Yield (page_number, PIL Image) one page at a time, rendering each page only when
+    the consumer asks for it, so memory no longer grows with the page count.
+    `pages` restricts rendering to the given 1-based page numbers.
+    """
+    if pages is None:
+        pages = range(1, pdf_page_count(pdf_bytes) + 1)
+    with _pdf_file(pdf_bytes) as path:
+        for p in pages:
+            img = _render_page(path, p, dpi)
+            if img is not None:
+                yield p, img
+
+@contextlib.contextmanager
+def _pdf_file(pdf_bytes):
+    # pdf2image hands poppler a file: convert_from_bytes writes the whole PDF to a temp
+    # file on every call, so write it once per document and render pages from the path
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(pdf_bytes)
+        yield path
+    finally:
+        os.unlink(path)
+
+def _render_page(pdf_path, page, dpi, grayscale=False):
+    from pdf2image import convert_from_path
+
+    with metrics.stage("rasterize", page=page, dpi=dpi) as rec:
+        try:
+            return convert_from_path(pdf_path, dpi=dpi, first_page=page, last_page=page, grayscale=grayscale)[0]
+        except Exception as e:
+            print(f"[OCR ERROR] Failed to rasterize page {page}: {e}")
+            rec["outcome"] = "error"
+            return None
+
+def iter_file_images(file_bytes, mime_type=None, dpi=200):
+    """Streaming counterpart of file_bytes_to_images: yield (page_number, image) pairs."""
+    if mime_type and "pdf" in mime_type.lower():
+        yield from iter_pdf_pages(file_bytes, dpi=dpi)
+        return
+    for p, img in enumerate(file_bytes_to_images(file_bytes, mime_type, dpi=dpi), start=1):
+        yield p, img
+
+_ocr_cache = None
+_ocr_cache_owner = None  # (path, pid) the cache was opened for
+_forked_caches = []  # opened by the parent before fork(): kept unused and never closed here
+
+def get_ocr_cache():
+    """
+    Per-process OCR cache opened lazily from OCR_CACHE_PATH (None = disabled).
+    Configured through the environment so OCR pool workers open the same store.
+    A forked worker opens its own: a SQLite connection (and its lock) must not be
+    used across fork().
+    """
+    global _ocr_cache, _ocr_cache_owner
+    path = os.getenv("OCR_CACHE_PATH")
+    if not path:
+        return None
+    owner = (path, os.getpid())
+    if _ocr_cache is None or _ocr_cache_owner != owner:
+        if _ocr_cache is not None and _ocr_cache_owner[1] != owner[1]:
+            _forked_caches.append(_ocr_cache)  # closing it could roll back the parent's write
+        _ocr_cache, _ocr_cache_owner = default_ocr_cache(), owner
+    return _ocr_cache
+
+@functools.lru_cache(maxsize=1)
+def _tesseract_version():
+    try:
+        import pytesseract
+        return str(pytesseract.get_tesseract_version())
+    except Exception:
+        return "unknown"
+
+def ocr_cache_key(pil_image, config="", variant=None):
+    """Content hash of the rendered page pixels + DPI + Tesseract config/version (+ preprocessing / ROI mode)."""
+    digest = hashlib.blake2b(pil_image.tobytes(), digest_size=20).hexdigest()
+    return make_key("ocr", digest, list(pil_image.size), pil_image.mode,
+                    pil_image.info.get("dpi"), config, _tesseract_version(),
+                    *([variant] if variant else []))
+
+def _pack_tokens(table):
+    # columnar layout: no per-token keys on disk
+    return {
+        "t": table.text,
+        "c": np.round(table.conf, 4).tolist(),
+        "b": table.bboxes.ravel().tolist(),
+        **({"k": table.block.tolist()} if table.block.any() else {}),
+    }
+
+def _unpack_tokens(packed):
+    b = np.asarray(packed["b"], dtype=np.int32).reshape(-1, 4)
+    return TokenTable(packed["t"], packed["c"], np.ones(len(packed["t"]), dtype=np.int32),
+                      b[:, 0], b[:, 1], b[:, 2], b[:, 3], packed.get("k"))
+
+def image_to_token_table(pil_image, config="", page=1):
+    """
+    OCR one page image into a TokenTable (see extractor.tokens), tagged with `page`.
+    Results are served from the OCR cache (see get_ocr_cache) when the same page
+    image was OCRed before with the same config.
+    With OCR_PREPROCESS set, the image is preprocessed first (see extractor.preprocess)
+    and bboxes are mapped back to `pil_image` pixels. With OCR_ROI set, only the page's
+    text blocks are OCRed (see _image_to_token_table_roi).
+    """
+    from extractor.preprocess import steps_from_env, target_dpi_from_env
+
+    steps, roi = steps_from_env(), roi_from_env()
+    variant = ([list(steps), target_dpi_from_env()] if steps else []) + (["roi"] if roi else [])
+    ocr = _image_to_token_table_roi if roi else _image_to_token_table
+    with metrics.stage("image_to_ocr_data") as rec:
+        cache, key, table = get_ocr_cache(), None, None
+        if cache is not None:
+            try:
+                key = ocr_cache_key(pil_image, config, variant)
+                packed = cache.get(key)
+                table = _unpack_tokens(packed) if packed is not None else None
+            except Exception as e:
+                print(f"[OCR ERROR] OCR cache lookup failed: {e}")
+            rec["cache_hit"] = int(table is not None)
+        if table is None:
+            if steps:
+                from extractor.preprocess import preprocess_image
+                img, transform = preprocess_image(pil_image, steps=steps, target_dpi=variant[1])
+                table = ocr(img, config)
+                table = transform.to_source(table) if table is not None else None
+            else:
+                table = ocr(pil_image, config)
+            if table is None:
+                rec["outcome"] = "error"
+                table = TokenTable.empty()
+            elif key is not None:
+                try:
+                    cache.set(key, _pack_tokens(table))
+                except Exception as e:
+                    print(f"[OCR ERROR] OCR cache store failed: {e}")
+        size = getattr(pil_image, "size", None)
+        if size:
+            rec["pixels"] = size[0] * size[1]
+        rec["tokens"] = len(table)
+        return table.with_page(page)
+
+def image_to_ocr_data(pil_image, config=""):
     """Return words with bboxes and confidences using tesseract TSV output."""
+    return image_to_token_table(pil_image, config).to_dicts(include_page=False)
+
+def _image_to_token_table(pil_image, config=""):
     try:
+        import pytesseract
         from pytesseract import Output
-        data = pytesseract.image_to_data(pil_image, output_type=Output.DICT)
+        data = pytesseract.image_to_data(pil_image, output_type=Output.DICT, config=config)
     except Exception as e:
         print(f"[OCR ERROR] pytesseract failed: {e}")
-        return []
+        return None
+    # vectorized: empty words are dropped and columns converted without per-word dicts
+    return TokenTable.from_tesseract(data)
 
-    results = []
-    n = len(data['level'])
-    for i in range(n):
-        text = data['text'][i].strip()
-        if text == "":
-            continue
-        try:
-            conf = float(data['conf'][i])
-        except Exception:
-            conf = 0.0
-        left, top, w, h = data['left'][i], data['top'][i], data['width'][i], data['height'][i]
-        bbox = [left, top, left + w, top + h]
-        results.append({
-            "text": text,
-            "conf": max(0.0, conf) / 100.0,
-            "bbox": bbox
+def roi_from_env():
+    return os.getenv("OCR_ROI", "").strip().lower() in ("1", "true", "yes", "on")
+
+def _block_config(config, psm, dpi):
+    # a crop gives Tesseract too little to guess the resolution from
+    if "--psm" not in config:
+        config = f"{config} --psm {psm}"
+    if "--dpi" not in config:
+        config = f"{config} --dpi {int(round(dpi))}"
+    return config.strip()
+
+def _image_to_token_table_roi(pil_image, config=""):
+    """
+    Region-of-interest OCR: Tesseract runs only on the text blocks found by
+    extractor.regions, each crop with the --psm of its kind, several at a time (each
+    Tesseract call is its own process, so threads are enough). Tokens get the 1-based
+    block number in reading order as block_id. Pages without a usable layout are OCRed whole.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from extractor.preprocess import effective_dpi, to_gray
+    from extractor.regions import find_text_blocks
+
+    with metrics.stage("ocr_regions") as rec:
+        blocks = find_text_blocks(to_gray(pil_image))
+        rec["blocks"] = len(blocks or [])
+        if not blocks:
+            return _image_to_token_table(pil_image, config)
+        dpi = effective_dpi(pil_image)
+        jobs = [(pil_image.crop(b.bbox), _block_config(config, b.psm, dpi)) for b in blocks]
+        area = sum((b.bbox[2] - b.bbox[0]) * (b.bbox[3] - b.bbox[1]) for b in blocks)
+        rec["pixel_ratio"] = round(area / max(1, pil_image.size[0] * pil_image.size[1]), 3)
+        threads = min(len(jobs), int(os.getenv("OMP_THREAD_LIMIT") or os.cpu_count() or 1))
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+            tables = list(pool.map(lambda job: _image_to_token_table(*job), jobs))
+        if all(t is None for t in tables):
+            return None
+        return TokenTable.concat(t.shifted(b.bbox[0], b.bbox[1]).with_block(i)
+                                 for i, (b, t) in enumerate(zip(blocks, tables), start=1) if t is not None)
+
+def _init_ocr_worker(omp_threads):
+    # Tesseract's OpenMP threads would oversubscribe the CPU when several pages run at once
+    os.environ["OMP_THREAD_LIMIT"] = str(omp_threads)
+
+def _ocr_page(args):
+    # (page, image) or (page, image, bbox scale factor) for pages rendered at another DPI
+    page, img, *scale = args
+    table = image_to_token_table(img, page=page)
+    return table.scaled(scale[0]) if scale else table
+
+def _ocr_page_captured(job, collect):
+    # Pool workers have their own (empty) sink list; ship events back to the parent
+    if not collect:
+        return _ocr_page(job), []
+    with metrics.capture() as events:
+        table = _ocr_page(job)
+    return table, events
+
+def iter_ocr_pages(page_images, workers=None, as_table=False):
+    """
+    OCR a stream of (page_number, image) pairs and yield each page's tokens in input order
+    (a TokenTable with as_table=True, otherwise a list of token dicts).
+    Pages are consumed as they arrive; at most 2 * workers images are in flight, so
+    peak memory is independent of the page count. Each pool worker gets an equal share
+    of OMP_THREAD_LIMIT so the pool never oversubscribes the machine.
+    """
+    out = (lambda table: table) if as_table else (lambda table: table.to_dicts())
+    jobs = iter(page_images)
+    head = list(itertools.islice(jobs, 2))
+    cpus = os.cpu_count() or 1
+    workers = workers or cpus
+    if workers == 1 or len(head) < 2:
+        for job in itertools.chain(head, jobs):
+            yield out(_ocr_page(job))
+        return
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_ocr_worker,
+                             initargs=(max(1, cpus // workers),)) as pool:
+        window = deque()
+        collect = metrics.enabled()
+
+        def _result(fut):
+            table, events = fut.result()
+            for ev in events:
+                metrics.emit(ev)
+            return out(table)
+
+        for job in itertools.chain(head, jobs):
+            window.append(pool.submit(_ocr_page_captured, job, collect))
+            if len(window) >= 2 * workers:
+                yield _result(window.popleft())
+        while window:
+            yield _result(window.popleft())
+
+def ocr_document(images, workers=None, pages=None, as_table=False):
+    """
+    OCR page images in a process pool and return all tokens tagged with their page.
+    `images` may be a list or a generator; `pages` gives the page number of each image
+    (default 1..N). Output is in page order. `workers` defaults to the CPU count.
+    Returns a TokenTable with as_table=True, otherwise a list of token dicts.
+    """
+    jobs = zip(pages if pages is not None else itertools.count(1), images)
+    table = TokenTable.concat(iter_ocr_pages(jobs, workers=workers, as_table=True))
+    return table if as_table else table.to_dicts()
+
+PREVIEW_DPI = 100
+TARGET_TEXT_PX = 24   # typical text line height Tesseract should see
+MIN_DPI, MAX_DPI = 120, 400
+MIN_PAGE_CONF = 0.80  # mean token conf below which a page is re-rendered at a higher DPI
+
+def adaptive_dpi_from_env():
+    return os.getenv("OCR_ADAPTIVE_DPI", "").strip().lower() in ("1", "true", "yes", "on")
+
+def min_page_conf_from_env():
+    return float(os.getenv("OCR_MIN_PAGE_CONF", MIN_PAGE_CONF))
+
+def _snap_dpi(dpi, step=25):
+    return int(min(MAX_DPI, max(MIN_DPI, -(-dpi // step) * step)))
+
+def choose_page_dpi(preview, preview_dpi=PREVIEW_DPI, target_px=TARGET_TEXT_PX):
+    """
+    DPI at which the small print of a page is about `target_px` tall, estimated from a
+    low-DPI `preview` render; None when the preview shows no text lines.
+    """
+    from extractor.preprocess import text_line_height, to_gray
+
+    height = text_line_height(to_gray(preview))
+    if not height:
+        return None
+    return _snap_dpi(preview_dpi * target_px / height)
+
+def ocr_pdf_pages_adaptive(pdf_bytes, pages, dpi=200, workers=None, min_conf=None):
+    """
+    OCR PDF pages each rendered at its own DPI, returning one TokenTable per page
+    with bboxes in pixels at `dpi` (like every other OCR path).
+    Pass 1 renders a cheap PREVIEW_DPI grayscale preview, sizes the page so its text is
+    about TARGET_TEXT_PX tall (choose_page_dpi) and OCRs it. Pass 2 re-renders only the
+    pages whose mean token conf is under `min_conf` at 1.5x their DPI (up to MAX_DPI),
+    keeping whichever result is more confident.
+    """
+    min_conf = min_page_conf_from_env() if min_conf is None else min_conf
+    plan = []  # (page, render dpi, has text), filled as pass 1 hands pages to the pool
+
+    def _first_pass():
+        for p in pages:
+            preview = _render_page(path, p, PREVIEW_DPI, grayscale=True)
+            if preview is None:
+                continue
+            page_dpi = choose_page_dpi(preview)
+            plan.append((p, page_dpi or dpi, page_dpi is not None))
+            img = _render_page(path, p, plan[-1][1])
+            if img is not None:
+                yield p, img, dpi / plan[-1][1]
+            else:
+                plan.pop()
+
+    with _pdf_file(pdf_bytes) as path, metrics.stage("adaptive_dpi") as rec:
+        tables = list(iter_ocr_pages(_first_pass(), workers=workers, as_table=True))
+        retry = [i for i, (t, (p, page_dpi, has_text)) in enumerate(zip(tables, plan))
+                 if has_text and page_dpi < MAX_DPI and (not len(t) or t.conf.mean() < min_conf)]
+        retry_dpi = {i: _snap_dpi(plan[i][1] * 1.5) for i in retry}
+
+        def _second_pass():
+            for i in retry:
+                img = _render_page(path, plan[i][0], retry_dpi[i])
+                if img is not None:
+                    yield plan[i][0], img, dpi / retry_dpi[i]
+
+        improved = 0
+        for i, table in zip(retry, iter_ocr_pages(_second_pass(), workers=workers, as_table=True)):
+            old = tables[i]
+            if len(table) and (not len(old) or table.conf.mean() > old.conf.mean()):
+                tables[i] = table
+                plan[i] = (plan[i][0], retry_dpi[i], True)
+                improved += 1
+        rec.update({
+            "pages": len(plan),
+            "retried": len(retry),
+            "improved": improved,
+            # pixels rendered for OCR relative to rendering every page at `dpi`
+            "pixel_ratio": round(sum((d / dpi) ** 2 for _, d, _ in plan) / max(1, len(plan)), 3),
+            "mean_dpi": round(sum(d for _, d, _ in plan) / max(1, len(plan))),
         })
-    return results
+    return tables
+
+def _usable_text(tokens, min_words=3, min_alnum_ratio=0.5):
+    """A text layer is usable when it has a few words and is mostly real characters (not broken-font glyphs)."""
+    if len(tokens) < min_words:
+        return False
+    chars = "".join(t["text"] for t in tokens)
+    alnum = sum(1 for ch in chars if ch.isalnum())
+    return alnum / max(1, len(chars)) >= min_alnum_ratio
+
+@metrics.instrument("pdf_text_layer", lambda res, pdf_bytes, *a, **k: {
+    "bytes": len(pdf_bytes), "pages": len(res), "ocr_pages": sum(1 for p in res if p is None)})
+def pdf_text_layer_tokens(pdf_bytes, dpi=200):
+    """
+    Read the embedded text layer of each PDF page with PyMuPDF.
+    Returns one entry per page: a token list in the same {text, conf, bbox, page} format
+    as OCR (bbox in pixels at `dpi`, conf=1.0), or None when the page has no usable text.
+    """
+    import fitz  # PyMuPDF
+
+    scale = dpi / 72.0
+    pages = []
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        for p, page in enumerate(doc, start=1):
+            toks = []
+            for x0, y0, x1, y1, word, *_ in page.get_text("words"):
+                word = word.strip()
+                if not word:
+                    continue
+                # words are in unrotated page space; map them onto the rendered page
+                r = fitz.Rect(x0, y0, x1, y1) * page.rotation_matrix
+                toks.append({
+                    "text": word,
+                    "conf": 1.0,
+                    "bbox": [int(round(r.x0 * scale)), int(round(r.y0 * scale)),
+                             int(round(r.x1 * scale)), int(round(r.y1 * scale))],
+                    "page": p,
+                })
+            pages.append(toks if _usable_text(toks) else None)
+    return pages
+
+def file_bytes_to_tokens(file_bytes, mime_type=None, dpi=200, use_text_layer=True, workers=None,
+                         as_table=False, adaptive_dpi=None):
+    """
+    Return (tokens, n_pages) for a PDF or image, tokens tagged with their page number
+    (a TokenTable with as_table=True, otherwise a list of token dicts).
+    PDF pages with a usable text layer are read directly; only the remaining pages are
+    rasterized, streamed one at a time into Tesseract running across `workers` processes.
+    With `adaptive_dpi` (default: OCR_ADAPTIVE_DPI) PDF pages are rendered at a per-page
+    DPI (see ocr_pdf_pages_adaptive); bboxes are still in pixels at `dpi`.
+    """
+    if adaptive_dpi is None:
+        adaptive_dpi = adaptive_dpi_from_env()
+
+    def _result(table, n_pages):
+        return (table if as_table else table.to_dicts()), n_pages
+
+    def _ocr_pages(pages):
+        if adaptive_dpi:
+            return ocr_pdf_pages_adaptive(file_bytes, pages, dpi=dpi, workers=workers)
+        return iter_ocr_pages(iter_pdf_pages(file_bytes, dpi=dpi, pages=pages), workers=workers, as_table=True)
+
+    if not (mime_type and "pdf" in mime_type.lower()):
+        images = file_bytes_to_images(file_bytes, mime_type, dpi=dpi)
+        return _result(ocr_document(images, workers=workers, as_table=True), len(images))
+
+    pages = None
+    if use_text_layer:
+        try:
+            pages = pdf_text_layer_tokens(file_bytes, dpi=dpi)
+        except Exception as e:
+            print(f"[OCR ERROR] Text layer extraction failed, falling back to OCR: {e}")
+    if pages is None:
+        n_pages = pdf_page_count(file_bytes)
+        return _result(TokenTable.concat(_ocr_pages(range(1, n_pages + 1))), n_pages)
+
+    need_ocr = [p for p, page_tokens in enumerate(pages, start=1) if page_tokens is None]
+    tables = [TokenTable.from_dicts(page_tokens) for page_tokens in pages if page_tokens]
+    tables.extend(_ocr_pages(need_ocr))
+    table = TokenTable.concat(tables)
+    table = table.take(np.argsort(table.page, kind="stable"))  # stable: keeps reading order within a page
+    return _result(table, len(pages))
@@ -0,0 +1,113 @@
+# extractor/pipeline.py
+import mimetypes
+import os
+import time
+from typing import Dict, List, Optional
+
+from extractor import metrics
+
+# Stage modules are imported inside the stage functions: callers that only need
+# default_fields / guess_mime_type (CLIs, the service front end) start without them
+
+DEFAULT_FIELDS = {
+    "invoice": ["InvoiceNumber", "InvoiceDate", "VendorName", "TotalAmount", "LineItems"],
+    "medical_bill": [
+        "PatientName", "PatientID", "HospitalName", "BillNumber",
+        "AdmissionDate", "DischargeDate", "TotalAmount", "LineItems"
+    ],
+    "prescription": ["PatientName", "DoctorName", "PrescriptionDate", "Medications"],
+}
+
+
+def default_fields(doc_type: str) -> List[str]:
+    """Fields extracted when the user does not ask for specific ones."""
+    return list(DEFAULT_FIELDS.get(doc_type, DEFAULT_FIELDS["prescription"]))
+
+
+DOC_EXTS = (".pdf", ".png", ".jpg", ".jpeg")
+
+
+def find_documents(directory: str, recursive: bool = True) -> List[str]:
+    """All supported documents under `directory`, as sorted paths relative to it."""
+    found = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith(DOC_EXTS):
+                found.append(os.path.relpath(os.path.join(root, name), directory))
+        if not recursive:
+            break
+    return sorted(found)
+
+
+def list_documents(directory: str) -> List[str]:
+    """Supported documents directly in `directory`, as sorted paths."""
+    return [os.path.join(directory, p) for p in find_documents(directory, recursive=False)]
+
+
+def guess_mime_type(path: str) -> Optional[str]:
+    return mimetypes.guess_type(path)[0]
+
+
+def ocr_stage(file_bytes: bytes, mime_type: Optional[str], workers: Optional[int] = None) -> Dict:
+    """OCR (or text-layer read) a document: {tokens (TokenTable), n_pages, full_text}."""
+    from extractor.ocr import file_bytes_to_tokens
+
+    tokens, n_pages = file_bytes_to_tokens(file_bytes, mime_type, workers=workers, as_table=True)
+    return {
+        "tokens": tokens,
+        "n_pages": n_pages,
+        "full_text": tokens.full_text(),
+    }
+
+
+def ocr_job(file_bytes: bytes, mime_type: Optional[str], collect_metrics: bool = False) -> Dict:
+    """
+    ocr_stage in a pool process (batch, service): pages are OCRed serially here, the pool
+    parallelizes across documents. Adds "ocr_s" and "metrics", the stage events captured
+    when `collect_metrics`, for the parent to re-emit (it cannot see the worker's sinks).
+    """
+    t0 = time.perf_counter()
+    events = []
+    if collect_metrics:
+        with metrics.capture() as events:
+            ocr = ocr_stage(file_bytes, mime_type, workers=1)
+    else:
+        ocr = ocr_stage(file_bytes, mime_type, workers=1)
+    ocr["ocr_s"] = round(time.perf_counter() - t0, 3)
+    ocr["metrics"] = events
+    return ocr
+
+
+def extract_stage(ocr: Dict, expected_fields: Optional[List[str]] = None, n_consistency: int = 3,
+                  cache=None, token_format: str = "compact", max_runs: Optional[int] = None,
+                  requery: str = "full", chunk_chars: Optional[int] = None, table_items: bool = False,
+                  rules: bool = False) -> Dict:
+    """
+    Route, extract with the LLM and normalize an OCR result; same steps as app.py.
+    With `chunk_chars`, documents longer than that are extracted in chunks (extract_chunked).
+    With `table_items` / `rules`, clean item tables and labelled fields are read without
+    the LLM (see extract_with_llm).
+    """
+    from extractor.router import detect_doc_type
+    from extractor.llm_extract import extract_with_llm, extract_chunked
+    from extractor.normalize_result import normalize_extraction
+
+    doc_type, route_scores = detect_doc_type(ocr["full_text"], ocr["tokens"])
+    fields = expected_fields or default_fields(doc_type)
+    extra = {"max_chunk_chars": chunk_chars} if chunk_chars else {}
+    llm_raw = (extract_chunked if chunk_chars else extract_with_llm)(
+        ocr["full_text"],
+        ocr["tokens"],
+        fields,
+        n_consistency=n_consistency,
+        doc_type=doc_type,
+        cache=cache,
+        token_format=token_format,
+        max_runs=max_runs,
+        requery=requery,
+        table_items=table_items,
+        rules=rules,
+        **extra,
+    )
+    normalized = normalize_extraction(llm_raw, ocr["tokens"])
+    return {"route_scores": route_scores, "normalized": normalized}
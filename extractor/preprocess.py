@@ -0,0 +1,231 @@
+# extractor/preprocess.py
+"""
+NumPy image preprocessing between page rendering and Tesseract:
+grayscale, margin auto-crop, deskew, downscale to a target effective DPI and
+adaptive (local-mean) binarization.
+
+    img, tf = preprocess_image(pil_image, steps=DEFAULT_STEPS, target_dpi=300)
+    table = <OCR img>
+    table = tf.to_source(table)   # bboxes back in the original image's pixels
+
+Enabled for the OCR stage through OCR_PREPROCESS (see steps_from_env), so OCR
+pool workers pick up the same settings.
+"""
+import math
+import os
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from extractor import metrics
+
+STEPS = ("gray", "crop", "deskew", "downscale", "binarize")
+DEFAULT_STEPS = STEPS
+PAGE_WIDTH_IN = 8.5  # assumed page width when the image carries no DPI
+
+
+def to_gray(pil_image) -> np.ndarray:
+    """uint8 luminance (ITU-R 601 weights) as a 2-D array."""
+    if pil_image.mode == "L":
+        return np.asarray(pil_image, dtype=np.uint8)
+    rgb = np.asarray(pil_image.convert("RGB"), dtype=np.float32)
+    return (rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)).round().astype(np.uint8)
+
+
+def _box_mean(gray: np.ndarray, window: int) -> np.ndarray:
+    """Mean over a window x window neighbourhood of every pixel, via an integral image."""
+    h, w = gray.shape
+    r = window // 2
+    ii = np.zeros((h + 1, w + 1), dtype=np.float64)
+    ii[1:, 1:] = gray.cumsum(axis=0, dtype=np.float64).cumsum(axis=1)
+    y0 = np.clip(np.arange(h) - r, 0, h)
+    y1 = np.clip(np.arange(h) + r + 1, 0, h)
+    x0 = np.clip(np.arange(w) - r, 0, w)
+    x1 = np.clip(np.arange(w) + r + 1, 0, w)
+    total = ii[y1][:, x1] - ii[y0][:, x1] - ii[y1][:, x0] + ii[y0][:, x0]
+    area = (y1 - y0)[:, None] * (x1 - x0)[None, :]
+    return total / area
+
+
+def adaptive_binarize(gray: np.ndarray, window: Optional[int] = None, t: float = 0.15) -> np.ndarray:
+    """
+    Bradley local-mean thresholding: a pixel is ink when it is `t` darker than the mean
+    of its neighbourhood. Copes with shadows and uneven lighting on phone photos.
+    Returns uint8 0 (ink) / 255 (paper).
+    """
+    if window is None:
+        window = max(15, (min(gray.shape) // 40) | 1)
+    ink = gray < _box_mean(gray, window) * (1.0 - t)
+    return np.where(ink, 0, 255).astype(np.uint8)
+
+
+def _ink_mask(gray: np.ndarray) -> np.ndarray:
+    # Global cut between paper and ink: well below the typical (paper) brightness
+    return gray < min(160, int(np.median(gray) * 0.75))
+
+
+def content_bbox(gray: np.ndarray, margin: int = 12, min_ink: float = 0.002) -> Tuple[int, int, int, int]:
+    """(x0, y0, x1, y1) around rows / columns with ink, padded by `margin`; whole image if blank."""
+    ink = _ink_mask(gray)
+    h, w = gray.shape
+    rows = np.flatnonzero(ink.sum(axis=1) > max(2, min_ink * w))
+    cols = np.flatnonzero(ink.sum(axis=0) > max(2, min_ink * h))
+    if not len(rows) or not len(cols):
+        return 0, 0, w, h
+    return (int(max(0, cols[0] - margin)), int(max(0, rows[0] - margin)),
+            int(min(w, cols[-1] + 1 + margin)), int(min(h, rows[-1] + 1 + margin)))
+
+
+def text_line_height(gray: np.ndarray, strips: int = 4, quantile: float = 25, min_px: int = 3) -> Optional[float]:
+    """
+    Typical height in pixels of the text lines on a page, None when there is no text.
+    Ink rows are found per vertical strip (so columns do not merge lines) and the
+    heights of their runs summarized with a low quantile, so small print dominates.
+    """
+    ink = _ink_mask(gray)
+    runs = []
+    for band in np.array_split(ink, strips, axis=1):
+        rows = band.sum(axis=1) > 1
+        edges = np.diff(np.concatenate(([0], rows.astype(np.int8), [0])))
+        runs.append(np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1))
+    runs = np.concatenate(runs)
+    runs = runs[runs >= min_px]  # ruling lines and specks
+    if len(runs) < 3:
+        return None
+    return float(np.percentile(runs, quantile))
+
+
+def estimate_skew(gray: np.ndarray, max_angle: float = 5.0, step: float = 0.25,
+                  max_points: int = 60000) -> float:
+    """
+    Skew angle in degrees (PIL rotate() convention: rotating by it levels the text).
+    Projection-profile search: ink pixels are projected onto the y axis at every
+    candidate angle at once, and the angle giving the sharpest row histogram wins.
+    """
+    ink = _ink_mask(gray)
+    ys, xs = np.nonzero(ink)
+    if len(ys) < 100:
+        return 0.0
+    if len(ys) > max_points:
+        pick = np.random.default_rng(0).choice(len(ys), max_points, replace=False)
+        ys, xs = ys[pick], xs[pick]
+    angles = np.arange(-max_angle, max_angle + step / 2, step)
+    rad = np.deg2rad(angles)[:, None]
+    # y coordinate after rotating the page by each candidate angle (PIL: counter-clockwise)
+    proj = (ys[None, :] * np.cos(rad) - xs[None, :] * np.sin(rad)).round().astype(np.int64)
+    proj -= proj.min(axis=1, keepdims=True)
+    n_bins = int(proj.max()) + 1
+    offsets = (np.arange(len(angles)) * n_bins)[:, None]
+    hist = np.bincount((proj + offsets).ravel(), minlength=len(angles) * n_bins).reshape(len(angles), n_bins)
+    score = (hist.astype(np.float64) ** 2).sum(axis=1)
+    best = int(np.argmax(score))
+    if score[best] <= score[len(angles) // 2] * 1.001:
+        return 0.0  # no clear gain over leaving the page as is
+    return float(angles[best])
+
+
+def effective_dpi(pil_image, page_width_in: float = PAGE_WIDTH_IN) -> float:
+    dpi = pil_image.info.get("dpi")
+    try:
+        if dpi and float(dpi[0]) > 1:
+            return float(dpi[0])
+    except (TypeError, ValueError, IndexError):
+        pass
+    return pil_image.size[0] / page_width_in
+
+
+class PreprocessTransform:
+    """Geometry applied by preprocess_image (crop, rotation, scale), to map OCR bboxes back."""
+
+    __slots__ = ("crop", "size", "angle", "scale", "source_size")
+
+    def __init__(self, source_size, crop=None, angle=0.0, scale=1.0):
+        self.source_size = tuple(source_size)
+        self.crop = crop or (0, 0, source_size[0], source_size[1])
+        self.size = (self.crop[2] - self.crop[0], self.crop[3] - self.crop[1])
+        self.angle = angle
+        self.scale = scale
+
+    def is_identity(self) -> bool:
+        return self.crop == (0, 0) + self.source_size and not self.angle and self.scale == 1.0
+
+    def to_source(self, table):
+        """TokenTable with bboxes mapped from the preprocessed image to the source image."""
+        if self.is_identity() or not len(table):
+            return table
+        from extractor.tokens import TokenTable
+
+        xs = np.stack([table.x1, table.x2, table.x2, table.x1], axis=1) / self.scale
+        ys = np.stack([table.y1, table.y1, table.y2, table.y2], axis=1) / self.scale
+        if self.angle:
+            cx, cy = self.size[0] / 2.0, self.size[1] / 2.0
+            a = math.radians(self.angle)
+            dx, dy = xs - cx, ys - cy
+            xs = cx + dx * math.cos(a) - dy * math.sin(a)
+            ys = cy + dx * math.sin(a) + dy * math.cos(a)
+        xs += self.crop[0]
+        ys += self.crop[1]
+        w, h = self.source_size
+        return TokenTable(
+            table.text, table.conf, table.page,
+            np.clip(xs.min(axis=1).round(), 0, w), np.clip(ys.min(axis=1).round(), 0, h),
+            np.clip(xs.max(axis=1).round(), 0, w), np.clip(ys.max(axis=1).round(), 0, h),
+            table.block,
+        )
+
+
+def preprocess_image(pil_image, steps: Sequence[str] = DEFAULT_STEPS, target_dpi: float = 300,
+                     page_width_in: float = PAGE_WIDTH_IN):
+    """
+    Apply the selected `steps` (any of STEPS, always in that order) and return
+    (image ready for Tesseract, PreprocessTransform). Downscaling never enlarges.
+    """
+    from PIL import Image
+
+    steps = set(steps)
+    unknown = steps - set(STEPS)
+    if unknown:
+        raise ValueError(f"unknown preprocessing steps: {sorted(unknown)}")
+    with metrics.stage("preprocess", pixels_in=pil_image.size[0] * pil_image.size[1]) as rec:
+        dpi = effective_dpi(pil_image, page_width_in)
+        gray = to_gray(pil_image)
+        crop, angle, scale = None, 0.0, 1.0
+        if "crop" in steps:
+            crop = content_bbox(gray)
+            gray = gray[crop[1]:crop[3], crop[0]:crop[2]]
+        if "deskew" in steps:
+            angle = estimate_skew(gray)
+        if steps & {"gray", "binarize"}:
+            img = Image.fromarray(gray)
+        else:
+            img = pil_image.convert("RGB")
+            img = img.crop(crop) if crop else img
+        if angle:
+            fill = 255 if img.mode == "L" else (255, 255, 255)
+            img = img.rotate(angle, resample=Image.BICUBIC, expand=False, fillcolor=fill)
+        if "downscale" in steps and dpi > target_dpi:
+            scale = target_dpi / dpi
+            img = img.resize((max(1, round(img.size[0] * scale)), max(1, round(img.size[1] * scale))),
+                             Image.LANCZOS)
+        if "binarize" in steps:
+            img = Image.fromarray(adaptive_binarize(np.asarray(img.convert("L"))))
+        img.info["dpi"] = (dpi * scale, dpi * scale)
+        rec["pixels_out"] = img.size[0] * img.size[1]
+    return img, PreprocessTransform(pil_image.size, crop, angle, scale)
+
+
+def steps_from_env() -> Tuple[str, ...]:
+    """
+    Steps enabled by OCR_PREPROCESS: unset / "0" / "off" = none, "1" / "all" = all,
+    otherwise a comma list such as "gray,deskew,binarize".
+    """
+    spec = os.getenv("OCR_PREPROCESS", "").strip().lower()
+    if spec in ("", "0", "off", "none", "false"):
+        return ()
+    if spec in ("1", "all", "on", "true"):
+        return DEFAULT_STEPS
+    return tuple(s for s in STEPS if s in {p.strip() for p in spec.split(",")})
+
+
+def target_dpi_from_env() -> float:
+    return float(os.getenv("OCR_TARGET_DPI", 300))
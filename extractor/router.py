@@ -1,6 +1,8 @@
 # extractor/router.py
 import re
+import sys
 from typing import List, Dict, Tuple
+from extractor import metrics
 
 # Lightweight keyword sets
 INVOICE_HINTS = [
@@ -24,6 +26,57 @@ PRESCRIPTION_HINTS = [
     "od", "bid", "tid", "qid", "hs", "prn", "after food", "before food"
 ]
 
+_CLASS_HINTS = {
+    "invoice": INVOICE_HINTS,
+    "medical_bill": MEDICAL_BILL_HINTS,
+    "prescription": PRESCRIPTION_HINTS,
+}
+_CLASSES = tuple(_CLASS_HINTS)
+
+
+def _build_hint_matcher():
+    """
+    Compile every hint of every class into one regex, once, at import.
+
+    The pattern is a zero-width lookahead at each word boundary that captures the
+    longest hint starting there, so nothing is consumed and hints nested inside others
+    ("invoice" in "tax invoice") are still seen at their own position. Shorter hints
+    that match at the same position ("invoice" under "invoice no") are exactly those
+    that are a prefix of the captured hint followed by a word boundary, so each
+    captured hint maps to a precomputed per-class count vector. Counts are identical
+    to running `\\b<hint>\\b` separately for every hint.
+    """
+    hints = sorted({w.lower() for ws in _CLASS_HINTS.values() for w in ws}, key=len, reverse=True)
+    alternation = "|".join(re.escape(h) + r"\b" for h in hints)
+    matcher = re.compile(r"\b(?=(" + alternation + r"))")
+
+    vectors = {}
+    for h in hints:
+        vec = []
+        for cls in _CLASSES:
+            n = 0
+            for w in _CLASS_HINTS[cls]:
+                w = w.lower()
+                # h itself is known to end on a boundary; a shorter prefix must be followed by one
+                if w == h or (h.startswith(w) and re.fullmatch(re.escape(w) + r"\b.*", h, re.S)):
+                    n += 1
+            vec.append(n)
+        vectors[h] = vec
+    return matcher, vectors
+
+
+_HINT_MATCHER, _HINT_VECTORS = _build_hint_matcher()
+
+
+def _count_all_classes(text: str) -> Dict[str, int]:
+    """Hint occurrence counts for every class in a single pass over the lowercased text."""
+    totals = [0] * len(_CLASSES)
+    for hint in _HINT_MATCHER.findall(text.lower()):
+        for i, n in enumerate(_HINT_VECTORS[hint]):
+            totals[i] += n
+    return dict(zip(_CLASSES, totals))
+
+
 def _count_occurrences(text: str, words: List[str]) -> int:
     t = text.lower()
     total = 0
@@ -33,39 +86,61 @@ def _count_occurrences(text: str, words: List[str]) -> int:
         total += len(re.findall(pattern, t))
     return total
 
+
+# Token clues, compiled once. _TOKEN_ANY is their union: most tokens match none of
+# them and are rejected with a single search.
+_RX_DOSE = re.compile(r"\b\d+(?:\.\d+)?\s*(mg|ml|mcg)\b")
+_RX_FREQ = re.compile(r"\b(bid|tid|qid|od|hs|prn)\b")
+_RX_INVOICE = re.compile(r"\binvoice\b")
+_RX_INVOICE_TERMS = re.compile(r"\b(subtotal|gst|vat|balance\s*due|po\s*#?|po\s*number)\b")
+_RX_MEDICAL = re.compile(r"\b(hospital|patient\s*id|uhid|ipd|opd|admission|discharge|ward|procedure)\b")
+_TOKEN_ANY = re.compile("|".join(
+    "(?:" + rx.pattern + ")" for rx in (_RX_DOSE, _RX_FREQ, _RX_INVOICE, _RX_INVOICE_TERMS, _RX_MEDICAL)
+))
+
+
+def _is_token_table(tokens):
+    # Only a loaded extractor.tokens can have built a TokenTable; checking this way keeps
+    # routing free of the NumPy import
+    mod = sys.modules.get("extractor.tokens")
+    return mod is not None and isinstance(tokens, mod.TokenTable)
+
+
 def _score_tokens(tokens: List[Dict]) -> Dict[str, float]:
     scores = {"invoice": 0.0, "medical_bill": 0.0, "prescription": 0.0}
-    for tok in tokens:
-        s = (tok.get("text") or "").strip()
-        sl = s.lower()
+    # a TokenTable exposes its text column directly; no per-token dict lookups
+    texts = tokens.text if _is_token_table(tokens) else (tok.get("text") for tok in tokens)
+    for text in texts:
+        s = (text or "").strip()
 
         # Prescription-y clues
         if s in {"Rx", "℞"}:
             scores["prescription"] += 3.0
-        if re.search(r"\b\d+(?:\.\d+)?\s*(mg|ml|mcg)\b", sl):
+
+        sl = s.lower()
+        if not _TOKEN_ANY.search(sl):
+            continue
+        if _RX_DOSE.search(sl):
             scores["prescription"] += 0.6
-        if re.search(r"\b(bid|tid|qid|od|hs|prn)\b", sl):
+        if _RX_FREQ.search(sl):
             scores["prescription"] += 0.8
 
         # Invoice clues
-        if re.search(r"\binvoice\b", sl):
+        if _RX_INVOICE.search(sl):
             scores["invoice"] += 1.0
-        if re.search(r"\b(subtotal|gst|vat|balance\s*due|po\s*#?|po\s*number)\b", sl):
+        if _RX_INVOICE_TERMS.search(sl):
             scores["invoice"] += 0.6
 
         # Medical bill clues
-        if re.search(r"\b(hospital|patient\s*id|uhid|ipd|opd|admission|discharge|ward|procedure)\b", sl):
+        if _RX_MEDICAL.search(sl):
             scores["medical_bill"] += 0.8
 
     return scores
 
+@metrics.instrument("detect_doc_type", lambda res, ocr_text, ocr_tokens: {"chars": len(ocr_text), "tokens": len(ocr_tokens)})
 def detect_doc_type(ocr_text: str, ocr_tokens: List[Dict]) -> Tuple[str, Dict[str, float]]:
     """Return (label, scores) where label ∈ {'invoice','medical_bill','prescription'}."""
-    text_scores = {
-        "invoice": _count_occurrences(ocr_text, INVOICE_HINTS),
-        "medical_bill": _count_occurrences(ocr_text, MEDICAL_BILL_HINTS),
-        "prescription": _count_occurrences(ocr_text, PRESCRIPTION_HINTS),
-    }
+    text_scores = _count_all_classes(ocr_text)
     token_scores = _score_tokens(ocr_tokens)
 
     # Weighted blend: text has more context, tokens add strong clues
@@ -0,0 +1,209 @@
+# extractor/rules.py
+"""
+Deterministic fast path: answer fields that sit next to a printed label ("Invoice No:",
+"Date of issue", "Total Amount") straight from the OCR tokens, without an LLM call.
+
+    fields, remaining = extract_with_rules(tokens, ["InvoiceNumber", "VendorName"])
+
+A field is answered only when its value passes the same checks as extractor.validator,
+its OCR confidence is high enough and every label of the best kind agrees on it;
+everything else is left to the LLM (see extract_with_llm(rules=True)).
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+from extractor import metrics
+from extractor.layout import group_lines, line_bbox, line_cells
+from extractor.validator import is_date, is_invoice_number, is_patient_id, parse_amount
+
+MIN_CONF = 0.85
+
+_DATE = re.compile(
+    r"\d{1,4}[./-]\d{1,2}[./-]\d{2,4}"
+    r"|\d{1,2}(st|nd|rd|th)?\s+[A-Za-z]{3,9}\.?,?\s+\d{2,4}"
+    r"|[A-Za-z]{3,9}\.?\s+\d{1,2}(st|nd|rd|th)?,?\s+\d{2,4}"
+)
+
+
+def _invoice_number(v: str) -> Optional[str]:
+    v = v.strip(" #:.")
+    return v if is_invoice_number(v) else None
+
+
+def _date(v: str) -> Optional[str]:
+    m = _DATE.search(v)
+    return m.group(0) if m and is_date(m.group(0)) else None
+
+
+def _amount(v: str) -> Optional[str]:
+    if not re.fullmatch(r"[^\w]*[\d.,\s]+[^\w]*|[A-Za-z]{0,3}\.?\s*[\d.,\s]+", v.strip()):
+        return None  # one number, maybe with a currency sign / code
+    amount = parse_amount(v)
+    return f"{amount:.2f}" if amount is not None and amount > 0 else None
+
+
+def _identifier(v: str) -> Optional[str]:
+    v = v.strip(" #:.")
+    return v if re.fullmatch(r"[A-Za-z0-9][A-Za-z0-9\-/]*", v) and re.search(r"\d", v) else None
+
+
+def _patient_id(v: str) -> Optional[str]:
+    v = v.strip(" #:.")
+    return v if is_patient_id(v) and re.search(r"\d", v) else None
+
+
+def _name(v: str) -> Optional[str]:
+    v = v.strip(" ,")
+    words = v.split()
+    if not 1 <= len(words) <= 8 or ":" in v or re.search(r"\d", v) or sum(ch.isalpha() for ch in v) < 2:
+        return None
+    return v
+
+
+# field -> (label patterns, best first, matched against the whole label; value check / normalizer)
+FIELD_RULES = {
+    "InvoiceNumber": ((r"(invoice|inv)\.?\s*(no|number|num|#)\.?",), _invoice_number),
+    "InvoiceDate": ((r"invoice\s*date|date\s*of\s*(issue|invoice)|issue\s*date", r"(bill\s*)?date"), _date),
+    "TotalAmount": ((r"grand\s*total|total\s*(payable|due)|amount\s*(due|payable)|balance\s*due",
+                     r"total(\s*(invoice|bill|service))?\s*amount|net\s*amount", r"total"), _amount),
+    "VendorName": ((r"seller|vendor|supplier|sold\s*by|from",), _name),
+    "BillNumber": ((r"bill\s*(no|number|#)\.?", r"receipt\s*(no|number|#)\.?"), _identifier),
+    "PatientName": ((r"patient(\s*name)?",), _name),
+    "PatientID": ((r"patient\s*id|uhid|mrn|reg(istration)?\.?\s*(no|number|id)\.?",), _patient_id),
+    "AdmissionDate": ((r"admission\s*date|date\s*of\s*admission|admitted\s*on|d\.?o\.?a\.?",), _date),
+    "DischargeDate": ((r"discharge\s*date|date\s*of\s*discharge|discharged\s*on|d\.?o\.?d\.?",), _date),
+    "DoctorName": ((r"doctor(\s*name)?|consultant|physician|prescribed\s*by",), _name),
+    "PrescriptionDate": ((r"prescription\s*date|date",), _date),
+}
+
+
+def _split_label(cell: Dict) -> Tuple[str, List[Dict]]:
+    """(label text, value tokens) of a cell: split at the first ':' or after the whole cell."""
+    toks = cell["tokens"]
+    for k, tok in enumerate(toks):
+        text = tok["text"]
+        if text.startswith(":") and k:
+            value = [dict(tok, text=text[1:])] + toks[k + 1:] if len(text) > 1 else toks[k + 1:]
+            return " ".join(t["text"] for t in toks[:k]), value
+        if ":" in text:
+            head, _, tail = text.partition(":")
+            label = " ".join([t["text"] for t in toks[:k]] + [head])
+            return label, ([dict(tok, text=tail)] if tail else []) + toks[k + 1:]
+    return cell["text"], []
+
+
+def _label_rank(label: str, patterns) -> Optional[int]:
+    label = re.sub(r"\s+", " ", label.strip(" .#:-").lower())
+    return next((i for i, p in enumerate(patterns) if re.fullmatch(p, label)), None)
+
+
+def _prefix_label(cell: Dict, patterns) -> Optional[Tuple[int, List[Dict]]]:
+    # label and value in one cell without a colon: "Invoice No 89969473"
+    toks = cell["tokens"]
+    for j in range(len(toks) - 1, 0, -1):
+        rank = _label_rank(" ".join(t["text"] for t in toks[:j]), patterns)
+        if rank is not None:
+            return rank, toks[j:]
+    return None
+
+
+def _candidate(tokens: List[Dict], check) -> Optional[Tuple[str, List[Dict]]]:
+    tokens = [t for t in tokens if t["text"].strip()]
+    if not tokens:
+        return None
+    value = check(" ".join(t["text"] for t in tokens))
+    return (value, tokens) if value else None
+
+
+def _cell_below(lines, cells_of, li: int, cell: Dict) -> Optional[Dict]:
+    # first cell of the next line on the page that overlaps the label horizontally
+    if li + 1 >= len(lines) or lines[li + 1][0].get("page", 1) != lines[li][0].get("page", 1):
+        return None
+    h = line_bbox(lines[li])[3] - line_bbox(lines[li])[1]
+    if line_bbox(lines[li + 1])[1] - line_bbox(lines[li])[3] > 1.5 * h:
+        return None
+    x1, x2 = cell["bbox"][0], cell["bbox"][2]
+    return next((c for c in cells_of(li + 1) if min(c["bbox"][2], x2) > max(c["bbox"][0], x1)), None)
+
+
+def _cells_cache(lines: List[List[Dict]]):
+    cache = {}
+
+    def cells_of(i: int) -> List[Dict]:
+        if i not in cache:
+            cache[i] = line_cells(lines[i])
+        return cache[i]
+    return cells_of
+
+
+def find_field(lines: List[List[Dict]], field: str, cells_of=None) -> Optional[Dict]:
+    """
+    The value of `field` next to its label in the text `lines` (see layout.group_lines):
+    {"name", "value", "confidence", "source": {page, bbox}, "rule": label kind}, or None when
+    no label is found, no candidate validates, or labels of the best kind disagree.
+    Candidates per label, first valid wins: the rest of the label's cell, the cell after it
+    when it is the last one on the line, then the cell right below.
+    """
+    patterns, check = FIELD_RULES[field]
+    cells_of = cells_of or _cells_cache(lines)
+    found = []  # (rank, value, tokens)
+    for li in range(len(lines)):
+        cells = cells_of(li)
+        for ci, cell in enumerate(cells):
+            label, inline = _split_label(cell)
+            rank = _label_rank(label, patterns)
+            if rank is None:
+                hit = _prefix_label(cell, patterns)
+                if hit is None:
+                    continue
+                rank, inline = hit
+            options = [inline]
+            if not any(t["text"].strip() for t in inline):
+                if len(cells) == ci + 2:
+                    options.append(cells[ci + 1]["tokens"])
+                below = _cell_below(lines, cells_of, li, cell)
+                if below is not None:
+                    options.append(below["tokens"])
+            for toks in options:
+                cand = _candidate(toks, check)
+                if cand:
+                    found.append((rank,) + cand)
+                    break
+    if not found:
+        return None
+    best = min(r for r, _, _ in found)
+    top = [(v, toks) for r, v, toks in found if r == best]
+    if len({v.lower() for v, _ in top}) > 1:
+        return None
+    value, toks = top[0]
+    return {
+        "name": field,
+        "value": value,
+        "confidence": round(sum(t["conf"] for t in toks) / len(toks), 2),
+        "source": {"page": toks[0].get("page", 1), "bbox": [int(v) for v in line_bbox(toks)]},
+        "rule": best,
+    }
+
+
+def extract_with_rules(ocr_tokens, expected_fields: List[str], min_conf: float = MIN_CONF
+                       ) -> Tuple[List[Dict], List[str]]:
+    """
+    Answer the `expected_fields` that have a rule (FIELD_RULES) from label/value proximity.
+    Returns (fields in the LLM output format, with "rule" set; fields left for the LLM).
+    A field is answered only if its value's mean OCR confidence is at least `min_conf`.
+    """
+    from extractor.tokens import as_dicts
+
+    with metrics.stage("rules", fields=len(expected_fields)) as rec:
+        wanted = [f for f in expected_fields if f in FIELD_RULES]
+        answered = []
+        if wanted:
+            lines = group_lines(as_dicts(ocr_tokens))
+            cells_of = _cells_cache(lines)
+            for field in wanted:
+                hit = find_field(lines, field, cells_of)
+                if hit and hit["confidence"] >= min_conf:
+                    answered.append(hit)
+        names = {f["name"] for f in answered}
+        rec["answered"] = len(answered)
+        return answered, [f for f in expected_fields if f not in names]
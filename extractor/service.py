@@ -0,0 +1,397 @@
+# extractor/service.py
+"""
+Async HTTP (ASGI) service around the extraction pipeline.
+
+    python -m extractor.service serve --port 8000 --ocr-workers 4 --llm-workers 8
+    uvicorn extractor.service:app            # same app, default settings
+
+Endpoints:
+    POST /jobs?fields=A,B&filename=x.pdf   raw document body (Content-Type = its MIME type)
+                                           -> 202 {"job_id", ...}; 503 when the queue is full
+    GET  /jobs/<id>                        status plus the stage events so far
+    GET  /jobs/<id>/events                 NDJSON stream of stage events until the job ends
+    GET  /jobs/<id>/result                 200 final result, 202 while running, 500 on error
+    GET  /healthz                          queue depths and job counts
+
+Jobs go through two bounded queues: OCR runs in a process pool, then routing, LLM
+extraction and normalization run in a thread pool sharing one LLM client (and its
+connection pool), so the event loop never blocks on a model call. When the LLM stage
+falls behind, OCR consumers block on the LLM queue and new uploads are refused with
+503 + Retry-After instead of piling up.
+
+For local testing without a provider, run the stub model server and point the
+client at it:
+
+    python -m extractor.service stub-llm --port 8001
+    LLM_BASE_URL=http://127.0.0.1:8001/v1 python -m extractor.service serve
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+from extractor import metrics
+from extractor.pipeline import ocr_job
+
+_JOB_PATH = re.compile(r"^/jobs/([0-9a-f]{32})(/events|/result)?/?$")
+
+
+class Job:
+    """One submitted document: status, stage events and (when done) the result."""
+
+    def __init__(self, data: bytes, mime_type: Optional[str], filename: str, fields: Optional[List[str]]):
+        self.id = uuid.uuid4().hex
+        self.data = data
+        self.mime_type = mime_type
+        self.filename = filename
+        self.fields = fields
+        self.status = "queued"
+        self.events: List[Dict] = []
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self._cond = asyncio.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "error")
+
+    async def post(self, event: Dict, status: Optional[str] = None) -> None:
+        async with self._cond:
+            self.events.append(dict(event, ts=round(time.time(), 3)))
+            if status:
+                self.status = status
+            self._cond.notify_all()
+
+    async def wait_events(self, start: int):
+        """Events from index `start` on, waiting until there is at least one or the job ends."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: len(self.events) > start or self.finished)
+            return self.events[start:], self.finished
+
+    def describe(self) -> Dict:
+        return {"job_id": self.id, "file": self.filename, "status": self.status,
+                "error": self.error, "events": self.events}
+
+
+class ExtractionService:
+    """
+    ASGI application. Pools and consumer tasks start on the ASGI lifespan startup
+    event, or on the first request when the server does not send lifespan events.
+    """
+
+    def __init__(self, ocr_workers: Optional[int] = None, llm_workers: int = 4, queue_size: int = 32,
+                 max_jobs: int = 1000, max_upload_mb: float = 25.0, n_consistency: int = 3,
+                 token_format: str = "compact", use_cache: bool = True, llm=None):
+        self.ocr_workers = ocr_workers or os.cpu_count() or 1
+        self.llm_workers = llm_workers
+        self.queue_size = queue_size
+        self.max_jobs = max_jobs
+        self.max_upload = int(max_upload_mb * 1024 * 1024)
+        self.n_consistency = n_consistency
+        self.token_format = token_format
+        self.use_cache = use_cache
+        self.llm = llm
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._started = False
+        self._tasks: List[asyncio.Task] = []
+
+    # ---- lifecycle ----------------------------------------------------------
+
+    async def start(self) -> None:
+        if self._started:
+            return
+        self._started = True
+        self.cache = None
+        # OCR_CACHE_PATH is read by every OCR worker process (see extractor.ocr.get_ocr_cache)
+        if not self.use_cache:
+            os.environ.pop("OCR_CACHE_PATH", None)
+        else:
+            os.environ.setdefault("OCR_CACHE_PATH", ".cache/ocr_cache.sqlite")
+            from extractor.cache import default_llm_cache
+            self.cache = default_llm_cache()
+        metrics.configure_from_env()
+        self._ocr_pool = ProcessPoolExecutor(max_workers=self.ocr_workers)
+        self._llm_pool = ThreadPoolExecutor(max_workers=self.llm_workers, thread_name_prefix="llm")
+        self._ocr_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._llm_queue: asyncio.Queue = asyncio.Queue(maxsize=self.llm_workers)
+        self._tasks = [asyncio.create_task(self._ocr_consumer()) for _ in range(self.ocr_workers)]
+        self._tasks += [asyncio.create_task(self._llm_consumer()) for _ in range(self.llm_workers)]
+
+    async def stop(self) -> None:
+        if not self._started:
+            return
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._ocr_pool.shutdown(wait=False, cancel_futures=True)
+        self._llm_pool.shutdown(wait=False, cancel_futures=True)
+        self._started = False
+
+    # ---- stage consumers ----------------------------------------------------
+
+    async def _ocr_consumer(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._ocr_queue.get()
+            try:
+                await job.post({"stage": "ocr_started"}, status="ocr")
+                ocr = await loop.run_in_executor(self._ocr_pool, ocr_job, job.data, job.mime_type,
+                                                 metrics.enabled())
+                job.data = None  # the upload is no longer needed
+                for ev in ocr.pop("metrics", []):
+                    metrics.emit(ev)
+                if not ocr["tokens"]:
+                    raise RuntimeError("OCR produced no tokens")
+                await job.post({"stage": "ocr", "n_pages": ocr["n_pages"], "n_tokens": len(ocr["tokens"]),
+                                "ocr_s": ocr["ocr_s"]})
+                await self._llm_queue.put((job, ocr))  # blocks while the LLM stage is saturated
+            except Exception as e:
+                await self._fail(job, "ocr", e)
+            finally:
+                self._ocr_queue.task_done()
+
+    async def _llm_consumer(self) -> None:
+        from extractor.router import detect_doc_type
+        from extractor.llm_extract import extract_with_llm
+        from extractor.normalize_result import normalize_extraction
+        from extractor.pipeline import default_fields
+
+        loop = asyncio.get_running_loop()
+
+        def run(fn, *args, **kwargs):
+            return loop.run_in_executor(self._llm_pool, lambda: fn(*args, **kwargs))
+
+        while True:
+            job, ocr = await self._llm_queue.get()
+            stage = "route"
+            try:
+                doc_type, route_scores = await run(detect_doc_type, ocr["full_text"], ocr["tokens"])
+                await job.post({"stage": "route", "doc_type": doc_type, "route_scores": route_scores},
+                               status="extracting")
+                stage = "llm"
+                t0 = time.perf_counter()
+                llm_raw = await run(
+                    extract_with_llm, ocr["full_text"], ocr["tokens"], job.fields or default_fields(doc_type),
+                    n_consistency=self.n_consistency, doc_type=doc_type, cache=self.cache,
+                    token_format=self.token_format, llm=self.llm,
+                )
+                await job.post({"stage": "llm", "llm_s": round(time.perf_counter() - t0, 3),
+                                "fields": [{"name": f.get("name"), "value": f.get("value")}
+                                           for f in llm_raw.get("fields", [])]})
+                stage = "normalize"
+                job.result = await run(normalize_extraction, llm_raw, ocr["tokens"])
+                await job.post({"stage": "result", "result": job.result}, status="done")
+            except Exception as e:
+                await self._fail(job, stage, e)
+            finally:
+                self._llm_queue.task_done()
+
+    async def _fail(self, job: Job, stage: str, err: Exception) -> None:
+        print(f"[SERVICE ERROR] Job {job.id} ({job.filename}) failed in {stage}: {err}")
+        job.error = str(err)
+        job.data = None
+        await job.post({"stage": "error", "failed_stage": stage, "error": str(err)}, status="error")
+
+    def _remember(self, job: Job) -> None:
+        self.jobs[job.id] = job
+        if len(self.jobs) > self.max_jobs:
+            for jid in [j.id for j in self.jobs.values() if j.finished][: len(self.jobs) - self.max_jobs]:
+                del self.jobs[jid]
+
+    # ---- ASGI ---------------------------------------------------------------
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                msg = await receive()
+                if msg["type"] == "lifespan.startup":
+                    await self.start()
+                    await send({"type": "lifespan.startup.complete"})
+                elif msg["type"] == "lifespan.shutdown":
+                    await self.stop()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+        await self.start()
+        method, path = scope["method"], scope["path"]
+        if path == "/jobs" or path == "/jobs/":
+            if method != "POST":
+                return await _send_json(send, 405, {"error": "use POST"})
+            return await self._submit(scope, receive, send)
+        if path == "/healthz":
+            return await _send_json(send, 200, {
+                "ok": True,
+                "ocr_queue": self._ocr_queue.qsize(),
+                "llm_queue": self._llm_queue.qsize(),
+                "jobs": len(self.jobs),
+                "running": sum(1 for j in self.jobs.values() if not j.finished),
+            })
+        m = _JOB_PATH.match(path)
+        if not m:
+            return await _send_json(send, 404, {"error": "not found"})
+        if method != "GET":
+            return await _send_json(send, 405, {"error": "use GET"})
+        job = self.jobs.get(m.group(1))
+        if job is None:
+            return await _send_json(send, 404, {"error": "unknown job"})
+        if m.group(2) == "/events":
+            return await self._stream(job, send)
+        if m.group(2) == "/result":
+            if job.status == "done":
+                return await _send_json(send, 200, job.result)
+            if job.status == "error":
+                return await _send_json(send, 500, {"job_id": job.id, "error": job.error})
+            return await _send_json(send, 202, {"job_id": job.id, "status": job.status})
+        return await _send_json(send, 200, job.describe())
+
+    async def _submit(self, scope, receive, send):
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        filename = (query.get("filename") or ["upload"])[0]
+        fields = [f.strip() for f in ",".join(query.get("fields", [])).split(",") if f.strip()] or None
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        mime = headers.get("content-type", "").split(";")[0].strip()
+        if not mime or mime == "application/octet-stream":
+            from extractor.pipeline import guess_mime_type
+            mime = guess_mime_type(filename)
+
+        chunks, size = [], 0
+        while True:
+            msg = await receive()
+            if msg["type"] == "http.disconnect":
+                return
+            body = msg.get("body", b"")
+            size += len(body)
+            if size > self.max_upload:
+                return await _send_json(send, 413, {"error": f"upload larger than {self.max_upload} bytes"})
+            chunks.append(body)
+            if not msg.get("more_body"):
+                break
+        if not size:
+            return await _send_json(send, 400, {"error": "empty body; send the document bytes"})
+
+        job = Job(b"".join(chunks), mime, filename, fields)
+        try:
+            self._ocr_queue.put_nowait(job)
+        except asyncio.QueueFull:
+            return await _send_json(send, 503, {"error": "queue full, retry later"},
+                                    headers=[(b"retry-after", b"5")])
+        self._remember(job)
+        await job.post({"stage": "queued", "file": filename, "bytes": size, "mime_type": mime})
+        return await _send_json(send, 202, {
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/jobs/{job.id}",
+            "events_url": f"/jobs/{job.id}/events",
+            "result_url": f"/jobs/{job.id}/result",
+        })
+
+    async def _stream(self, job: Job, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/x-ndjson"), (b"cache-control", b"no-cache")]})
+        sent = 0
+        while True:
+            events, finished = await job.wait_events(sent)
+            sent += len(events)
+            body = "".join(json.dumps(ev, ensure_ascii=False) + "\n" for ev in events).encode("utf-8")
+            done = finished and sent >= len(job.events)
+            await send({"type": "http.response.body", "body": body, "more_body": not done})
+            if done:
+                return
+
+
+async def _send_json(send, status: int, payload, headers=None):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode())] + (headers or [])})
+    await send({"type": "http.response.body", "body": body})
+
+
+def _stub_content(messages) -> str:
+    # Echo the requested field names back with empty values, in the schema build_prompt asks for
+    user = next((m["content"] for m in messages if m.get("role") == "user"), "")
+    m = re.search(r"EXTRACT FIELDS: (\[.*?\])", user)
+    names = json.loads(m.group(1)) if m else []
+    return json.dumps({"doc_type": "", "fields": [{"name": n, "value": "", "confidence": 0.0} for n in names],
+                       "line_items": [], "overall_confidence": 0.0,
+                       "qa": {"passed_rules": [], "failed_rules": [], "notes": "stub"}})
+
+
+async def stub_llm_app(scope, receive, send):
+    """Minimal OpenAI-compatible /v1/chat/completions endpoint for local tests (no provider, no key)."""
+    if scope["type"] != "http":
+        return
+    if scope["method"] != "POST" or not scope["path"].endswith("/chat/completions"):
+        return await _send_json(send, 404, {"error": "not found"})
+    body = b""
+    while True:
+        msg = await receive()
+        body += msg.get("body", b"")
+        if not msg.get("more_body"):
+            break
+    req = json.loads(body or b"{}")
+    content = _stub_content(req.get("messages", []))
+    await _send_json(send, 200, {
+        "id": "stub-" + uuid.uuid4().hex[:12],
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": req.get("model", "stub"),
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    })
+
+
+app = ExtractionService()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m extractor.service", description=__doc__.split("\n\n")[0].strip())
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("serve", help="run the extraction service")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8000)
+    p.add_argument("--ocr-workers", type=int, default=None, help="OCR processes (default: CPU count)")
+    p.add_argument("--llm-workers", type=int, default=4, help="documents in the LLM stage at once")
+    p.add_argument("--queue-size", type=int, default=32, help="uploads waiting for OCR before 503")
+    p.add_argument("--n-consistency", type=int, default=3)
+    p.add_argument("--token-format", choices=["json", "compact", "layout"], default="compact")
+    p.add_argument("--no-cache", action="store_true", help="do not use the LLM / OCR caches")
+    p.add_argument("--llm", choices=["live", "stub"], default="live",
+                   help="stub: answer in-process with empty fields (no model server)")
+    s = sub.add_parser("stub-llm", help="run a stub OpenAI-compatible model server")
+    s.add_argument("--host", default="127.0.0.1")
+    s.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args(argv)
+
+    try:
+        import uvicorn
+    except ImportError:
+        parser.error("uvicorn is required to serve: pip install uvicorn")
+
+    if args.cmd == "stub-llm":
+        uvicorn.run(stub_llm_app, host=args.host, port=args.port, log_level="warning")
+        return
+    llm = None
+    if args.llm == "stub":
+        def llm(messages, **kwargs):
+            return _stub_content(messages)
+    service = ExtractionService(
+        ocr_workers=args.ocr_workers, llm_workers=args.llm_workers, queue_size=args.queue_size,
+        n_consistency=args.n_consistency, token_format=args.token_format,
+        use_cache=not args.no_cache, llm=llm,
+    )
+    uvicorn.run(service, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# extractor/spatial.py
+import math
+from collections import defaultdict
+from typing import List, Dict, Iterable, Optional
+
+
+def intersects(a, b) -> bool:
+    """True if rectangles [x1,y1,x2,y2] a and b overlap (touching edges count)."""
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class TokenIndex:
+    """
+    Per-page uniform grid over OCR token bboxes, built once per document.
+    Each token is registered in every grid cell its bbox covers, so a rectangle query
+    only looks at tokens in the cells the rectangle covers instead of the whole page.
+    """
+
+    def __init__(self, tokens: Iterable[Dict], cell: Optional[float] = None):
+        self.tokens = list(tokens)
+        if cell is None:
+            # ~4 median token heights per cell keeps buckets small but tokens in few cells
+            heights = sorted(max(1, t["bbox"][3] - t["bbox"][1]) for t in self.tokens)
+            cell = 4.0 * heights[len(heights) // 2] if heights else 64.0
+        self.cell = max(8.0, float(cell))
+        self._grid = defaultdict(lambda: defaultdict(list))  # page -> (cx, cy) -> token indices
+        for i, t in enumerate(self.tokens):
+            grid = self._grid[t.get("page")]
+            for key in self._cells(t["bbox"]):
+                grid[key].append(i)
+        self._extent = {  # page -> occupied cells (cx1, cy1, cx2, cy2)
+            page: (min(cx for cx, _ in grid), min(cy for _, cy in grid),
+                   max(cx for cx, _ in grid), max(cy for _, cy in grid))
+            for page, grid in self._grid.items()
+        }
+
+    def _cells(self, bbox):
+        c = self.cell
+        x1, y1 = int(bbox[0] // c), int(bbox[1] // c)
+        x2, y2 = int(bbox[2] // c), int(bbox[3] // c)
+        for cx in range(x1, x2 + 1):
+            for cy in range(y1, y2 + 1):
+                yield cx, cy
+
+    def query(self, page, bbox, pad: float = 0) -> List[Dict]:
+        """Tokens on `page` whose bbox intersects `bbox` grown by `pad`, in original token order."""
+        grid = self._grid.get(page)
+        if not grid:
+            return []
+        rect = [bbox[0] - pad, bbox[1] - pad, bbox[2] + pad, bbox[3] + pad]
+        if any(math.isnan(v) for v in rect):
+            return []
+        # Only occupied cells can hold tokens: clamp the rectangle to them, so a huge or
+        # infinite bbox costs no more than the page's grid
+        ex1, ey1, ex2, ey2 = self._extent[page]
+        c = self.cell
+        x1, x2 = (int(min(max(v, ex1 * c), ex2 * c) // c) for v in (rect[0], rect[2]))
+        y1, y2 = (int(min(max(v, ey1 * c), ey2 * c) // c) for v in (rect[1], rect[3]))
+        if (x2 - x1 + 1) * (y2 - y1 + 1) > len(grid):
+            keys = [k for k in grid if x1 <= k[0] <= x2 and y1 <= k[1] <= y2]
+        else:
+            keys = ((cx, cy) for cx in range(x1, x2 + 1) for cy in range(y1, y2 + 1))
+        hits = set()
+        for key in keys:
+            for i in grid.get(key, ()):
+                if i not in hits and intersects(self.tokens[i]["bbox"], rect):
+                    hits.add(i)
+        return [self.tokens[i] for i in sorted(hits)]
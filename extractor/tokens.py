@@ -0,0 +1,213 @@
+# extractor/tokens.py
+import sys
+from collections.abc import Mapping
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+_FIELDS = ("text", "conf", "bbox", "page", "block_id")
+
+
+class TokenView(Mapping):
+    """Read-only dict view of one row of a TokenTable: {"text", "conf", "bbox", "page", "block_id"}."""
+
+    __slots__ = ("_table", "_i")
+
+    def __init__(self, table: "TokenTable", i: int):
+        self._table = table
+        self._i = i
+
+    def __getitem__(self, key):
+        t, i = self._table, self._i
+        if key == "text":
+            return t.text[i]
+        if key == "conf":
+            return float(t.conf[i])
+        if key == "bbox":
+            return [int(t.x1[i]), int(t.y1[i]), int(t.x2[i]), int(t.y2[i])]
+        if key == "page":
+            return int(t.page[i])
+        if key == "block_id":
+            return int(t.block[i])
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(_FIELDS)
+
+    def __len__(self):
+        return len(_FIELDS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class TokenTable:
+    """
+    Columnar OCR token store: NumPy columns for page, conf, x1/y1/x2/y2 and layout
+    block (0 = none, see extractor.regions) plus an interned text list. Uses a fraction
+    of the memory of one dict per word and supports vectorized bbox/conf queries.
+    Iterating yields TokenView dict views, so code written for the list-of-dicts format
+    keeps working; to_dicts() gives real dicts.
+    """
+
+    __slots__ = ("text", "conf", "page", "x1", "y1", "x2", "y2", "block")
+
+    def __init__(self, text: List[str], conf, page, x1, y1, x2, y2, block=None):
+        self.text = text
+        self.conf = np.asarray(conf, dtype=np.float64)
+        self.page = np.asarray(page, dtype=np.int32)
+        self.x1 = np.asarray(x1, dtype=np.int32)
+        self.y1 = np.asarray(y1, dtype=np.int32)
+        self.x2 = np.asarray(x2, dtype=np.int32)
+        self.y2 = np.asarray(y2, dtype=np.int32)
+        self.block = np.zeros(len(text), dtype=np.int32) if block is None else np.asarray(block, dtype=np.int32)
+
+    # ---- construction -------------------------------------------------------
+
+    @classmethod
+    def empty(cls) -> "TokenTable":
+        return cls([], [], [], [], [], [], [])
+
+    @classmethod
+    def from_tesseract(cls, data: Dict[str, Sequence], page: int = 1) -> "TokenTable":
+        """Build from pytesseract's image_to_data(output_type=Output.DICT) arrays."""
+        stripped = [str(s).strip() for s in data["text"]]
+        keep = np.fromiter((bool(s) for s in stripped), dtype=bool, count=len(stripped))
+        idx = np.flatnonzero(keep)
+        try:
+            conf = np.asarray(data["conf"], dtype=np.float64)
+        except (TypeError, ValueError):
+            conf = np.array([_to_float(c) for c in data["conf"]], dtype=np.float64)
+        left = np.asarray(data["left"], dtype=np.int32)[idx]
+        top = np.asarray(data["top"], dtype=np.int32)[idx]
+        width = np.asarray(data["width"], dtype=np.int32)[idx]
+        height = np.asarray(data["height"], dtype=np.int32)[idx]
+        return cls(
+            [sys.intern(stripped[i]) for i in idx],
+            np.maximum(conf[idx], 0.0) / 100.0,
+            np.full(len(idx), page, dtype=np.int32),
+            left, top, left + width, top + height,
+        )
+
+    @classmethod
+    def from_dicts(cls, tokens: Iterable[Dict], page: Optional[int] = None) -> "TokenTable":
+        """Build from the list-of-dicts format; `page` overrides/sets the page of every token."""
+        tokens = list(tokens)
+        bboxes = np.array([t["bbox"] for t in tokens], dtype=np.float64).reshape(-1, 4).round()
+        return cls(
+            [sys.intern(t["text"]) for t in tokens],
+            [t["conf"] for t in tokens],
+            [page if page is not None else t.get("page", 1) for t in tokens],
+            bboxes[:, 0], bboxes[:, 1], bboxes[:, 2], bboxes[:, 3],
+            [t.get("block_id", 0) for t in tokens],
+        )
+
+    @classmethod
+    def concat(cls, tables: Iterable["TokenTable"]) -> "TokenTable":
+        tables = [t for t in tables if len(t)]
+        if not tables:
+            return cls.empty()
+        return cls(
+            [s for t in tables for s in t.text],
+            *(np.concatenate([getattr(t, col) for t in tables])
+              for col in ("conf", "page", "x1", "y1", "x2", "y2", "block"))
+        )
+
+    def with_page(self, page: int) -> "TokenTable":
+        self.page = np.full(len(self), page, dtype=np.int32)
+        return self
+
+    def with_block(self, block: int) -> "TokenTable":
+        self.block = np.full(len(self), block, dtype=np.int32)
+        return self
+
+    def take(self, idx) -> "TokenTable":
+        """Subset by integer indices or boolean mask."""
+        idx = np.flatnonzero(idx) if np.asarray(idx).dtype == bool else np.asarray(idx, dtype=np.int64)
+        return TokenTable([self.text[i] for i in idx], self.conf[idx], self.page[idx],
+                          self.x1[idx], self.y1[idx], self.x2[idx], self.y2[idx], self.block[idx])
+
+    def scaled(self, factor: float) -> "TokenTable":
+        """Copy with bboxes multiplied by `factor`, e.g. pixels at one DPI to another."""
+        if factor == 1:
+            return self
+        return TokenTable(self.text, self.conf, self.page,
+                          *(np.round(getattr(self, c) * factor) for c in ("x1", "y1", "x2", "y2")), self.block)
+
+    def shifted(self, dx: int, dy: int) -> "TokenTable":
+        """Copy with bboxes moved by (dx, dy), e.g. from a crop back to its page."""
+        return TokenTable(self.text, self.conf, self.page, self.x1 + dx, self.y1 + dy,
+                          self.x2 + dx, self.y2 + dy, self.block)
+
+    # ---- dict compatibility -------------------------------------------------
+
+    def __len__(self):
+        return len(self.text)
+
+    def __getitem__(self, i: int) -> TokenView:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return TokenView(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield TokenView(self, i)
+
+    def to_dicts(self, include_page: bool = True) -> List[Dict]:
+        """Token dicts; "block_id" is only included when the tokens come from region OCR."""
+        conf = self.conf.tolist()
+        boxes = np.stack([self.x1, self.y1, self.x2, self.y2], axis=1).tolist()
+        if not include_page:
+            return [{"text": s, "conf": c, "bbox": b} for s, c, b in zip(self.text, conf, boxes)]
+        pages = self.page.tolist()
+        if not self.block.any():
+            return [{"text": s, "conf": c, "bbox": b, "page": p}
+                    for s, c, b, p in zip(self.text, conf, boxes, pages)]
+        blocks = self.block.tolist()
+        return [{"text": s, "conf": c, "bbox": b, "page": p, "block_id": k}
+                for s, c, b, p, k in zip(self.text, conf, boxes, pages, blocks)]
+
+    # ---- vectorized queries -------------------------------------------------
+
+    @property
+    def bboxes(self) -> np.ndarray:
+        """(N, 4) array of [x1, y1, x2, y2]."""
+        return np.stack([self.x1, self.y1, self.x2, self.y2], axis=1)
+
+    def full_text(self) -> str:
+        return " ".join(self.text)
+
+    def in_bbox(self, page: int, bbox: Sequence[float], pad: float = 0) -> np.ndarray:
+        """Boolean mask of tokens on `page` whose bbox intersects `bbox` grown by `pad`."""
+        return (
+            (self.page == page)
+            & (self.x1 <= bbox[2] + pad) & (self.x2 >= bbox[0] - pad)
+            & (self.y1 <= bbox[3] + pad) & (self.y2 >= bbox[1] - pad)
+        )
+
+    def confs_in(self, page: int, bbox: Sequence[float], pad: float = 0) -> List[float]:
+        return self.conf[self.in_bbox(page, bbox, pad)].tolist()
+
+    def pages(self) -> List[int]:
+        return np.unique(self.page).tolist()
+
+    def nbytes(self) -> int:
+        """Approximate memory footprint (columns + text list, shared interned strings excluded)."""
+        cols = sum(getattr(self, c).nbytes for c in ("conf", "page", "x1", "y1", "x2", "y2", "block"))
+        return cols + sys.getsizeof(self.text)
+
+
+def _to_float(v) -> float:
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def as_dicts(tokens) -> List[Dict]:
+    """Return `tokens` in the list-of-dicts format, whatever the input representation."""
+    if isinstance(tokens, TokenTable):
+        return tokens.to_dicts()
+    return tokens
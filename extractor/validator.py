@@ -1,6 +1,12 @@
 # extractor/validator.py
 import re
-from dateutil.parser import parse as dateparse
+from extractor import metrics
+
+
+def dateparse(*args, **kwargs):
+    # dateutil is only imported once a date is actually validated
+    from dateutil.parser import parse
+    return parse(*args, **kwargs)
 
 def is_currency(s: str) -> bool:
     try:
@@ -9,6 +15,30 @@ def is_currency(s: str) -> bool:
     except Exception:
         return False
 
+def parse_amount(s):
+    """
+    Float value of a quantity / money string ("1,234.56", "1.234,56", "$ 72,54", "10%"),
+    None if it is not a number. A lone comma followed by 1-2 digits is a decimal comma.
+    """
+    t = re.sub(r"[^\d,.\-]", "", str(s))
+    if not re.search(r"\d", t):
+        return None
+    if "," in t and "." in t:
+        dec = "," if t.rfind(",") > t.rfind(".") else "."
+        t = t.replace("." if dec == "," else ",", "").replace(",", ".")
+    elif "," in t:
+        t = t.replace(",", ".") if re.search(r",\d{1,2}$", t) and t.count(",") == 1 else t.replace(",", "")
+    try:
+        return float(t)
+    except ValueError:
+        return None
+
+def is_invoice_number(s) -> bool:
+    return bool(re.match(r"^(INV[-/]?\d+|\d+)$", str(s), re.I))
+
+def is_patient_id(s) -> bool:
+    return bool(re.match(r"^[A-Za-z0-9\-]+$", str(s)))
+
 def is_date(s: str) -> bool:
     try:
         dateparse(s, fuzzy=True)
@@ -20,7 +50,7 @@ def validate_invoice_fields(fields: dict, line_items: list):
     passed, failed, notes = [], [], []
 
     # InvoiceNumber regex
-    if re.match(r"^(INV[-/]?\d+|\d+)$", str(fields.get("InvoiceNumber", "")), re.I):
+    if is_invoice_number(fields.get("InvoiceNumber", "")):
         passed.append("invoice_number_format")
     else:
         failed.append("invoice_number_format")
@@ -67,7 +97,7 @@ def validate_medical_bill(fields: dict, line_items: list):
         failed.append("patient_name_present")
 
     # PatientID alphanumeric
-    if re.match(r"^[A-Za-z0-9\-]+$", str(fields.get("PatientID", ""))):
+    if is_patient_id(fields.get("PatientID", "")):
         passed.append("patient_id_format")
     else:
         failed.append("patient_id_format")
@@ -139,6 +169,7 @@ def validate_prescription(fields: dict, line_items: list):
 
     return {"passed_rules": passed, "failed_rules": failed, "notes": ";".join(notes)}
 
+@metrics.instrument("validate_fields", lambda res, *a, **k: {"passed": len(res["passed_rules"]), "failed": len(res["failed_rules"])})
 def validate_fields(doc_type: str, fields: dict, line_items: list):
     if doc_type == "invoice":
         return validate_invoice_fields(fields, line_items)
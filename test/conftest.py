@@ -0,0 +1,49 @@
+# test/conftest.py
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def tok(text, x1, y1, x2, y2, conf=0.95, page=1):
+    return {"text": text, "conf": conf, "bbox": [x1, y1, x2, y2], "page": page}
+
+
+def words(line, y, x=40, char_w=10, h=20, conf=0.95, page=1):
+    """Tokens for one text line: words split at single spaces, wider gaps kept as given."""
+    out = []
+    for w in line.split(" "):
+        if w:
+            out.append(tok(w, x, y, x + char_w * len(w), y + h, conf, page))
+            x += char_w * len(w)
+        x += char_w
+    return out
+
+
+class StubLLM:
+    """call_llm stand-in: returns `answers` in turn (the last one repeats), sleeping `delay` per call."""
+
+    def __init__(self, *answers, delay=0.0):
+        self.answers = [a if isinstance(a, str) else json.dumps(a) for a in answers]
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, messages, model=None, temperature=0.0):
+        with self._lock:
+            n = len(self.calls)
+            self.calls.append(messages)
+        time.sleep(self.delay)
+        return self.answers[min(n, len(self.answers) - 1)]
+
+
+@pytest.fixture
+def stub_llm():
+    return StubLLM
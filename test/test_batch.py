@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from extractor import batch
+
+_lock = threading.Lock()
+_state = {"submitted": 0, "done": 0, "peak": 0}
+
+
+class CountingPool(ThreadPoolExecutor):
+    # stands in for the OCR process pool; records the documents in flight at each submit
+    def submit(self, fn, *args, **kwargs):
+        with _lock:
+            _state["submitted"] += 1
+            _state["peak"] = max(_state["peak"], _state["submitted"] - _state["done"])
+        return super().submit(fn, *args, **kwargs)
+
+
+def _fake_ocr(directory, rel, collect=False):
+    return {"tokens": [{"text": rel}], "n_pages": 1, "ocr_s": 0.0, "metrics": []}
+
+
+def _fake_extract(ocr, *args):
+    time.sleep(0.02)  # the LLM stage is the bottleneck
+    with _lock:
+        _state["done"] += 1
+    return {"normalized": {"fields": []}, "route_scores": {}, "llm_s": 0.02}
+
+
+def _run(tmp_path, monkeypatch, n_docs=20):
+    _state.update(submitted=0, done=0, peak=0)
+    docs = tmp_path / "docs"
+    docs.mkdir(exist_ok=True)
+    for i in range(n_docs):
+        (docs / f"{i:02d}.pdf").write_bytes(b"")
+    monkeypatch.setattr(batch, "ProcessPoolExecutor", CountingPool)
+    monkeypatch.setattr(batch, "_ocr_job", _fake_ocr)
+    monkeypatch.setattr(batch, "_extract_job", _fake_extract)
+    out = tmp_path / "out.jsonl"
+    return batch.run_batch(str(docs), str(out), ocr_workers=1, llm_workers=1), out
+
+
+def test_documents_in_flight_are_bounded(tmp_path, monkeypatch):
+    stats, _ = _run(tmp_path, monkeypatch)
+    assert stats["ok"] == 20
+    assert _state["peak"] <= 1 + 2 * 1
+
+
+def test_resume_skips_finished_documents(tmp_path, monkeypatch):
+    _run(tmp_path, monkeypatch)
+    with open(tmp_path / "out.jsonl", "a") as fh:
+        fh.write('{"file": "torn')  # crash mid-line
+    stats, _ = _run(tmp_path, monkeypatch)
+    assert (stats["skipped"], stats["ok"]) == (20, 0)
+
+
+def test_no_cache_disables_an_inherited_ocr_cache(tmp_path, monkeypatch):
+    seen = {}
+
+    def run_batch(directory, out, cache=None, **kwargs):
+        seen.update(cache=cache, ocr_cache=os.environ.get("OCR_CACHE_PATH"))
+        return {}
+
+    monkeypatch.setenv("OCR_CACHE_PATH", str(tmp_path / "ocr.sqlite"))
+    monkeypatch.setattr(batch, "run_batch", run_batch)
+    batch.main([str(tmp_path), "--out", str(tmp_path / "out.jsonl"), "--no-cache"])
+    assert seen == {"cache": None, "ocr_cache": None}
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from extractor.cache import FileCache, SQLiteCache, make_key, open_cache
+
+
+@pytest.fixture(params=["sqlite", "files"])
+def make_cache(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "sqlite":
+            return SQLiteCache(str(tmp_path / "cache.sqlite"), **kwargs)
+        return FileCache(str(tmp_path / "cache"), **kwargs)
+    return make
+
+
+def test_make_key_is_content_addressed():
+    assert make_key("m", 0.3, [{"role": "user", "content": "x"}], 0) == \
+        make_key("m", 0.3, [{"content": "x", "role": "user"}], 0)
+    assert make_key("m", 0.3, "x", 0) != make_key("m", 0.3, "x", 1)
+
+
+def test_open_cache_picks_backend(tmp_path):
+    assert isinstance(open_cache(str(tmp_path / "a.sqlite")), SQLiteCache)
+    assert isinstance(open_cache(str(tmp_path / "dir")), FileCache)
+
+
+def test_roundtrip_and_stats(make_cache):
+    cache = make_cache()
+    assert cache.get("k") is None
+    cache.set("k", {"fields": [1, 2]})
+    assert cache.get("k") == {"fields": [1, 2]}
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_least_recently_used_is_evicted(make_cache):
+    cache = make_cache(max_entries=2)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    cache.set("b", 2)
+    time.sleep(0.02)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    time.sleep(0.02)
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_ttl_expires_entries(make_cache):
+    cache = make_cache(ttl=0.05)
+    cache.set("k", 1)
+    time.sleep(0.1)
+    assert cache.get("k") is None
+
+
+def test_file_cache_ttl_counts_from_write_not_last_read(tmp_path):
+    cache = FileCache(str(tmp_path / "cache"), ttl=0.15)
+    cache.set("a", 1)
+    time.sleep(0.1)
+    assert cache.get("a") == 1
+    time.sleep(0.1)
+    cache.set("b", 2)  # eviction pass: "a" was written 0.2s ago, read 0.1s ago
+    assert cache.stats()["entries"] == 1
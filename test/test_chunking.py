@@ -0,0 +1,68 @@
+from conftest import StubLLM, words
+from extractor.llm_extract import _row_chars, chunk_tokens, extract_chunked, merge_chunk_results
+from extractor.layout import group_lines
+
+
+def _page(page, n_lines, y0=20):
+    return [t for i in range(n_lines) for t in words(f"line {i} of page {page}", y0 + 30 * i, page=page)]
+
+
+def _chars(tokens):
+    return sum(_row_chars(line) for line in group_lines(tokens))
+
+
+def test_whole_pages_are_packed_while_they_fit():
+    pages = [_page(p, 3) for p in (1, 2, 3)]
+    budget = _chars(pages[0]) * 2
+    chunks = chunk_tokens([t for page in pages for t in page], max_chars=budget)
+    assert [sorted({t["page"] for t in c}) for c in chunks] == [[1, 2], [3]]
+    assert [t for c in chunks for t in c] == [t for page in pages for t in page]  # no overlap, in order
+
+
+def test_oversized_page_is_cut_into_line_bands():
+    tokens = _page(1, 6)
+    line_chars = _chars(tokens[:5])  # one line
+    chunks = chunk_tokens(tokens, max_chars=2 * line_chars)
+    assert [len(group_lines(c)) for c in chunks] == [2, 2, 2]
+    assert all(_chars(c) <= 2 * line_chars for c in chunks)
+
+
+def test_document_that_fits_is_one_chunk():
+    tokens = _page(1, 3) + _page(2, 3)
+    assert chunk_tokens(tokens, max_chars=10 ** 6) == [tokens]
+
+
+def _field(name, value, page, y):
+    return {"name": name, "value": value, "source": {"page": page, "bbox": [40, y, 200, y + 20]}}
+
+
+def test_merge_keeps_the_most_confident_duplicate():
+    chunks = [words("Total 10.00", 20, conf=0.5), words("Total 12.50", 20, page=2, conf=0.99)]
+    low, high = _field("TotalAmount", "10.00", 1, 20), _field("TotalAmount", "12.50", 2, 20)
+    number = _field("InvoiceNumber", "4711", 2, 20)
+    results = [
+        {"doc_type": "invoice", "fields": [low, _field("InvoiceNumber", "", 1, 0)], "_llm_runs": [{"fields": [low]}]},
+        {"doc_type": "invoice", "fields": [high, number], "_llm_runs": [{"fields": [high, number]}]},
+    ]
+    merged = merge_chunk_results(results, chunks, ["InvoiceNumber", "TotalAmount"])
+    assert [(f["name"], f["value"]) for f in merged["fields"]] == [("InvoiceNumber", "4711"), ("TotalAmount", "12.50")]
+    assert merged["_chunk_sources"] == {"InvoiceNumber": 1, "TotalAmount": 1}
+    assert [f["value"] for f in merged["_llm_runs"][0]["fields"]] == ["4711", "12.50"]
+
+
+def test_merge_concatenates_line_items_once_in_chunk_order():
+    a = {"description": "Widget", "amount": 20.0, "source": {"page": 1, "bbox": [40, 100, 400, 120]}}
+    b = {"description": "Widget", "amount": 20.0, "source": {"page": 2, "bbox": [40, 100, 400, 120]}}
+    c = {"description": "Gadget", "amount": 5.5, "source": {"page": 2, "bbox": [40, 130, 400, 150]}}
+    results = [{"fields": [], "line_items": [a, a]}, None, {"fields": [], "line_items": [b, c]}]
+    merged = merge_chunk_results(results, [[], [], []], [])
+    assert merged["line_items"] == [a, b, c]  # the same item on another page is kept
+
+
+def test_extract_chunked_extracts_every_chunk():
+    tokens = _page(1, 3) + _page(2, 3)
+    llm = StubLLM({"doc_type": "invoice", "fields": [], "line_items": []})
+    result = extract_chunked("", tokens, ["InvoiceNumber"], max_chunk_chars=_chars(_page(1, 3)),
+                             n_consistency=1, llm=llm)
+    assert len(llm.calls) == 2
+    assert [c["pages"] for c in result["_chunks"]] == [[1], [2]]
@@ -0,0 +1,34 @@
+from conftest import words
+from extractor.layout import find_tables, group_lines, table_line_items
+
+ROWS = [
+    "Description          Qty    Price     Amount",
+    "Widget, blue          2     10.00      20.00",
+    "Gadget                1      5.50       5.50",
+    "  with carry case",
+    "Subtotal                                25.50",
+    "Total                                   25.50",
+]
+
+
+def _tables(rows):
+    tokens = [t for i, row in enumerate(rows) for t in words(row, 20 + 25 * i)]
+    return find_tables(group_lines(tokens))
+
+
+def test_wrapped_description_joins_its_row():
+    table = _tables(ROWS[:4])[0]
+    assert table["header"] == ["Description", "Qty", "Price", "Amount"]
+    assert table["rows"][1]["cells"][0] == "Gadget with carry case"
+
+
+def test_total_row_is_not_merged_into_last_item():
+    tables = _tables(ROWS)
+    assert [row["cells"][0] for row in tables[0]["rows"]] == ["Widget, blue", "Gadget with carry case"]
+    items = table_line_items(tables)
+    assert [(i["description"], i["amount"]) for i in items] == [("Widget, blue", 20.0), ("Gadget with carry case", 5.5)]
+
+
+def test_total_row_under_a_single_line_item():
+    tables = _tables(ROWS[:3] + ["Total                                   25.50"])
+    assert tables[0]["rows"][-1]["cells"] == ["Gadget", "1", "5.50", "5.50"]
@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+from extractor.llm_client import LLMClient, ModelRoute, RateLimiter, parse_model_routes
+
+ROUTES = [ModelRoute("slow", slo_s=0.05), ModelRoute("fast", slo_s=5.0)]
+
+
+def _client(latency, **kwargs):
+    client = LLMClient(api_key="test", **kwargs)
+
+    def complete(messages, model, cancel=None, **kw):
+        time.sleep(latency[model])
+        return f'{{"model": "{model}"}}'
+    client.complete = complete
+    return client
+
+
+def test_slow_model_is_hedged_and_abandoned():
+    client = _client({"slow": 0.4, "fast": 0.01})
+    start = time.perf_counter()
+    text, model = client.complete_hedged([], ROUTES, return_model=True)
+    assert model == "fast" and "fast" in text
+    assert time.perf_counter() - start < 0.3
+    assert client._surplus == 1  # the slow call is still running, abandoned
+    time.sleep(0.5)
+    assert client._surplus == 0
+
+
+def test_hedges_are_capped():
+    client = _client({"slow": 0.2, "fast": 0.01}, max_hedges=1)
+    client._surplus = 1  # another caller's hedge still in flight
+    assert client.complete_hedged([], ROUTES, return_model=True)[1] == "slow"
+
+
+def test_failed_model_falls_back():
+    client = LLMClient(api_key="test")
+
+    def complete(messages, model, cancel=None, **kw):
+        if model == "slow":
+            raise RuntimeError("down")
+        return "{}"
+    client.complete = complete
+    assert client.complete_hedged([], ROUTES, return_model=True) == ("{}", "fast")
+
+
+def test_parse_model_routes():
+    routes = parse_model_routes("a@8, b ,c@x", default_slo=20)
+    assert [(r.model, r.slo_s) for r in routes] == [("a", 8.0), ("b", 20.0)]
+
+
+def test_rate_limiter_paces_requests():
+    limiter = RateLimiter(requests_per_min=600)  # 10/s, bucket starts full
+    limiter.requests._tokens = 0
+    assert limiter.acquire() == pytest.approx(0.1, abs=0.05)
+
+
+def test_fallback_answers_are_cached_under_their_model(tmp_path, monkeypatch):
+    from extractor import llm_extract
+    from extractor.cache import open_cache, make_key
+
+    calls = []
+
+    def call_llm(messages, model, temperature, return_model=False):
+        calls.append(model)
+        return '{"fields": []}', "fallback-model"
+    monkeypatch.setattr(llm_extract, "call_llm", call_llm)
+    cache = open_cache(str(tmp_path / "llm.sqlite"))
+    messages = [{"role": "user", "content": "x"}]
+    for _ in range(2):
+        llm_extract._run_llm(messages, [0], model="primary", cache=cache)
+    assert len(calls) == 2  # not served from cache as the primary model's answer
+    assert cache.get(make_key("fallback-model", 0.0, messages, 0)) == '{"fields": []}'
@@ -0,0 +1,147 @@
+import os
+import time
+
+import pytest
+
+from conftest import StubLLM, words
+from extractor.llm_extract import extract_with_llm
+
+DELAY = 0.3
+TOKENS = words("Invoice No: 4711", 20) + words("Total: 12.50", 60)
+ANSWER = {"doc_type": "invoice", "fields": [
+    {"name": "InvoiceNumber", "value": "4711", "source": {"page": 1, "bbox": [40, 20, 200, 40]}},
+]}
+
+
+def test_consistency_runs_are_concurrent():
+    llm = StubLLM(ANSWER, delay=DELAY)
+    start = time.perf_counter()
+    result = extract_with_llm("Invoice No: 4711", TOKENS, ["InvoiceNumber"], n_consistency=3, llm=llm)
+    wall = time.perf_counter() - start
+    assert len(llm.calls) == 3
+    assert len(result["_llm_runs"]) == 3
+    assert wall < 1.6 * DELAY  # about one call, not three
+
+
+def test_sequential_when_max_concurrency_is_one():
+    llm = StubLLM(ANSWER, delay=0.05)
+    start = time.perf_counter()
+    extract_with_llm("", TOKENS, ["InvoiceNumber"], n_consistency=3, llm=llm, max_concurrency=1)
+    assert time.perf_counter() - start >= 3 * 0.05
+
+
+def test_failed_run_is_recorded_and_skipped():
+    llm = StubLLM(ANSWER)
+    calls = []
+
+    def flaky(messages, model=None, temperature=0.0):
+        calls.append(1)
+        if len(calls) == 2:
+            raise RuntimeError("boom")
+        return llm(messages, model=model, temperature=temperature)
+
+    result = extract_with_llm("", TOKENS, ["InvoiceNumber"], n_consistency=3, llm=flaky, max_concurrency=1)
+    assert len(result["_llm_runs"]) == 2
+    assert result["_llm_errors"] == [{"run": 1, "error": "boom"}]
+    assert result["fields"][0]["value"] == "4711"
+
+
+def test_all_runs_failing_raises():
+    def down(messages, model=None, temperature=0.0):
+        raise RuntimeError("down")
+
+    with pytest.raises(RuntimeError, match="All 2 LLM runs failed"):
+        extract_with_llm("", TOKENS, ["InvoiceNumber"], n_consistency=2, llm=down)
+
+
+def test_cache_serves_repeat_documents(tmp_path):
+    from extractor.cache import open_cache
+
+    cache = open_cache(str(tmp_path / "llm.sqlite"))
+    llm = StubLLM(ANSWER)
+    for _ in range(2):
+        extract_with_llm("", TOKENS, ["InvoiceNumber"], n_consistency=3, llm=llm, cache=cache)
+    assert len(llm.calls) == 3
+    assert cache.stats()["hits"] == 3
+
+
+def _answer(value):
+    return {"doc_type": "invoice", "fields": [{"name": "InvoiceNumber", "value": value}]}
+
+
+def test_adaptive_stops_when_first_runs_agree():
+    llm = StubLLM(ANSWER)
+    result = extract_with_llm("", TOKENS, ["InvoiceNumber"], n_consistency=1, llm=llm, max_runs=5)
+    assert len(llm.calls) == 2
+    assert result["_llm_adaptive"]["stopped_early"]
+
+
+def test_adaptive_escalates_while_runs_disagree():
+    llm = StubLLM(_answer("4711"), _answer("4717"), _answer("4711"), _answer("4717"))
+    result = extract_with_llm("", TOKENS, ["InvoiceNumber"], n_consistency=1, llm=llm, max_runs=4)
+    assert len(llm.calls) == 4
+    assert result["_llm_adaptive"]["runs"] == 4 and not result["_llm_adaptive"]["stopped_early"]
+    assert result["_llm_adaptive"]["agreement"]["InvoiceNumber"] == 0.5
+
+
+def test_adaptive_needs_two_runs():
+    with pytest.raises(ValueError):
+        extract_with_llm("", TOKENS, ["InvoiceNumber"], llm=StubLLM(ANSWER), max_runs=1)
+
+
+def test_import_does_not_load_numpy():
+    import subprocess
+    import sys
+
+    code = "import sys, extractor.llm_extract; print('numpy' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert out.stdout.strip() == "False"
+
+
+def _run(invoice, total):
+    return {"doc_type": "invoice", "fields": [
+        {"name": "InvoiceNumber", "value": invoice, "source": {"page": 1, "bbox": [40, 20, 200, 40]}},
+        {"name": "Total", "value": total, "source": {"page": 1, "bbox": [40, 60, 160, 80]}},
+    ]}
+
+
+def test_requery_votes_only_on_requeried_fields():
+    from extractor.confidence import field_agreement
+    from extractor.llm_extract import requery_fields
+    from extractor.normalize_result import normalize_extraction
+
+    runs = [_run("4711", "12.50"), _run("4717", "13.50")]
+    result = dict(runs[0], _llm_runs=runs)
+    llm = StubLLM({"fields": [{"name": "InvoiceNumber", "value": "4711",
+                               "source": {"page": 1, "bbox": [40, 20, 200, 40]}}]})
+    requery_fields(result, TOKENS, ["InvoiceNumber"], llm=llm)
+
+    prompt = llm.calls[0][-1]["content"]
+    assert 'EXTRACT FIELDS: ["InvoiceNumber"]' in prompt
+    assert len(result["_llm_runs"]) == 3
+    agreement = field_agreement(result["_llm_runs"], ["InvoiceNumber", "Total"])
+    assert agreement == {"InvoiceNumber": 0.67, "Total": 0.5}  # Total stays disputed
+    fields = {f["name"]: f for f in normalize_extraction(result, TOKENS)["fields"]}
+    assert fields["InvoiceNumber"]["value"] == "4711"
+    assert fields["Total"]["confidence_breakdown"]["llm_agreement"] == 0.5
+
+
+def test_requery_majority_replaces_the_disputed_value():
+    from extractor.llm_extract import requery_fields
+
+    runs = [_run("4717", "12.50"), _run("4711", "12.50")]
+    result = dict(runs[0], _llm_runs=runs)
+    requery_fields(result, TOKENS, ["InvoiceNumber"], llm=StubLLM(_run("4711", "99.00")))
+    values = {f["name"]: f["value"] for f in result["fields"]}
+    assert values == {"InvoiceNumber": "4711", "Total": "12.50"}
+    assert result["_llm_runs"][-1]["_fields"] == ["InvoiceNumber"]
+    assert [f["name"] for f in result["_llm_runs"][-1]["fields"]] == ["InvoiceNumber"]
+
+
+def test_adaptive_field_requery_sends_targeted_runs():
+    llm = StubLLM(_run("4711", "12.50"), _run("4717", "12.50"), _run("4711", "12.50"))
+    result = extract_with_llm("", TOKENS, ["InvoiceNumber", "Total"], llm=llm, max_runs=3, requery="fields")
+    assert len(llm.calls) == 3
+    assert result["_llm_requery"][0]["fields"] == ["InvoiceNumber"]
+    assert result["_llm_adaptive"]["agreement"]["Total"] == 1.0
@@ -0,0 +1,77 @@
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from extractor import metrics
+
+
+def _worker_stage():
+    with metrics.capture() as events:
+        with metrics.stage("worker_stage", items=2):
+            pass
+    return events
+
+
+def test_stage_records_counts_and_errors():
+    with metrics.capture() as events:
+        with metrics.stage("ok_stage", tokens=3) as rec:
+            rec["pages"] = 1
+        with pytest.raises(ValueError):
+            with metrics.stage("bad_stage"):
+                raise ValueError("boom")
+    assert [(e["stage"], e["outcome"]) for e in events] == [("ok_stage", "ok"), ("bad_stage", "error")]
+    assert (events[0]["tokens"], events[0]["pages"]) == (3, 1)
+    assert events[1]["error"] == "ValueError: boom"
+
+
+def test_forked_workers_do_not_inherit_sinks(tmp_path):
+    path = tmp_path / "events.jsonl"
+    sink = metrics.JSONLogSink(str(path))
+    metrics.add_sink(sink)
+    try:
+        ctx = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            events = pool.submit(_worker_stage).result()
+        for ev in events:  # what iter_ocr_pages / batch do with worker events
+            metrics.emit(ev)
+    finally:
+        metrics.remove_sink(sink)
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [ev["stage"] for ev in lines] == ["worker_stage"]
+
+
+def test_memory_sink_summary():
+    sink = metrics.MemorySink()
+    for d, hit in ((0.1, 1), (0.3, 0)):
+        sink.record({"stage": "ocr", "duration_s": d, "outcome": "ok", "ts": 0, "cache_hit": hit})
+    row, = sink.summary()
+    assert (row["calls"], row["total_s"], row["cache_hit_rate"]) == (2, 0.4, 0.5)
+
+
+def test_scoped_sinks_only_see_their_own_context():
+    from concurrent.futures import ThreadPoolExecutor
+    import threading
+
+    barrier = threading.Barrier(2)
+    sinks = {}
+
+    def session(name):
+        sinks[name] = metrics.MemorySink()
+        with metrics.scoped(sinks[name]):
+            barrier.wait()  # both sessions are scoped at the same time
+            with metrics.stage(name):
+                pass
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                pool.submit(metrics.bind(lambda: metrics.emit({"stage": name + "_pool"}))).result()
+        barrier.wait()
+
+    threads = [threading.Thread(target=session, args=(n,)) for n in ("a", "b")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert [ev["stage"] for ev in sinks["a"].events] == ["a", "a_pool"]
+    assert [ev["stage"] for ev in sinks["b"].events] == ["b", "b_pool"]
+    assert not metrics.enabled()
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from extractor import ocr
+
+pdf2image = pytest.importorskip("pdf2image")
+
+
+def test_pdf_is_written_once_per_document(monkeypatch):
+    calls = []
+
+    def convert_from_path(path, dpi, first_page, last_page, grayscale=False):
+        with open(path, "rb") as fh:
+            calls.append((path, fh.read(), first_page))
+        return [f"page {first_page}"]
+
+    monkeypatch.setattr(pdf2image, "convert_from_path", convert_from_path)
+    pages = list(ocr.iter_pdf_pages(b"%PDF-1.4 stub", pages=[1, 2, 3]))
+    assert pages == [(1, "page 1"), (2, "page 2"), (3, "page 3")]
+    assert len({path for path, _, _ in calls}) == 1
+    assert all(data == b"%PDF-1.4 stub" for _, data, _ in calls)
+    assert not os.path.exists(calls[0][0])  # removed once the pages are rendered
+
+
+def test_render_failure_skips_the_page(monkeypatch):
+    def convert_from_path(path, dpi, first_page, last_page, grayscale=False):
+        if first_page == 2:
+            raise RuntimeError("bad page")
+        return [first_page]
+
+    monkeypatch.setattr(pdf2image, "convert_from_path", convert_from_path)
+    assert list(ocr.iter_pdf_pages(b"%PDF", pages=[1, 2, 3])) == [(1, 1), (3, 3)]
+
+
+def test_rendering_is_timed_as_rasterize(monkeypatch):
+    from extractor import metrics
+
+    monkeypatch.setattr(pdf2image, "convert_from_path", lambda path, first_page, **kw: [first_page])
+    with metrics.capture() as events:
+        list(ocr.iter_pdf_pages(b"%PDF", dpi=150, pages=[1, 2]))
+    assert [(ev["stage"], ev["page"], ev["dpi"]) for ev in events] == [("rasterize", 1, 150), ("rasterize", 2, 150)]
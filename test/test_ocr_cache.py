@@ -0,0 +1,28 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from extractor import ocr
+from extractor.tokens import TokenTable
+
+
+def _use_cache_in_worker():
+    cache = ocr.get_ocr_cache()
+    cache.set("from-worker", 1)
+    return ocr._ocr_cache_owner[1] == os.getpid(), len(ocr._forked_caches)
+
+
+def test_forked_worker_reopens_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("OCR_CACHE_PATH", str(tmp_path / "ocr.sqlite"))
+    parent = ocr.get_ocr_cache()
+    assert ocr.get_ocr_cache() is parent
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("fork")) as pool:
+        own, inherited = pool.submit(_use_cache_in_worker).result()
+    assert own and inherited == 1
+    assert parent.get("from-worker") == 1
+
+
+def test_packed_tokens_roundtrip():
+    table = TokenTable(["Total", "12.50"], [0.9, 0.8], [3, 3], [10, 60], [5, 5], [50, 90], [20, 20], [2, 2])
+    back = ocr._unpack_tokens(ocr._pack_tokens(table)).with_page(3)
+    assert back.to_dicts() == table.to_dicts()
@@ -0,0 +1,38 @@
+import re
+
+import pytest
+
+from conftest import words
+from extractor.router import _CLASS_HINTS, _count_all_classes, _count_occurrences, detect_doc_type
+
+TEXTS = [
+    "TAX INVOICE  Invoice No 123  Bill to: ACME  Subtotal 10.00  Balance due 12.00",
+    "Kshema Hospital  Patient ID KMH7417  UHID 55  Admission date 1/2/24  Discharge date 3/2/24  Bill No 9",
+    "Dr. Rao  Rx  Tab Paracetamol 500 mg BID after food  Syrup 5 ml HS",
+    "invoice no invoice number tax invoice patient id patient",
+    "",
+]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_single_pass_counts_match_per_hint_regexes(text):
+    expected = {cls: _count_occurrences(text, hints) for cls, hints in _CLASS_HINTS.items()}
+    assert _count_all_classes(text) == expected
+
+
+@pytest.mark.parametrize("text, label", [
+    (TEXTS[0], "invoice"),
+    (TEXTS[1], "medical_bill"),
+    (TEXTS[2], "prescription"),
+    ("hello world", "invoice"),  # too little evidence: default
+])
+def test_detect_doc_type(text, label):
+    tokens = [t for i, line in enumerate(re.split(r"\s{2,}", text)) for t in words(line, 20 + 30 * i)]
+    assert detect_doc_type(text, tokens)[0] == label
+
+
+def test_token_table_scores_like_dicts():
+    from extractor.tokens import TokenTable
+
+    tokens = words("Rx Tab Amoxicillin 250 mg TID", 20)
+    assert detect_doc_type(TEXTS[2], TokenTable.from_dicts(tokens)) == detect_doc_type(TEXTS[2], tokens)
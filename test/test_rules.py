@@ -0,0 +1,50 @@
+from conftest import StubLLM, words
+from extractor.rules import extract_with_rules
+
+HEADER = words("ACME Traders", 20)
+
+
+def test_value_on_the_label_line():
+    tokens = HEADER + words("Invoice No: 89969473", 60)
+    fields, remaining = extract_with_rules(tokens, ["InvoiceNumber", "VendorName"])
+    assert [(f["name"], f["value"]) for f in fields] == [("InvoiceNumber", "89969473")]
+    assert fields[0]["source"] == {"page": 1, "bbox": [160, 60, 240, 80]}
+    assert remaining == ["VendorName"]
+
+
+def test_value_on_the_next_line():
+    tokens = HEADER + words("Invoice Date", 60) + words("12/03/2024", 85)
+    fields, _ = extract_with_rules(tokens, ["InvoiceDate"])
+    assert fields[0]["value"] == "12/03/2024"
+    assert fields[0]["source"]["bbox"][1] == 85
+
+
+def test_colon_prefixed_value():
+    tokens = HEADER + words("Bill No   :B-4417", 60) + words("Total Amount   :  1,250.00", 100)
+    fields, remaining = extract_with_rules(tokens, ["BillNumber", "TotalAmount"])
+    assert {f["name"]: f["value"] for f in fields} == {"BillNumber": "B-4417", "TotalAmount": "1250.00"}
+    assert remaining == []
+
+
+def test_disagreeing_labels_are_left_to_the_llm():
+    tokens = HEADER + words("Invoice No: 4711", 60) + words("Invoice No: 4712", 140)
+    assert extract_with_rules(tokens, ["InvoiceNumber"]) == ([], ["InvoiceNumber"])
+
+
+def test_low_confidence_value_is_left_to_the_llm():
+    tokens = HEADER + words("Invoice No:", 60) + words("4711", 60, x=160, conf=0.5)
+    assert extract_with_rules(tokens, ["InvoiceNumber"]) == ([], ["InvoiceNumber"])
+
+
+def test_rule_fields_skip_the_llm_and_are_tagged():
+    from extractor.llm_extract import extract_with_llm
+    from extractor.normalize_result import normalize_extraction
+
+    tokens = HEADER + words("Invoice No: 89969473", 60)
+    llm = StubLLM({"doc_type": "invoice", "fields": [{"name": "VendorName", "value": "ACME Traders"}]})
+    raw = extract_with_llm("", tokens, ["InvoiceNumber", "VendorName"], n_consistency=2, llm=llm, rules=True)
+    assert all('EXTRACT FIELDS: ["VendorName"]' in call[-1]["content"] for call in llm.calls)
+    fields = {f["name"]: f for f in normalize_extraction(raw, tokens)["fields"]}
+    assert fields["InvoiceNumber"]["method"] == "rules"
+    assert fields["InvoiceNumber"]["confidence_breakdown"]["llm_agreement"] == 1.0
+    assert "method" not in fields["VendorName"]
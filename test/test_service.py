@@ -0,0 +1,111 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import words
+from extractor import pipeline, service
+from extractor.tokens import TokenTable
+
+TOKENS = words("Invoice No: 4711", 20) + words("Total: 12.50", 60)
+
+
+async def request(app, method, path, body=b"", query=b"", headers=()):
+    """Drive an ASGI app in-process: (status, headers, [body chunks])."""
+    sent = False
+    out = {"chunks": []}
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            await asyncio.sleep(3600)  # no disconnect while the response streams
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(msg):
+        if msg["type"] == "http.response.start":
+            out["status"], out["headers"] = msg["status"], dict(msg.get("headers", []))
+        else:
+            out["chunks"].append(msg.get("body", b""))
+
+    scope = {"type": "http", "method": method, "path": path, "query_string": query,
+             "headers": list(headers)}
+    await app(scope, receive, send)
+    return out["status"], out["headers"], out["chunks"]
+
+
+def stub_llm(messages, model=None, temperature=0.0):
+    # the in-process equivalent of pointing LLM_BASE_URL at `service stub-llm`
+    body = json.dumps({"model": model, "messages": messages}).encode()
+    status, _, chunks = asyncio.run(request(service.stub_llm_app, "POST", "/v1/chat/completions", body))
+    assert status == 200
+    return json.loads(b"".join(chunks))["choices"][0]["message"]["content"]
+
+
+@pytest.fixture
+def fake_ocr(monkeypatch):
+    gate = threading.Event()
+    gate.set()
+
+    def ocr_stage(data, mime_type, workers=None):
+        gate.wait(5)
+        tokens = TokenTable.from_dicts(TOKENS)
+        return {"tokens": tokens, "n_pages": 1, "full_text": tokens.full_text()}
+
+    monkeypatch.setattr(service, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(pipeline, "ocr_stage", ocr_stage)
+    return gate
+
+
+def _submit(app, name="a.pdf"):
+    query = f"fields=InvoiceNumber,TotalAmount&filename={name}".encode()
+    return request(app, "POST", "/jobs", b"%PDF-stub", query=query, headers=[(b"content-type", b"application/pdf")])
+
+
+def test_stub_llm_app_echoes_requested_fields():
+    content = json.loads(stub_llm([{"role": "user", "content": 'EXTRACT FIELDS: ["InvoiceNumber"]'}]))
+    assert [f["name"] for f in content["fields"]] == ["InvoiceNumber"]
+
+
+def test_submit_stream_and_result(fake_ocr):
+    async def scenario():
+        app = service.ExtractionService(ocr_workers=1, llm_workers=1, use_cache=False, n_consistency=1, llm=stub_llm)
+        try:
+            status, _, chunks = await _submit(app)
+            assert status == 202
+            job = json.loads(b"".join(chunks))
+            status, headers, chunks = await asyncio.wait_for(request(app, "GET", job["events_url"]), 10)
+            assert headers[b"content-type"] == b"application/x-ndjson"
+            stages = [json.loads(line)["stage"] for line in b"".join(chunks).decode().splitlines()]
+            status, _, chunks = await request(app, "GET", job["result_url"])
+            return stages, status, json.loads(b"".join(chunks))
+        finally:
+            await app.stop()
+
+    stages, status, result = asyncio.run(scenario())
+    assert stages == ["queued", "ocr_started", "ocr", "route", "llm", "result"]
+    assert status == 200
+    assert [f["name"] for f in result["fields"]] == ["InvoiceNumber", "TotalAmount"]
+
+
+def test_full_queue_is_refused_with_503(fake_ocr):
+    fake_ocr.clear()  # OCR blocks: the first job holds the only worker
+
+    async def scenario():
+        app = service.ExtractionService(ocr_workers=1, llm_workers=1, queue_size=1, use_cache=False, llm=stub_llm)
+        try:
+            first = json.loads(b"".join((await _submit(app, "1.pdf"))[2]))
+            while app.jobs[first["job_id"]].status != "ocr":
+                await asyncio.sleep(0.01)
+            assert (await _submit(app, "2.pdf"))[0] == 202  # waits in the queue
+            status, headers, _ = await _submit(app, "3.pdf")
+            return status, headers
+        finally:
+            fake_ocr.set()
+            await app.stop()
+
+    status, headers = asyncio.run(scenario())
+    assert status == 503
+    assert headers[b"retry-after"] == b"5"
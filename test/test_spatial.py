@@ -0,0 +1,41 @@
+import random
+import time
+
+import pytest
+
+from conftest import words
+from extractor.normalize_result import _parse_source, normalize_extraction
+from extractor.spatial import TokenIndex, intersects
+
+TOKENS = words("Invoice No: 4711", 20) + words("Total: 12.50", 60) + words("Page two", 20, page=2)
+
+
+def test_query_matches_linear_scan():
+    rng = random.Random(0)
+    tokens = [t for y in range(20, 800, 25) for t in words("lorem ipsum dolor sit amet", y, x=rng.randint(0, 300))]
+    index = TokenIndex(tokens)
+    for _ in range(200):
+        x, y = rng.uniform(-50, 600), rng.uniform(-50, 850)
+        rect = [x, y, x + rng.uniform(0, 400), y + rng.uniform(0, 200)]
+        assert index.query(1, rect) == [t for t in tokens if intersects(t["bbox"], rect)]
+
+
+@pytest.mark.parametrize("bbox", [[0, 0, 2e5, 2e5], [0, 0, 1e300, 10], [-float("inf"), 0, float("inf"), 1e9]])
+def test_huge_bbox_is_bounded_by_the_grid(bbox):
+    index = TokenIndex(TOKENS)
+    start = time.perf_counter()
+    hits = index.query(1, bbox)
+    assert time.perf_counter() - start < 0.1
+    assert hits == [t for t in TOKENS if t["page"] == 1 and intersects(t["bbox"], bbox)]
+
+
+def test_nan_bbox_matches_nothing():
+    assert TokenIndex(TOKENS).query(1, [float("nan"), 0, 100, 100]) == []
+
+
+@pytest.mark.parametrize("bbox", [["NaN", 0, 10, 10], [0, 0, "inf", 10], [0, 0, 1e400, 10]])
+def test_non_finite_source_is_missing(bbox):
+    assert _parse_source({"page": 1, "bbox": bbox}) is None
+    raw = {"doc_type": "invoice", "fields": [{"name": "InvoiceNumber", "value": "4711",
+                                              "source": {"page": 1, "bbox": bbox}}]}
+    assert normalize_extraction(raw, TOKENS)["fields"][0]["name"] == "InvoiceNumber"